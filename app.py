@@ -1,17 +1,22 @@
-from flask import Flask, render_template, request, redirect, url_for, send_file, flash, jsonify, send_from_directory, session
+from flask import Flask, Response, render_template, request, redirect, url_for, send_file, flash, jsonify, session, stream_with_context
 import os
 import uuid
 import json
+import hashlib
 import logging
 import subprocess
 import threading
 import time
 from datetime import datetime
-from io import BytesIO
+from io import BytesIO, StringIO
+import csv
 import re
 import tempfile
+import shutil
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from itertools import combinations
-from openpyxl import load_workbook, Workbook
+from openpyxl import Workbook
 from openpyxl.drawing.image import Image as XLImage
 from openpyxl.chart import ScatterChart, Reference, Series
 from openpyxl.chart.marker import Marker
@@ -24,20 +29,58 @@ from PIL import Image as PILImage
 
 
 from nta_utils import (
-    process_csv_to_template,
-    extract_final_titres_openpyxl as extract_final_titres_xlwings,
+    WorkbookPipeline,
+    compiled_template,
+    load_template_workbook,
+    parse_thresholds,
+    titre_label,
     save_template_path,
     load_template_path,
     load_settings,
     save_settings,
-    generate_sigmoid_csv,
-    flag_triplicate_errors,
-    count_errors_from_workbook,
-    validate_csv_mode,
+    write_sigmoid_csv,
+    write_plate_data_csv,
+    triplicate_error_rows,
+    relabel_ic50_lod,
+    shard_sigmoid_csv,
+    merge_ic50_csvs,
+    scan_plate_csv,
+    read_plates,
+    run_options,
+    batch_file_options,
+    check_csv_mode,
     DEFAULT_SETTINGS,
 )
+from r_pool import configure_r_pool, get_r_pool, run_rscript, RCancelled
+from jobs import EventBoard, Job, JobQueue, JobFailed, JobCancelled
+from store import open_store
 
-in_memory_files = {}  # Key: UUID, Value: BytesIO
+STORE_POLL = 2  # seconds between re-reads of a shared store while waiting on another process
+
+
+def _open_result_store(settings):
+    """
+    Store for processed runs and their fitting / comparison results, keyed by
+    UUID and bounded by the store_budget_mb / store_ttl_hours settings.  The
+    NTAWEB_STORE environment variable overrides the store_backend setting
+    with "memory", "sqlite" or the path of a SQLite file; running more than
+    one server process needs a SQLite store.
+    """
+    backend = settings.get("store_backend", DEFAULT_SETTINGS["store_backend"])
+    path = settings.get("store_path") or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "results_store.sqlite3")
+    override = os.environ.get("NTAWEB_STORE", "").strip()
+    if override in ("memory", "sqlite"):
+        backend = override
+    elif override:
+        backend, path = "sqlite", override
+    store = open_store(
+        backend, path,
+        budget_mb=settings.get("store_budget_mb", DEFAULT_SETTINGS["store_budget_mb"]),
+        ttl_hours=settings.get("store_ttl_hours", DEFAULT_SETTINGS["store_ttl_hours"]),
+    )
+    logger.info("STORE    %s", f"SQLite at {path}" if store.shared else "in memory")
+    return store
 
 app = Flask(__name__)
 app.secret_key = "your-secret-key"
@@ -50,6 +93,90 @@ logging.basicConfig(
 )
 logger = logging.getLogger("ntaweb")
 
+# Processed runs and their fitting / comparison results (see _open_result_store)
+in_memory_files = _open_result_store(load_settings())
+
+
+def _configure_r_pool(settings, warm=False):
+    """Apply the r_pool_size / r_pool_max_jobs settings to the shared warm R pool."""
+    try:
+        size = max(0, int(settings.get("r_pool_size", DEFAULT_SETTINGS["r_pool_size"])))
+        max_jobs = max(1, int(settings.get("r_pool_max_jobs", DEFAULT_SETTINGS["r_pool_max_jobs"])))
+    except (TypeError, ValueError):
+        size, max_jobs = DEFAULT_SETTINGS["r_pool_size"], DEFAULT_SETTINGS["r_pool_max_jobs"]
+    return configure_r_pool(size, max_jobs, warm=warm)
+
+
+_configure_r_pool(load_settings(), warm=True)
+
+
+def _configure_store(settings):
+    """Apply the store_budget_mb / store_ttl_hours settings to in_memory_files."""
+    try:
+        budget = max(0, float(settings.get("store_budget_mb", DEFAULT_SETTINGS["store_budget_mb"])))
+        ttl = max(0, float(settings.get("store_ttl_hours", DEFAULT_SETTINGS["store_ttl_hours"])))
+    except (TypeError, ValueError):
+        budget, ttl = DEFAULT_SETTINGS["store_budget_mb"], DEFAULT_SETTINGS["store_ttl_hours"]
+    in_memory_files.configure(budget, ttl)
+
+
+def _missing(key, message):
+    """message for an ID that is not in memory, unless its results were dropped to save memory."""
+    reason = in_memory_files.gone_reason(key) if key else None
+    if reason == "expired":
+        return (f"These results expired after {in_memory_files.ttl / 3600:g} h unused. "
+                "Please process your data again.")
+    if reason == "evicted":
+        return "These results were cleared to free server memory. Please process your data again."
+    return message
+
+
+def _holding(fn, *keys):
+    """Wrap a job body so the given in_memory_files entries can't be evicted while it runs."""
+    def body(job, *args, **kwargs):
+        with in_memory_files.hold(*keys):
+            return fn(job, *args, **kwargs)
+    return body
+
+
+# Stage updates for runs and jobs; waiters block on this instead of sleep-polling
+events = EventBoard()
+
+
+def _record_job(job):
+    """Mirror a job's state into a shared store, so every server process can show (and cancel) it."""
+    if in_memory_files.shared:
+        in_memory_files.update(job.id, {"type": "job", "job": job.snapshot()}, create=True)
+
+
+def _find_job(job_id):
+    """The job from this process's queue or, with a shared store, as recorded by another process."""
+    job = job_queue.get(job_id)
+    if job is None and in_memory_files.shared:
+        entry = in_memory_files.get(job_id)
+        if entry and entry.get("type") == "job":
+            job = Job.from_snapshot(entry["job"])
+    return job
+
+
+def _watch_shared_cancels():
+    """Cancel this process's jobs when another process was asked to (shared store only)."""
+    while True:
+        time.sleep(STORE_POLL)
+        try:
+            for job in job_queue.active_jobs():
+                entry = in_memory_files.get(job.id)
+                if entry and entry.get("cancel_requested"):
+                    job_queue.cancel(job.id)
+        except Exception:
+            logger.exception("JOB      cancel watcher failed")
+
+
+# Curve fitting and titre comparison run here, never inside a request
+job_queue = JobQueue(workers=load_settings().get("job_workers", DEFAULT_SETTINGS["job_workers"]),
+                     events=events, record=_record_job)
+if in_memory_files.shared:
+    threading.Thread(target=_watch_shared_cancels, name="cancel-watch", daemon=True).start()
 
 
 @app.route("/")
@@ -123,11 +250,38 @@ def settings():
         except ValueError:
             new_settings["sigmoid_r2_threshold"] = 0.5
         new_settings["lod_censor_include"] = request.form.get("lod_censor_include") == "on"
+        try:
+            new_settings["fitting_workers"] = max(1, int(request.form.get("fitting_workers", 1)))
+        except ValueError:
+            new_settings["fitting_workers"] = 1
+        try:
+            new_settings["plot_workers"] = max(1, int(request.form.get("plot_workers", 2)))
+        except ValueError:
+            new_settings["plot_workers"] = 2
+        try:
+            new_settings["batch_workers"] = max(1, int(request.form.get("batch_workers", 2)))
+        except ValueError:
+            new_settings["batch_workers"] = 2
+        new_settings["optimise_plot_images"] = request.form.get("optimise_plot_images") == "on"
+        try:
+            new_settings["r_pool_size"] = max(0, int(request.form.get("r_pool_size", 2)))
+        except ValueError:
+            new_settings["r_pool_size"] = 2
+        try:
+            new_settings["store_budget_mb"] = max(0, int(request.form.get("store_budget_mb", 256)))
+        except ValueError:
+            new_settings["store_budget_mb"] = 256
+        try:
+            new_settings["store_ttl_hours"] = max(0, float(request.form.get("store_ttl_hours", 6)))
+        except ValueError:
+            new_settings["store_ttl_hours"] = 6
         try:
             new_settings["comparison_disagreement_threshold"] = float(request.form.get("comparison_disagreement_threshold", 1.0))
         except ValueError:
             new_settings["comparison_disagreement_threshold"] = 1.0
         save_settings(new_settings)
+        _configure_r_pool(new_settings, warm=True)
+        _configure_store(new_settings)
         flash("Settings saved.", "success")
         return redirect(url_for("settings"))
 
@@ -143,11 +297,16 @@ def reset_settings():
     reset_keys = [
         "timestamp_in_filename", "error_flagging", "default_data_mode",
         "default_num_pseudotypes", "outlier_threshold_log2",
-        "sigmoid_r2_threshold", "lod_censor_include", "comparison_disagreement_threshold",
+        "sigmoid_r2_threshold", "lod_censor_include",
+        "fitting_workers", "plot_workers", "batch_workers", "optimise_plot_images", "r_pool_size", "r_pool_max_jobs", "job_workers",
+        "store_budget_mb", "store_ttl_hours",
+        "comparison_disagreement_threshold",
     ]
     for key in reset_keys:
         current[key] = DEFAULT_SETTINGS[key]
     save_settings(current)
+    _configure_r_pool(current)
+    _configure_store(current)
     flash("Settings reset to defaults.", "success")
     return redirect(url_for("settings"))
 
@@ -181,170 +340,323 @@ def save_template_selection():
     return redirect(url_for("settings"))
 
 
-def _run_r_in_background(file_id, excel_path, output_plot_path, r_cmd):
-    """Run process_data.R in a background thread, then embed plots into the stored Excel."""
-    try:
-        subprocess.run(r_cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        logger.info("R SCRIPT (background) complete for %s", file_id)
+def _mark_plots_ready(file_id, ok, **fields):
+    """Flag a run's plots as settled (stored, or given up on), storing `fields` with the flag, and wake anyone waiting on them."""
+    in_memory_files.update(file_id, {"plots_ready": True, **fields})
+    events.publish(file_id, "plots", {"ready": True, "ok": ok})
 
-        with open(output_plot_path, "rb") as f:
-            summary_plot_bytes = f.read()
-
-        # Embed plots into the stored Excel bytes
-        file_info = in_memory_files.get(file_id)
-        if file_info:
-            wb = load_workbook(BytesIO(file_info["data"]))
-            ws_summary = wb.create_sheet("Summary Plots")
-            ws_summary.add_image(XLImage(output_plot_path), "A1")
-
-            plate_dir = os.path.dirname(output_plot_path)
-            _plates_embedded = 0
-            for sheet_name in wb.sheetnames:
-                if not sheet_name.startswith("Plate"):
-                    continue
-                plate_png = os.path.join(plate_dir, f"{sheet_name}.png")
-                if os.path.exists(plate_png):
-                    ws_plate = wb[sheet_name]
-                    temp_png = os.path.join(plate_dir, f"temp_{sheet_name}.png")
-                    PILImage.open(plate_png).save(temp_png, "PNG")
-                    img_plate = XLImage(temp_png)
-                    img_plate.anchor = "B33"
-                    ws_plate.add_image(img_plate)
-                    _plates_embedded += 1
-            logger.info("IMAGES   (background) %d plate PNG(s) embedded", _plates_embedded)
 
+def _wait_for_plots(file_id, timeout):
+    """
+    The run's entry once its plots are settled, or as it stands after
+    `timeout` seconds (None if the run is gone).  Woken by the "plots" event
+    when R ran in this process; a shared store is also re-read every
+    STORE_POLL seconds in case it ran in another.
+    """
+    deadline = time.time() + timeout
+    while True:
+        seq = events.latest_seq(file_id)
+        info = in_memory_files.get(file_id)
+        remaining = deadline - time.time()
+        if info is None or info.get("plots_ready") or remaining <= 0:
+            return info
+        if in_memory_files.shared:
+            remaining = min(remaining, STORE_POLL)
+        events.since(file_id, seq, timeout=remaining)
+
+
+def _plate_plot_key(file_id, plate):
+    return f"plate_plot:{file_id}:{plate}"
+
+
+def _plot_units(plates, workers):
+    """
+    Split process_data.R's output into independent renders (trailing
+    arguments): one per plate when warm R workers make a call cheap,
+    otherwise `workers` contiguous shares of the plates.  The first plate(s)
+    go first so the gallery starts filling at once, then the summary plot.
+    """
+    if get_r_pool().available:
+        shares = [[plate] for plate in plates]
+    else:
+        size = -(-len(plates) // max(1, workers))
+        shares = [plates[k:k + size] for k in range(0, len(plates), size)]
+    units = [["plates", *share] for share in shares]
+    units.insert(1, ["summary"])
+    return units
+
+
+def _store_plate_plot(file_id, plate, png_path):
+    """
+    Store one plate's PNG under its own key and tell the run's watchers it is
+    there.  Its excel_file_id makes it part of the run's family in the
+    store: kept while the run is, and evicted with it.
+    """
+    if not os.path.exists(png_path):
+        return
+    with open(png_path, "rb") as f:
+        png_bytes = f.read()
+    in_memory_files[_plate_plot_key(file_id, plate)] = {
+        "type": "plate_plot", "excel_file_id": file_id, "png": png_bytes,
+    }
+    events.publish(file_id, "plate", {"plate": plate})
+
+
+def _plot_image(png_bytes, optimise=False):
+    """
+    (XLImage, stats) for one plot PNG.  openpyxl is handed the PNG bytes as
+    they are (no decode/re-encode); with `optimise` they are first quantised
+    to a 256-colour palette, which is kept only if it is smaller.
+    stats: {"bytes": original size, "saved": bytes saved, "seconds": time spent}
+    """
+    _t = time.time()
+    original = len(png_bytes)
+    if optimise:
+        with PILImage.open(BytesIO(png_bytes)) as img:
             out = BytesIO()
-            wb.save(out)
-            file_info["data"] = out.getvalue()
-            file_info["summary_plot"] = summary_plot_bytes
-            file_info["plots_ready"] = True
-            logger.info("PLOTS    stored for %s", file_id)
+            img.convert("RGBA").quantize(256, method=PILImage.Quantize.FASTOCTREE).save(
+                out, "PNG", optimize=True)
+        if out.tell() < original:
+            png_bytes = out.getvalue()
+    stats = {"bytes": original, "saved": original - len(png_bytes), "seconds": time.time() - _t}
+    return XLImage(BytesIO(png_bytes)), stats
+
+
+def _embed_plots(wb, summary_png, plate_pngs, optimise=False, workers=1):
+    """
+    Add the summary plot (on a new "Summary Plots" sheet) and each plate's
+    plot (below its data, at B33) to wb.  plate_pngs: {sheet name: PNG bytes}.
+    The plate images are prepared on `workers` threads; see _plot_image.
+    """
+    _t = time.time()
+    ws_summary = wb.create_sheet("Summary Plots")
+    ws_summary.add_image(XLImage(BytesIO(summary_png)), "A1")
+
+    names = list(plate_pngs)
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(names) or 1))) as pool:
+        prepared = list(pool.map(lambda name: _plot_image(plate_pngs[name], optimise), names))
+
+    saved = 0
+    for name, (img_plate, stats) in zip(names, prepared):
+        img_plate.anchor = "B33"
+        wb[name].add_image(img_plate)
+        saved += stats["saved"]
+        logger.debug("IMAGES   %s %.1f KB (%.1f KB saved) in %.3fs",
+                     name, stats["bytes"] / 1024, stats["saved"] / 1024, stats["seconds"])
+    logger.info("IMAGES   %d plate PNG(s) embedded in %.2fs (%.1f KB saved)",
+                len(names), time.time() - _t, saved / 1024)
+
+
+def _run_r_in_background(file_id, plot_dir, plate_data_path, output_plot_path, r_cmd, plates, workers=1):
+    """
+    Run process_data.R in a background thread, storing the plots for the run.
+    The summary and plate plots are rendered as separate R calls, up to
+    `workers` at a time (see _plot_units); each plate PNG is stored as soon
+    as its call returns, so /plate_plot can serve it before the rest are done.
+    The xlsx export embeds them when it is built (_export_workbook).
+    """
+    try:
+        units = _plot_units(plates, workers)
+        _t = time.time()
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(units)))) as pool:
+            futures = {pool.submit(run_rscript, r_cmd + unit): unit for unit in units}
+            # result() re-raises the first failure; leaving the block waits for the rest
+            for future in as_completed(futures):
+                future.result()
+                unit = futures[future]
+                if unit[0] == "summary":
+                    with open(output_plot_path, "rb") as f:
+                        in_memory_files.update(file_id, {"summary_plot": f.read()})
+                    continue
+                for plate in unit[1:]:
+                    _store_plate_plot(file_id, plate, os.path.join(plot_dir, f"{plate}.png"))
+        logger.info("R SCRIPT (background) complete for %s: %d render(s) in %.1fs",
+                    file_id, len(units), time.time() - _t)
+        logger.info("PLOTS    stored for %s", file_id)
+        _mark_plots_ready(file_id, ok=True)
     except Exception:
         logger.exception("R SCRIPT (background) failed for %s", file_id)
-        if file_id in in_memory_files:
-            in_memory_files[file_id]["plots_ready"] = True  # stop polling, fall back to on-demand
+        _mark_plots_ready(file_id, ok=False)  # stop waiting, fall back to on-demand
     finally:
-        try:
-            os.remove(excel_path)
-        except OSError:
-            pass
-        try:
-            os.remove(output_plot_path)
-        except OSError:
-            pass
-        plate_dir = os.path.dirname(output_plot_path)
-        for f in os.listdir(plate_dir):
-            if f.endswith(".png"):
-                try:
-                    os.remove(os.path.join(plate_dir, f))
-                except OSError:
-                    pass
+        shutil.rmtree(plot_dir, ignore_errors=True)
 
 
-@app.route("/process", methods=["POST"])
-def process():
-    file = request.files["csv_file"]
-    if not file:
-        flash("No CSV file uploaded.", "danger")
-        return redirect(url_for("index"))
+def _export_workbook(file_id, file_info, out):
+    """
+    Build the run's xlsx from its stored Run, template and plots and write
+    it to the file object `out`: Plate sheets, Data Summary (with defaults),
+    Errors sheet when flagging was on at /process, then the plot images.
+    """
+    _t = time.time()
+    run = _get_run(file_info)
+    options = file_info.get("export") or {}
+    pipeline = WorkbookPipeline.for_run(run).export(file_info["template"]).finish(
+        error_flagging=options.get("error_flagging"),
+        threshold_log2=options.get("outlier_threshold_log2", 1.0),
+    )
 
-    assay_title = request.form.get("assay_title", "")
-    pseudotypes = request.form.get("pseudotype_text", "").strip()
-    sample_ids = request.form.get("sample_id_text", "")
-    data_mode = request.form.get("data_mode", "standard")
+    summary_png = file_info.get("summary_plot")
+    if summary_png:
+        plate_pngs = {}
+        for name in run.names:
+            entry = in_memory_files.get(_plate_plot_key(file_id, name))
+            if entry is not None:
+                plate_pngs[name] = entry["png"]
+        missing = [name for name in run.names if name not in plate_pngs]
+        if missing:
+            logger.warning("EXPORT   %s has no plot for %s (%s); exported without", file_id[:8],
+                           ", ".join(missing), "not rendered" if file_info.get("plots_ready") else "still rendering")
+        settings = load_settings()
+        _embed_plots(pipeline.wb, summary_png, plate_pngs,
+                     optimise=settings.get("optimise_plot_images", False),
+                     workers=_worker_setting(settings, "plot_workers", 2))
 
-    if data_mode not in ("data_only", "standard"):
-        data_mode = "standard"
+    pipeline.save(out)
+    logger.info("EXPORT   %s workbook built in %.1fs (serialised in %.1fs)",
+                file_id[:8], time.time() - _t, pipeline.timings["save"])
 
-    if not pseudotypes:
-        flash("Please enter at least one pseudotype name.", "danger")
-        return redirect(url_for("index"))
 
-    raw_np = request.form.get("num_pseudotypes", "1")
-    if raw_np == "2alt":
-        num_pseudotypes = "2alt"
-    else:
-        try:
-            num_pseudotypes = int(raw_np)
-            if num_pseudotypes not in [1, 2, 3, 4]:
-                raise ValueError()
-        except ValueError:
-            flash("Invalid pseudotype count. Must be 1–4.", "danger")
-            return redirect(url_for("index"))
+# Settings that change what /process produces (the workbook or its R plots)
+UPLOAD_KEY_SETTINGS = ("timestamp_in_filename", "error_flagging", "outlier_threshold_log2", "quadrants")
 
-    # Per-plate config (optional — sent as JSON when custom per-plate mode is active)
-    plate_configs = None
-    raw_pc = request.form.get("plate_configs", "").strip()
-    if raw_pc:
-        try:
-            plate_configs = json.loads(raw_pc)
-            if not isinstance(plate_configs, list):
-                plate_configs = None
-        except (ValueError, TypeError):
-            plate_configs = None
 
-    settings = load_settings()
-    safe_title = assay_title.strip().replace(" ", "_")
-    timestamp = datetime.now().strftime("%Y-%m-%d")
-    filename = f"{safe_title}_{timestamp}.xlsx" if settings.get("timestamp_in_filename", True) else f"{safe_title}.xlsx"
+def _upload_key(csv_data, template_path, form, settings):
+    """
+    Content hash of everything a processed run is built from: the CSV bytes,
+    the template workbook, the labelling inputs and the settings above
+    (plus the selected colour preset, used by the R plots).
+    """
+    digest = hashlib.sha256(csv_data)
+    digest.update(bytes.fromhex(compiled_template(template_path).sha))
+    relevant = {key: settings.get(key) for key in UPLOAD_KEY_SETTINGS}
+    relevant["colours"] = settings.get("presets", {}).get(settings.get("selected_preset"))
+    digest.update(json.dumps({"form": form, "settings": relevant}, sort_keys=True).encode())
+    return "upload:" + digest.hexdigest()
 
-    csv_bytes = BytesIO(file.read())
-    csv_bytes.seek(0)
 
-    try:
-        template_path = load_template_path()
-    except Exception as e:
-        flash(str(e), "danger")
-        return redirect(url_for("index"))
+def _find_upload(upload_key):
+    """file_id of a stored run built from identical inputs, or None."""
+    entry = in_memory_files.get(upload_key)
+    file_id = entry.get("excel_file_id") if entry else None
+    return file_id if file_id and file_id in in_memory_files else None
 
-    csv_size_kb = round(csv_bytes.getbuffer().nbytes / 1024, 1)
-    logger.info("PROCESS  \u2190 %r  mode=%s  pseudotypes=%s", assay_title, data_mode, pseudotypes.replace("\n", ","))
-    logger.info("CSV      read %.1f KB", csv_size_kb)
 
-    _proc_start = time.time()
-    _t = time.time()
-    output_bytes = BytesIO()
-    process_csv_to_template(
-        csv_path=csv_bytes,
-        template_path=template_path,
-        output_path=output_bytes,
-        num_pseudotypes=num_pseudotypes,
-        pseudotype_texts=pseudotypes,
-        assay_title_text=assay_title,
-        sample_id_text=sample_ids,
-        data_mode=data_mode,
-        plate_configs=plate_configs,
-    )
-    logger.info("EXCEL    workbook built in %.1fs", time.time() - _t)
+STAGED_UPLOAD_TTL = 600   # seconds a validated upload stays available to /process
 
-    _t = time.time()
-    extract_final_titres_xlwings(output_bytes)
 
-    from nta_utils import add_default_to_final_titres
-    add_default_to_final_titres(output_bytes)
-    logger.info("EXTRACT  final titres written in %.1fs", time.time() - _t)
+def _staged_key(token):
+    return f"staged:{token}"
+
+
+def _stage_upload(csv_bytes, filename, detected, parsed):
+    """
+    Keep a validated upload for STAGED_UPLOAD_TTL seconds so /process can use
+    it without a second transfer.  parsed: {data mode: (PlateBlocks, diagnostics)}.
+    Returns the token.
+    """
+    token = uuid.uuid4().hex
+    in_memory_files[_staged_key(token)] = {
+        "type": "staged_upload", "csv": csv_bytes, "name": filename, "detected": detected,
+        "parsed": parsed, "expires": time.time() + STAGED_UPLOAD_TTL,
+    }
+    return token
+
+
+def _staged_upload(token):
+    """The staged upload for token, or None once it has expired."""
+    if not re.fullmatch(r"[0-9a-f]{32}", token or ""):
+        return None
+    entry = in_memory_files.get(_staged_key(token))
+    if entry is None or entry["expires"] < time.time():
+        in_memory_files.pop(_staged_key(token), None)
+        return None
+    return entry
+
+
+def _staged_blocks(token, staged, data_mode):
+    """(PlateBlocks, diagnostics) of a staged upload read as data_mode, parsing (once) if needed."""
+    parsed = staged["parsed"].get(data_mode)
+    if parsed is None:
+        blocks, scan = scan_plate_csv(BytesIO(staged["csv"]), data_mode)
+        parsed = (blocks, scan.diagnostics)
+        in_memory_files.update(_staged_key(token), {"parsed": {**staged["parsed"], data_mode: parsed}})
+    return parsed
+
+
+def _results_filename(assay_title, settings):
+    safe_title = assay_title.strip().replace(" ", "_")
+    timestamp = datetime.now().strftime("%Y-%m-%d")
+    return f"{safe_title}_{timestamp}.xlsx" if settings.get("timestamp_in_filename", True) else f"{safe_title}.xlsx"
+
+
+def _start_run(csv_data, options, template_path, settings, blocks=None):
+    """
+    Build and store the Run for one CSV upload (see /process): titres and
+    error counts only, the xlsx being exported on first download.
+    Returns (file_id, reused) — reused when an identical upload was already
+    stored, in which case nothing is rebuilt.  blocks: already parsed
+    PlateBlocks (a staged upload).  The R plots are not started here
+    (see _plot_job_args).
+    """
+    filename = _results_filename(options["assay_title"], settings)
+    # An identical upload (same CSV, template, labels and settings) reuses the stored run
+    upload_key = _upload_key(csv_data, template_path, {
+        "filename": filename, "assay_title": options["assay_title"],
+        "pseudotypes": options["pseudotypes"], "sample_ids": options["sample_ids"],
+        "data_mode": options["data_mode"], "num_pseudotypes": options["num_pseudotypes"],
+        "plate_configs": options["plate_configs"],
+    }, settings)
+    existing_id = _find_upload(upload_key)
+    if existing_id:
+        logger.info("DEDUP    identical upload, reusing %s", existing_id)
+        return existing_id, True
+
+    # Only the Run is built here; the xlsx is exported on first download (_export_workbook)
+    pipeline = WorkbookPipeline()
+    pipeline.load(
+        csv_path=BytesIO(csv_data),
+        template_path=template_path,
+        num_pseudotypes=options["num_pseudotypes"],
+        pseudotype_texts=options["pseudotypes"],
+        assay_title_text=options["assay_title"],
+        sample_id_text=options["sample_ids"],
+        data_mode=options["data_mode"],
+        plate_configs=options["plate_configs"],
+        blocks=blocks,
+    )
+    logger.info("RUN      %d plate(s) parsed in %.1fs, titres in %.1fs (%.1f KB held as arrays)",
+                len(pipeline.run), pipeline.timings["load"], pipeline.timings["titres"],
+                pipeline.run.nbytes / 1024)
 
     # ── Error flagging (if enabled in settings) ──
-    if settings.get("error_flagging", False):
-        _t = time.time()
-        flag_triplicate_errors(output_bytes, threshold_log2=settings.get("outlier_threshold_log2", 1.0))
-        from nta_utils import count_errors_from_workbook
-        _err_count, _ = count_errors_from_workbook(output_bytes.getvalue())
-        logger.info("FLAGS    error flagging complete in %.1fs (%d flagged)", time.time() - _t, _err_count)
+    error_flagging = bool(settings.get("error_flagging", False))
+    threshold_log2 = settings.get("outlier_threshold_log2", 1.0)
+    if error_flagging:
+        pipeline.check_errors(threshold_log2=threshold_log2)
+        logger.info("FLAGS    error flagging complete in %.1fs (%d flagged)",
+                    pipeline.timings["flags"], pipeline.error_count)
     else:
         logger.info("FLAGS    disabled")
 
-    # Store Excel immediately (no plots yet) so we can respond without waiting for R
     file_id = uuid.uuid4().hex
     in_memory_files[file_id] = {
-        "data": output_bytes.getvalue(),
+        "data": None,   # the xlsx, exported and cached on first download
         "name": filename,
+        "run": pipeline.run,
+        "template": compiled_template(template_path).data,
+        "export": {"error_flagging": error_flagging, "outlier_threshold_log2": threshold_log2},
         "summary_plot": None,
         "plots_ready": False,
     }
-    session["file_id"] = file_id
+    in_memory_files[upload_key] = {"type": "upload", "excel_file_id": file_id}
+    return file_id, False
+
 
-    # Build R command args \u2014 R runs in background so temp files must persist until it finishes
+def _plot_job_args(file_id, run, filename, settings):
+    """
+    Arguments for _run_r_in_background() to draw a run's plots; writes the
+    plate data hand-off into a new temp directory, which that removes.
+    """
     r_script = os.path.join(os.getcwd(), "process_data.R")
     presets = settings.get("presets", {})
     active_preset_name = settings.get("selected_preset", None)
@@ -364,41 +676,450 @@ def process():
 
     plot_title = os.path.splitext(filename)[0]
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp_excel:
-        tmp_excel.write(output_bytes.getvalue())
-        excel_path = tmp_excel.name
+    # Plate PNGs are written next to the summary plot, so each run gets its own directory
+    plot_dir = tempfile.mkdtemp(prefix="plots_")
+    plate_data_path = os.path.join(plot_dir, "plateData.csv")
+    write_plate_data_csv(run, plate_data_path)
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp_png:
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".png", prefix="summary_", dir=plot_dir) as tmp_png:
         output_plot_path = tmp_png.name
 
     r_cmd = [
         "Rscript", r_script,
-        excel_path, output_plot_path,
+        plate_data_path, output_plot_path,
         str(settings.get("timestamp_in_filename", True)).lower(),
         q1_colour, q2_colour, q3_colour, q4_colour,
         plot_title,
         q1_flag, q2_flag, q3_flag, q4_flag,
     ]
+    return (file_id, plot_dir, plate_data_path, output_plot_path, r_cmd,
+            list(run.names), _worker_setting(settings, "plot_workers", 2))
+
+
+@app.route("/process", methods=["POST"])
+def process():
+    # A staged upload (see /validate_csv_mode) stands in for the file
+    upload_token = request.form.get("upload_token", "")
+    staged = _staged_upload(upload_token) if upload_token else None
+    file = request.files.get("csv_file")
+    if staged is None and not file:
+        flash("The uploaded CSV has expired. Please choose the file again." if upload_token
+              else "No CSV file uploaded.", "danger")
+        return redirect(url_for("index"))
+
+    try:
+        options = run_options(request.form)
+    except ValueError as e:
+        flash(str(e), "danger")
+        return redirect(url_for("index"))
+
+    settings = load_settings()
+
+    blocks = None
+    if staged is not None and not file:
+        csv_data = staged["csv"]
+        blocks, _ = _staged_blocks(upload_token, staged, options["data_mode"])
+    else:
+        csv_data = file.read()
+
+    try:
+        template_path = load_template_path()
+    except Exception as e:
+        flash(str(e), "danger")
+        return redirect(url_for("index"))
+
+    csv_size_kb = round(len(csv_data) / 1024, 1)
+    logger.info("PROCESS  ← %r  mode=%s  pseudotypes=%s", options["assay_title"], options["data_mode"],
+                options["pseudotypes"].replace("\n", ","))
+    if blocks is not None:
+        logger.info("CSV      staged upload %s (%.1f KB, %d plate(s) already parsed)",
+                    upload_token[:8], csv_size_kb, len(blocks))
+    else:
+        logger.info("CSV      read %.1f KB", csv_size_kb)
 
+    _proc_start = time.time()
+    file_id, reused = _start_run(csv_data, options, template_path, settings, blocks=blocks)
+    if staged is not None:
+        # Used up: the run is stored, so the staged copy would only take up room
+        in_memory_files.pop(_staged_key(upload_token), None)
+    file_info = in_memory_files[file_id]
+    session["file_id"] = file_id
+    if reused:
+        flash("Identical upload: showing the results already processed for it.", "info")
+        return render_template(
+            "analysis_hub.html",
+            excel_file_id=file_id,
+            filename=file_info.get("name"),
+            processing_time=round(time.time() - _proc_start, 1),
+            fitting_id=file_info.get("fitting_id"),
+            comparison_id=file_info.get("comparison_id"),
+            settings=load_settings(),
+        )
+
+    # R runs in background so its temp files persist until it finishes
     logger.info("R SCRIPT launching in background for %s", file_id)
     threading.Thread(
         target=_run_r_in_background,
-        args=(file_id, excel_path, output_plot_path, r_cmd),
+        args=_plot_job_args(file_id, file_info["run"], file_info["name"], settings),
         daemon=True,
     ).start()
 
     _proc_elapsed = round(time.time() - _proc_start, 1)
-    logger.info("DONE     \u2713 %r ready (plots pending) \u00b7 %.1fs", filename, _proc_elapsed)
+    logger.info("DONE     ✓ %r ready (plots pending) · %.1fs", file_info["name"], _proc_elapsed)
     return render_template(
         "analysis_hub.html",
         excel_file_id=file_id,
-        filename=filename,
+        filename=file_info["name"],
         processing_time=_proc_elapsed,
         fitting_id=None,
         settings=load_settings(),
     )
 
 
+# ════════════════════════════════════════════════════════════════
+# Batch processing — many CSVs (or a zip of them) in one submission
+# ════════════════════════════════════════════════════════════════
+
+BATCH_MAX_FILES = 200
+BATCH_ACTIVE_STATUSES = ("queued", "processing")
+_batch_lock = threading.Lock()   # serialises updates to a batch's file list
+
+
+def _unique_name(name, used):
+    """name, or "stem (2).ext", "stem (3).ext"… if already in the set `used` (which it is added to)."""
+    stem, ext = os.path.splitext(name)
+    candidate, n = name, 1
+    while candidate in used:
+        n += 1
+        candidate = f"{stem} ({n}){ext}"
+    used.add(candidate)
+    return candidate
+
+
+def _batch_uploads(files):
+    """
+    [(name, CSV bytes)] for the uploaded files, each .zip expanded into the
+    .csv files it contains.  Names are made unique so every file keeps its
+    own row and labels; raises ValueError for an unreadable zip.
+    """
+    uploads, used = [], set()
+    limit = app.config["MAX_CONTENT_LENGTH"]
+    for file in files:
+        if not file or not file.filename:
+            continue
+        name = os.path.basename(file.filename)
+        data = file.read()
+        if not name.lower().endswith(".zip"):
+            uploads.append((_unique_name(name, used), data))
+            continue
+        try:
+            with zipfile.ZipFile(BytesIO(data)) as zf:
+                for member in zf.infolist():
+                    member_name = os.path.basename(member.filename)
+                    if (member.is_dir() or member.filename.startswith("__MACOSX/")
+                            or member_name.startswith(".") or not member_name.lower().endswith(".csv")):
+                        continue
+                    if member.file_size > limit:
+                        raise ValueError(f"{member_name} in {name} is larger than the upload limit.")
+                    uploads.append((_unique_name(member_name, used), zf.read(member)))
+        except zipfile.BadZipFile:
+            raise ValueError(f"{name} is not a valid zip file.")
+    return uploads
+
+
+def _set_batch_file(batch_id, index, **fields):
+    """Update one file's row of a batch and wake the batch hub."""
+    with _batch_lock:
+        entry = in_memory_files.get(batch_id)
+        if entry is None:
+            return
+        files = [dict(f) for f in entry["files"]]
+        files[index].update(fields)
+        in_memory_files.update(batch_id, {"files": files})
+    events.publish(batch_id, "batch", {"index": index, "status": files[index]["status"]})
+
+
+def _process_batch_file(job, batch_id, index, name, csv_data, options, template_path, settings, plot_pool):
+    """
+    One file of a batch: parse and store the run (_start_run), recording
+    each step in the file's row, then hand its R plots to plot_pool.  The
+    row is done once the run is stored, as /process shows the hub before
+    the plots are drawn.  A failure is recorded there rather than raised,
+    so the rest of the batch carries on.
+    """
+    if job.cancel_event.is_set():
+        _set_batch_file(batch_id, index, status="cancelled")
+        return "cancelled"
+    _t = time.time()
+    _set_batch_file(batch_id, index, status="processing")
+    try:
+        blocks, data_mode = read_plates(csv_data, options["data_mode"],
+                                        settings.get("default_data_mode", "standard"))
+        file_id, reused = _start_run(csv_data, dict(options, data_mode=data_mode),
+                                     template_path, settings, blocks=blocks)
+        file_info = in_memory_files[file_id]
+        if not reused:
+            plot_pool.submit(_run_r_in_background,
+                             *_plot_job_args(file_id, file_info["run"], file_info["name"], settings))
+    except Exception as e:
+        if isinstance(e, ValueError):
+            logger.warning("BATCH    %s %s failed: %s", batch_id[:8], name, e)
+        else:
+            logger.exception("BATCH    %s %s failed", batch_id[:8], name)
+        _set_batch_file(batch_id, index, status="failed", error=str(e) or e.__class__.__name__,
+                        seconds=round(time.time() - _t, 1))
+        return "failed"
+    _set_batch_file(batch_id, index, status="done", file_id=file_id, workbook=file_info["name"],
+                    plates=len(file_info["run"]), data_mode=data_mode, seconds=round(time.time() - _t, 1))
+    logger.info("BATCH    %s %s done in %.1fs", batch_id[:8], name, time.time() - _t)
+    return "done"
+
+
+def _run_batch(job, batch_id, uploads, options, template_path, settings):
+    """
+    Job body for a batch: every (name, CSV bytes) in uploads through
+    _process_batch_file, batch_workers files at a time.  The files share
+    this process's compiled template cache and warm R pool.
+
+    Plots are drawn batch_workers runs at a time on a pool of their own
+    that outlives the job, so the batch gives its job slot back once every
+    run is stored and fitting/comparison jobs don't queue behind R plots.
+    """
+    total = len(uploads)
+    outcomes = {"done": 0, "failed": 0, "cancelled": 0}
+    workers = max(1, min(_worker_setting(settings, "batch_workers", 2), total))
+    job.set_stage(f"0 of {total} file(s) processed", 0)
+    plot_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch-plots")
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch") as pool:
+            futures = [
+                pool.submit(_process_batch_file, job, batch_id, index, name, csv_data,
+                            options[index], template_path, settings, plot_pool)
+                for index, (name, csv_data) in enumerate(uploads)
+            ]
+            for finished, future in enumerate(as_completed(futures), 1):
+                outcomes[future.result()] += 1
+                job.set_stage(f"{finished} of {total} file(s) processed", finished / total)
+    finally:
+        # Plots already handed over are still drawn
+        plot_pool.shutdown(wait=False)
+    if not outcomes["done"]:
+        raise JobFailed(f"None of the {total} file(s) could be processed.")
+    return {"batch_id": batch_id, **outcomes}
+
+
+def _batch_file_row(index, row):
+    """A batch file's row for /batch_status, noting whether its run is still stored."""
+    file_id = row.get("file_id")
+    return {
+        "index": index, **row,
+        "available": bool(file_id) and file_id in in_memory_files,
+        "hub_url": url_for("analysis_hub", file_id=file_id) if file_id else None,
+        "download_url": url_for("download_memory", file_id=file_id) if file_id else None,
+    }
+
+
+def _batch_runs(entry):
+    """(row, Run) for every finished file of a batch whose run is still stored."""
+    runs = []
+    for row in entry["files"]:
+        if row.get("status") != "done":
+            continue
+        file_info = in_memory_files.get(row["file_id"])
+        if file_info is not None:
+            runs.append((row, _get_run(file_info)))
+    return runs
+
+
+@app.route("/batch", methods=["GET", "POST"])
+def batch():
+    """Batch mode: many CSVs (or zips of them) with shared and per-file labels."""
+    if request.method == "GET":
+        return render_template("batch.html", settings=load_settings(), max_files=BATCH_MAX_FILES)
+
+    try:
+        uploads = _batch_uploads(request.files.getlist("csv_files"))
+    except ValueError as e:
+        flash(str(e), "danger")
+        return redirect(url_for("batch"))
+    if not uploads:
+        flash("No CSV files uploaded.", "danger")
+        return redirect(url_for("batch"))
+    if len(uploads) > BATCH_MAX_FILES:
+        flash(f"A batch can hold at most {BATCH_MAX_FILES} files ({len(uploads)} uploaded).", "danger")
+        return redirect(url_for("batch"))
+
+    try:
+        file_labels = json.loads(request.form.get("file_labels") or "{}")
+    except (ValueError, TypeError):
+        file_labels = {}
+    if not isinstance(file_labels, dict):
+        file_labels = {}
+
+    form = {k: v for k, v in request.form.items() if k != "file_labels"}
+    options = []
+    for name, _ in uploads:
+        try:
+            options.append(batch_file_options(name, form, file_labels))
+        except ValueError as e:
+            flash(f"{name}: {e}", "danger")
+            return redirect(url_for("batch"))
+
+    try:
+        template_path = load_template_path()
+    except Exception as e:
+        flash(str(e), "danger")
+        return redirect(url_for("batch"))
+
+    settings = load_settings()
+    batch_id = uuid.uuid4().hex
+    in_memory_files[batch_id] = {
+        "type": "batch",
+        "name": f"NTA_batch_{datetime.now().strftime('%Y-%m-%d_%H%M')}",
+        "created": time.time(),
+        "files": [
+            {"csv": name, "title": opts["assay_title"], "bytes": len(csv_data), "status": "queued",
+             "file_id": None, "workbook": None, "plates": None, "data_mode": opts["data_mode"],
+             "error": None, "seconds": None}
+            for (name, csv_data), opts in zip(uploads, options)
+        ],
+    }
+    job = job_queue.submit("batch", _holding(_run_batch, batch_id), batch_id, uploads, options,
+                           template_path, settings, meta={"batch_id": batch_id})
+    in_memory_files.update(batch_id, {"job_id": job.id})
+    logger.info("BATCH    %s ← %d file(s), %.1f KB, %d at a time", batch_id[:8], len(uploads),
+                sum(len(data) for _, data in uploads) / 1024, _worker_setting(settings, "batch_workers", 2))
+    return redirect(url_for("batch_hub", batch_id=batch_id))
+
+
+@app.route("/batch/<batch_id>")
+def batch_hub(batch_id):
+    """Batch hub: each file's status and results, and the combined Data Summary."""
+    entry = in_memory_files.get(batch_id)
+    if not entry or entry.get("type") != "batch":
+        flash(_missing(batch_id, "Batch not found. Please submit the files again."), "danger")
+        return redirect(url_for("batch"))
+    return render_template("batch_hub.html", batch_id=batch_id, batch_name=entry["name"],
+                           job_id=entry.get("job_id"), settings=load_settings())
+
+
+@app.route("/batch_status/<batch_id>")
+def batch_status(batch_id):
+    """
+    JSON: the batch's job and every file's row (status queued / processing /
+    done / failed / cancelled).  With ?since=<seq>&wait=N (max 30s) waits
+    until a file changes after the seq a previous call returned.
+    """
+    wait = min(max(request.args.get("wait", 0, type=float), 0), 30)
+    since = request.args.get("since", type=int)
+    if wait and since is not None:
+        events.since(batch_id, since, timeout=min(wait, STORE_POLL) if in_memory_files.shared else wait)
+    seq = events.latest_seq(batch_id)
+
+    entry = in_memory_files.get(batch_id)
+    if not entry or entry.get("type") != "batch":
+        return jsonify({"status": "error", "message": _missing(batch_id, "Batch not found")}), 404
+    job = _find_job(entry.get("job_id")) if entry.get("job_id") else None
+    rows = [_batch_file_row(i, row) for i, row in enumerate(entry["files"])]
+    stopped = job is None or not job.active
+    counts = {}
+    for row in rows:
+        if stopped and row["status"] in BATCH_ACTIVE_STATUSES:
+            row["status"] = "cancelled"   # the job ended (cancelled while queued) before reaching it
+        counts[row["status"]] = counts.get(row["status"], 0) + 1
+    return jsonify({
+        "status": "success",
+        "name": entry["name"],
+        "job": job.to_dict() if job is not None else None,
+        "finished": not any(row["status"] in BATCH_ACTIVE_STATUSES for row in rows),
+        "counts": counts,
+        "files": rows,
+        "seq": seq,
+    })
+
+
+@app.route("/batch_summary/<batch_id>")
+def batch_summary(batch_id):
+    """
+    Combined Data Summary of a batch: the /titres rows of every finished
+    file, each prefixed with File and Assay.  Same ?threshold= as /titres;
+    ?format=csv downloads it.
+    """
+    entry = in_memory_files.get(batch_id)
+    if not entry or entry.get("type") != "batch":
+        return jsonify({"status": "error", "message": _missing(batch_id, "Batch not found")}), 404
+    try:
+        thresholds = parse_thresholds(request.args.get("threshold"), default=(50, 90))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    _t = time.time()
+    rows = []
+    runs = _batch_runs(entry)
+    for row, run in runs:
+        rows.extend({"File": row["csv"], "Assay": row["title"], **titres}
+                    for titres in run.titre_rows(thresholds))
+    logger.info("BATCH    %s summary — %d row(s) from %d file(s) in %.2fs",
+                batch_id[:8], len(rows), len(runs), time.time() - _t)
+
+    if request.args.get("format") == "csv":
+        return send_file(BytesIO(_summary_csv(rows)), as_attachment=True,
+                         download_name=f"{entry['name']}_summary.csv", mimetype="text/csv")
+    return jsonify({
+        "status": "success",
+        "titre_labels": [titre_label(t) for t in thresholds],
+        "files": len(runs),
+        "data": rows,
+    })
+
+
+def _summary_csv(rows):
+    out = StringIO()
+    if rows:
+        writer = csv.DictWriter(out, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    return out.getvalue().encode("utf-8")
+
+
+@app.route("/download_batch/<batch_id>")
+def download_batch(batch_id):
+    """Zip of every finished file's workbook plus the combined Data Summary (NT50 / NT90) as CSV."""
+    entry = in_memory_files.get(batch_id)
+    if not entry or entry.get("type") != "batch":
+        flash(_missing(batch_id, "Batch not found. Please submit the files again."), "danger")
+        return redirect(url_for("batch"))
+    runs = _batch_runs(entry)
+    if not runs:
+        flash("No finished files to download yet.", "warning")
+        return redirect(url_for("batch_hub", batch_id=batch_id))
+
+    _t = time.time()
+    # As /download_memory, wait for plots still being drawn (max 120s for the whole batch)
+    deadline = _t + 120
+    archive = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES)
+    used, rows = set(), []
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zf:
+        for row, run in runs:
+            file_info = _wait_for_plots(row["file_id"], timeout=max(0, deadline - time.time()))
+            if file_info is None:
+                continue
+            # xlsx files are already compressed, so they are stored as they are
+            info = zipfile.ZipInfo(_unique_name(file_info["name"], used),
+                                   datetime.now().timetuple()[:6])
+            info.compress_type = zipfile.ZIP_STORED
+            with zf.open(info, "w") as dest:
+                shutil.copyfileobj(_workbook_stream(row["file_id"], file_info), dest)
+            rows.extend({"File": row["csv"], "Assay": row["title"], **titres}
+                        for titres in run.titre_rows((50, 90)))
+        zf.writestr(f"{entry['name']}_summary.csv", _summary_csv(rows))
+    logger.info("BATCH    %s archive of %d workbook(s) built in %.1fs",
+                batch_id[:8], len(runs), time.time() - _t)
+    archive.seek(0)
+    return send_file(archive, as_attachment=True, download_name=f"{entry['name']}.zip",
+                     mimetype="application/zip")
+
+
 # ════════════════════════════════════════════════════════════════
 # Data Analysis
 # ════════════════════════════════════════════════════════════════
@@ -407,7 +1128,7 @@ def process():
 def analysis_hub(file_id):
     """Data Analysis — the central page with three analysis options."""
     if file_id not in in_memory_files:
-        flash("Results not found. Please process your data again.", "danger")
+        flash(_missing(file_id, "Results not found. Please process your data again."), "danger")
         return redirect(url_for("index"))
 
     file_info = in_memory_files[file_id]
@@ -425,7 +1146,7 @@ def analysis_hub(file_id):
 def linear_results(file_id):
     """Dedicated Linear Interpolation results page."""
     if file_id not in in_memory_files:
-        flash("Results not found. Please process your data again.", "danger")
+        flash(_missing(file_id, "Results not found. Please process your data again."), "danger")
         return redirect(url_for("index"))
 
     file_info = in_memory_files[file_id]
@@ -433,6 +1154,7 @@ def linear_results(file_id):
         "linear_results.html",
         excel_file_id=file_id,
         filename=file_info.get("name", "results.xlsx"),
+        plates=_get_run(file_info).names,
         settings=load_settings(),
     )
 
@@ -441,7 +1163,7 @@ def linear_results(file_id):
 def linear_summary_data(file_id):
     """JSON API returning plate/pseudotype/sample/titre counts for Data Summary card."""
     if file_id not in in_memory_files:
-        return jsonify({"status": "error", "message": "File not found"})
+        return jsonify({"status": "error", "message": _missing(file_id, "File not found")})
 
     try:
         file_info = in_memory_files[file_id]
@@ -450,24 +1172,11 @@ def linear_summary_data(file_id):
         if "_summary_cache" in file_info:
             return jsonify(file_info["_summary_cache"])
 
-        file_bytes = file_info["data"]
-        wb = load_workbook(BytesIO(file_bytes), data_only=True)
-
-        plate_sheets = [s for s in wb.sheetnames if s.startswith("Plate")]
+        run = _get_run(file_info)
 
         # Only count plates that contain actual numeric well data (B5:M12).
         # This excludes any extra/blank plates the plate reader appended.
-        def _plate_has_data(ws):
-            for row in range(5, 13):
-                for col in ['B','C','D','E','F','G','H','I','J','K','L','M']:
-                    try:
-                        float(ws[f'{col}{row}'].value)
-                        return True
-                    except (ValueError, TypeError):
-                        pass
-            return False
-
-        num_plates = sum(1 for s in plate_sheets if _plate_has_data(wb[s]))
+        num_plates = sum(1 for plate in run.plates if plate.has_data)
 
         pseudotypes = set()
         num_quadrants = 0
@@ -475,19 +1184,17 @@ def linear_summary_data(file_id):
         has_any_label = False
         all_labelled = True
 
-        for sheet_name in plate_sheets:
-            ws = wb[sheet_name]
-            for pt_cell, sid_cell in [('B3','B4'), ('E3','E4'), ('H3','H4'), ('K3','K4')]:
-                pt_val = ws[pt_cell].value
-                sid_val = ws[sid_cell].value
-                if pt_val and str(pt_val).strip():
-                    pseudotypes.add(str(pt_val).strip())
-                    num_quadrants += 1
-                    if sid_val and str(sid_val).strip():
-                        has_any_label = True
-                        num_labelled += 1
-                    else:
-                        all_labelled = False
+        for plate in run.plates:
+            for quad in plate.quadrants:
+                if not quad.used:
+                    continue
+                pseudotypes.add(quad.pseudotype)
+                num_quadrants += 1
+                if quad.sample_id:
+                    has_any_label = True
+                    num_labelled += 1
+                else:
+                    all_labelled = False
 
         # Determine labelling status
         if num_quadrants == 0:
@@ -499,9 +1206,6 @@ def linear_summary_data(file_id):
         else:
             label_status = "unlabelled"
 
-        # Count flagged errors (if Errors sheet exists)
-        error_count, has_errors_sheet = count_errors_from_workbook(file_bytes)
-
         result = {
             "status": "success",
             "num_plates": num_plates,
@@ -509,39 +1213,25 @@ def linear_summary_data(file_id):
             "num_samples": num_quadrants,
             "num_labelled": num_labelled,
             "label_status": label_status,
-            "error_count": error_count,
-            "error_flagging_enabled": has_errors_sheet,
+            "error_count": run.error_count,
+            "error_flagging_enabled": run.errors_flagged,
         }
-        file_info["_summary_cache"] = result
+        in_memory_files.update(file_id, {"_summary_cache": result})
         return jsonify(result)
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)})
 
 
-def _compute_boxplot_data(file_bytes, threshold_pct):
-    """
-    Compute NT titres for box plot using the same formula as the Excel template.
-
-    For each replicate column (3 per quadrant) on each Plate sheet:
-      NSC     = luminescence at row 12 (no-serum control, index 7 in 0-based)
-      target  = NSC × (1 - threshold_pct/100)  e.g. NT50 → NSC × 0.5
-      P16     = last 0-based index (0–7) where lum ≤ target
-                (replicates Excel MATCH(target, col5:col12, 1) on ascending data)
+def _get_run(file_info):
+    """The run's in-memory model (nta_utils.Run), stored with it by _start_run."""
+    return file_info["run"]
 
-      Boundary conditions:
-        P16 is None  → lum never drops to target → NT ≤ A5  (lower boundary)
-        P16 = 6      → crossing involves NSC row  → NT ≥ A11 (upper boundary)
-        P16 in 0–5   → valid interpolation between two tested dilution points
 
-      NT (valid) = (target - lum[P16]) / (lum[P16+1] - lum[P16])
-                   × (dil[P16+1] - dil[P16]) + dil[P16]
-
-    Each entry stores both:
-      "nt"          — average of non-boundary replicates only (used when boundary toggle OFF)
-      "nt_boundary" — average substituting A5 for low-boundary and A11 for high-boundary
-                      replicates (used when boundary toggle ON)
+def _compute_boxplot_data(file_info, threshold_pct):
+    """
+    NT titres for the box plot, using the same formula as the Excel template
+    (see nta_utils.compute_titres), grouped by pseudotype:
 
-    Returns:
       {
         pseudotype: [
           { sample, plate, nt, nt_boundary, has_boundary,
@@ -550,141 +1240,11 @@ def _compute_boxplot_data(file_bytes, threshold_pct):
           ...
         ]
       }
-    """
-    target_fraction = (100 - threshold_pct) / 100
-
-    wb = load_workbook(BytesIO(file_bytes), data_only=True)
-
-    quad_defs = [
-        {"pt_cell": "B3", "sid_cell": "B4", "cols": ["B", "C", "D"]},
-        {"pt_cell": "E3", "sid_cell": "E4", "cols": ["E", "F", "G"]},
-        {"pt_cell": "H3", "sid_cell": "H4", "cols": ["H", "I", "J"]},
-        {"pt_cell": "K3", "sid_cell": "K4", "cols": ["K", "L", "M"]},
-    ]
-
-    plate_sheets = sorted(
-        [s for s in wb.sheetnames if re.match(r"^Plate\d+$", s)],
-        key=lambda s: int(s[5:]),
-    )
-
-    grouped = {}
-
-    for sheet_name in plate_sheets:
-        ws = wb[sheet_name]
 
-        # Dilutions A5:A12 (8 values)
-        # Index 0 = A5 (lowest tested dilution)
-        # Index 6 = A11 (highest tested dilution)
-        # Index 7 = A12 (NSC slot — not a real dilution point)
-        dilutions = []
-        for row in range(5, 13):
-            val = ws[f"A{row}"].value
-            try:
-                dilutions.append(float(val))
-            except (ValueError, TypeError):
-                dilutions.append(None)
-
-        dil_low  = dilutions[0]  # A5  — lower boundary limit
-        dil_high = dilutions[6]  # A11 — upper boundary limit
-
-        for quad in quad_defs:
-            pt_val = ws[quad["pt_cell"]].value
-            if not pt_val or not str(pt_val).strip():
-                continue
-
-            pseudotype = str(pt_val).strip()
-            sid_val    = ws[quad["sid_cell"]].value
-            sample     = str(sid_val).strip() if sid_val and str(sid_val).strip() else "Unlabelled"
-
-            # rep_data: list of (nt_valid_or_None, boundary_flag)
-            # boundary_flag: None = valid, "low" = ≤A5, "high" = ≥A11
-            rep_data = []
-
-            for col in quad["cols"]:
-                lum = []
-                for row in range(5, 13):
-                    val = ws[f"{col}{row}"].value
-                    try:
-                        lum.append(float(val))
-                    except (ValueError, TypeError):
-                        lum.append(None)
-
-                nsc = lum[7]
-                if nsc is None or nsc <= 0:
-                    rep_data.append((None, None))
-                    continue
-
-                target = nsc * target_fraction
-
-                # Excel MATCH(target, lum, 1): binary search (assumes ascending)
-                lo, hi = 0, 6  # search lum[0:6] (rows 5-11, not NSC)
-                p16 = None
-                while lo <= hi:
-                    mid = (lo + hi) // 2
-                    if lum[mid] is not None and lum[mid] <= target:
-                        lo = mid + 1
-                    else:
-                        hi = mid - 1
-                if hi >= 0:
-                    p16 = hi
-
-                if p16 is None:
-                    # All lum[0:6] > target → NT ≤ lowest dilution
-                    rep_data.append((None, "low"))
-                else:
-                    # p16=6: uses (lum[6], lum[7]=NSC) / (dilutions[6], dilutions[7]=0)
-                    y1, y2 = lum[p16], lum[p16 + 1]
-                    x1, x2 = dilutions[p16], dilutions[p16 + 1]
-                    if None in (y1, y2, x1, x2) or y2 == y1:
-                        rep_data.append((None, None))
-                    else:
-                        nt_val = (target - y1) / (y2 - y1) * (x2 - x1) + x1
-                        rep_data.append((nt_val if nt_val > 0 else None, None))
-
-            # Average without boundary substitution
-            valid_nts = [nt for nt, b in rep_data if nt is not None and b is None]
-
-            # Average with boundary substitution (A5 for low, A11 for high)
-            boundary_nts = []
-            for nt, b in rep_data:
-                if b is None and nt is not None:
-                    boundary_nts.append(nt)
-                elif b == "low"  and dil_low  is not None:
-                    boundary_nts.append(dil_low)
-                elif b == "high" and dil_high is not None:
-                    boundary_nts.append(dil_high)
-
-            # Skip entries with no data at all
-            if not valid_nts and not boundary_nts:
-                continue
-
-            avg_nt          = round(sum(valid_nts)    / len(valid_nts),    1) if valid_nts    else None
-            avg_nt_boundary = round(sum(boundary_nts) / len(boundary_nts), 1) if boundary_nts else None
-
-            first_col = quad["cols"][0]
-            ref_nsc = None
-            try:
-                ref_nsc = float(ws[f"{first_col}12"].value)
-            except (ValueError, TypeError):
-                pass
-            ref_target = round(ref_nsc * target_fraction, 2) if ref_nsc else None
-
-            entry = {
-                "sample":             sample,
-                "plate":              sheet_name,
-                "nt":                 avg_nt,           # boundary-excluded average
-                "nt_boundary":        avg_nt_boundary,  # boundary-included average
-                "has_boundary":       any(b is not None for _, b in rep_data),
-                "boundary_low":       dil_low,
-                "boundary_high":      dil_high,
-                "nsc":                round(ref_nsc, 2) if ref_nsc else None,
-                "target":             ref_target,
-                "rep_nts":            [round(nt, 1) if nt is not None else None for nt, _ in rep_data],
-                "rep_boundary_flags": [b for _, b in rep_data],
-            }
-            grouped.setdefault(pseudotype, []).append(entry)
-
-    return grouped
+    "nt" averages the valid replicates only; "nt_boundary" substitutes A5 for
+    replicates that never drop to the target (NT ≤ A5).
+    """
+    return _get_run(file_info).boxplot_data(threshold_pct)
 
 
 @app.route("/boxplot_data/<file_id>")
@@ -694,14 +1254,16 @@ def boxplot_data(file_id):
     grouped by pseudotype for the box plot.
 
     Query params:
-        threshold: 50 (default) or 90
+        threshold: any NTxx threshold between 0 and 100 (default 50)
     """
     if file_id not in in_memory_files:
-        return jsonify({"status": "error", "message": "File not found"})
+        return jsonify({"status": "error", "message": _missing(file_id, "File not found")})
 
-    threshold = request.args.get("threshold", "50")
-    if threshold not in ("50", "90"):
-        threshold = "50"
+    try:
+        threshold = parse_thresholds(request.args.get("threshold"))[0]
+    except ValueError:
+        threshold = 50.0
+    label = titre_label(threshold)
 
     include_boundary = request.args.get("boundary", "false").lower() == "true"
 
@@ -714,23 +1276,17 @@ def boxplot_data(file_id):
 
     try:
         file_info = in_memory_files[file_id]
-        file_bytes = file_info["data"]
 
-        # ── Cache hit (raw data — boundary filtering applied per-request) ──
-        bp_cache = file_info.get("boxplot_cache", {})
-        if threshold in bp_cache:
-            logger.info("BOXPLOT  NT%s — cache hit", threshold)
-            raw_grouped = bp_cache[threshold]["data"]
+        # Titres are cached per threshold on the Run;
+        # boundary/quadrant filtering is applied per-request below
+        if _get_run(file_info).is_cached(threshold):
+            logger.info("BOXPLOT  %s — cache hit", label)
+            raw_grouped = _compute_boxplot_data(file_info, threshold)
         else:
-            # ── Compute ──────────────────────────────────────────────
-            logger.info("BOXPLOT  NT%s — computing …", threshold)
+            logger.info("BOXPLOT  %s — computing …", label)
             _t = time.time()
-            raw_grouped = _compute_boxplot_data(file_bytes, int(threshold))
-            logger.info("BOXPLOT  NT%s — done in %.2fs", threshold, time.time() - _t)
-            file_info.setdefault("boxplot_cache", {})[threshold] = {
-                "titre_label": f"NT{threshold}",
-                "data":        raw_grouped,
-            }
+            raw_grouped = _compute_boxplot_data(file_info, threshold)
+            logger.info("BOXPLOT  %s — done in %.2fs", label, time.time() - _t)
 
         # ── Apply boundary mode: pick which NT value to use ──────────
         # Build a fresh view — never mutate the cached dicts
@@ -750,22 +1306,18 @@ def boxplot_data(file_id):
                 filtered[pt] = kept
 
         # ── Filter to active quadrants ───────────────────────────────
-        q_pt_cells = {"Q1": "B3", "Q2": "E3", "Q3": "H3", "Q4": "K3"}
-        wb_f = load_workbook(BytesIO(file_bytes), data_only=True)
-        allowed = set()
-        for sheet in [s for s in wb_f.sheetnames if re.match(r"^Plate\d+$", s)]:
-            ws_f = wb_f[sheet]
-            for q, cell in q_pt_cells.items():
-                if q_active[q]:
-                    val = ws_f[cell].value
-                    if val and str(val).strip():
-                        allowed.add(str(val).strip())
+        allowed = {
+            quad.pseudotype
+            for plate in _get_run(file_info).plates
+            for quad in plate.quadrants
+            if quad.used and q_active[quad.name]
+        }
         if allowed:
             filtered = {k: v for k, v in filtered.items() if k in allowed}
 
         return jsonify({
             "status":      "success",
-            "titre_label": f"NT{threshold}",
+            "titre_label": label,
             "data":        filtered,
         })
 
@@ -774,27 +1326,54 @@ def boxplot_data(file_id):
         return jsonify({"status": "error", "message": str(e)})
 
 
+@app.route("/titres/<file_id>")
+def titres_data(file_id):
+    """JSON API: per-quadrant linear NT titres for one or more thresholds.
+
+    Query params:
+        threshold: one threshold or a comma-separated list, e.g. "80" or
+                   "50,80,99" (default "50,90"); all are computed in one pass
+
+    Each row carries Plate, Quadrant, Pseudotype, Sample_ID and, per
+    threshold, NTxx (valid replicates only) and NTxx_boundary (A5 substituted
+    for replicates below the lowest dilution).
+    """
+    if file_id not in in_memory_files:
+        return jsonify({"status": "error", "message": _missing(file_id, "File not found")})
+
+    try:
+        thresholds = parse_thresholds(request.args.get("threshold"), default=(50, 90))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    try:
+        run = _get_run(in_memory_files[file_id])
+        _t = time.time()
+        rows = run.titre_rows(thresholds)
+        logger.info("TITRES   %s — %d row(s) in %.2fs",
+                    ",".join(titre_label(t) for t in thresholds), len(rows), time.time() - _t)
+        return jsonify({
+            "status":       "success",
+            "titre_labels": [titre_label(t) for t in thresholds],
+            "data":         rows,
+        })
+    except Exception as e:
+        logger.exception("TITRES   error")
+        return jsonify({"status": "error", "message": str(e)})
+
+
 @app.route("/curve_fitting_results/<fitting_id>")
 def curve_fitting_results(fitting_id):
     """Serve cached sigmoid curve fitting results without reprocessing."""
     if fitting_id not in in_memory_files:
-        flash("Curve fitting results not found. Please run curve fitting again.", "danger")
+        flash(_missing(fitting_id, "Curve fitting results not found. Please run curve fitting again."), "danger")
         return redirect(url_for("index"))
     info = in_memory_files[fitting_id]
     excel_file_id = info.get("excel_file_id")
     if not excel_file_id or excel_file_id not in in_memory_files:
-        flash("Original Excel results not found.", "danger")
+        flash(_missing(excel_file_id, "Original Excel results not found."), "danger")
         return redirect(url_for("index"))
-    return render_template(
-        "curve_fitting_results.html",
-        fitting_id=fitting_id,
-        excel_file_id=excel_file_id,
-        output_files=list(info["data"].keys()),
-        ic50_filename=info["ic50_filename"],
-        lod_used=info.get("include_lod", load_settings().get("lod_censor_include", False)),
-        settings=load_settings(),
-        processing_time=None,
-    )
+    return _render_fitting_results(fitting_id)
 
 
 @app.route("/compare_titres_page/<file_id>")
@@ -802,56 +1381,168 @@ def compare_titres_page(file_id):
     """
     Titre comparison — triggered from Data Analysis.
     Expects ?fitting_id=<id> in query string.
-    Immediately runs the comparison and shows results.
+    Shows cached results, or queues the comparison and shows its progress.
     """
     fitting_id = request.args.get("fitting_id")
     if not file_id or file_id not in in_memory_files:
-        flash("Excel results not found.", "danger")
+        flash(_missing(file_id, "Excel results not found."), "danger")
         return redirect(url_for("index"))
     if not fitting_id or fitting_id not in in_memory_files:
-        flash("Curve fitting results not found. Please perform curve fitting first.", "danger")
+        flash(_missing(fitting_id, "Curve fitting results not found. Please perform curve fitting first."), "danger")
         return redirect(url_for("analysis_hub", file_id=file_id))
 
     # Return cached comparison results if already computed for this file
     existing_cmp_id = in_memory_files[file_id].get("comparison_id")
     if existing_cmp_id and existing_cmp_id in in_memory_files:
-        cached = in_memory_files[existing_cmp_id]
-        return render_template(
-            "titre_comparison_results.html",
-            comparison_id=existing_cmp_id,
-            excel_file_id=file_id,
-            stats=cached["stats"],
-            mismatches=cached["mismatches"],
-            has_plot=cached["has_plot"],
-            settings=load_settings(),
-            processing_time=None,
-        )
+        return _render_comparison_results(existing_cmp_id, file_id)
+
+    # Run the comparison in the background and show its progress
+    return _submit_comparison(file_id, fitting_id)
+
+
+# ════════════════════════════════════════════════════════════════
+# Background jobs (curve fitting, titre comparison)
+# ════════════════════════════════════════════════════════════════
+
+JOB_TITLES = {"fitting": "Sigmoid Curve Fitting", "comparison": "Titre Comparison",
+              "batch": "Batch Processing", "run": "Processing"}
+
+
+def _job_back_url(job):
+    batch_id = job.meta.get("batch_id")
+    if batch_id and batch_id in in_memory_files:
+        return url_for("batch_hub", batch_id=batch_id)
+    file_id = job.meta.get("file_id")
+    if file_id and file_id in in_memory_files:
+        return url_for("analysis_hub", file_id=file_id)
+    return url_for("index")
+
+
+@app.route("/jobs/<job_id>")
+def job_page(job_id):
+    """Progress page for a queued/running job; forwards to its result once finished."""
+    job = _find_job(job_id)
+    if job is None:
+        flash("Job not found. It may have expired; please run it again.", "warning")
+        return redirect(url_for("index"))
+    if not job.active:
+        return redirect(url_for("job_result", job_id=job_id))
+    return render_template(
+        "job_status.html",
+        job=job.to_dict(),
+        job_title=JOB_TITLES.get(job.kind, job.kind),
+        back_url=_job_back_url(job),
+        settings=load_settings(),
+    )
+
 
-    # Delegate to the existing compare logic
-    return _run_comparison(file_id, fitting_id)
+@app.route("/job_status/<job_id>")
+def job_status(job_id):
+    """JSON status: queued/running/done/failed/cancelled, stage and progress."""
+    job = _find_job(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Job not found"}), 404
+    data = job.to_dict()
+    if not job.active:
+        data["result_url"] = url_for("job_result", job_id=job_id)
+    return jsonify(data)
+
+
+@app.route("/cancel_job/<job_id>", methods=["POST"])
+def cancel_job(job_id):
+    """Cancel a queued or running job, killing its R process."""
+    if job_queue.cancel(job_id):
+        return jsonify({"status": "ok"})
+    job = _find_job(job_id)
+    if job is not None and job.active:
+        # Running in another server process, whose cancel watcher acts on this
+        in_memory_files.update(job_id, {"cancel_requested": True})
+        return jsonify({"status": "ok"})
+    return jsonify({"status": "error", "message": "Job not found or already finished"}), 400
+
+
+@app.route("/job_result/<job_id>")
+def job_result(job_id):
+    """Render the results page of a finished job (or report why it has none)."""
+    job = _find_job(job_id)
+    if job is None:
+        flash("Job not found. It may have expired; please run it again.", "warning")
+        return redirect(url_for("index"))
+    if job.active:
+        return redirect(url_for("job_page", job_id=job_id))
+
+    title = JOB_TITLES.get(job.kind, job.kind)
+    if job.status == "cancelled":
+        flash(f"{title} cancelled.", "warning")
+        return redirect(_job_back_url(job))
+    if job.status == "failed":
+        flash(job.error, "danger")
+        return redirect(_job_back_url(job))
+
+    processing_time = round(job.elapsed, 1)
+    result_id = None
+    if job.kind == "batch":
+        result_id = job.meta["batch_id"]
+        if result_id in in_memory_files:
+            return redirect(url_for("batch_hub", batch_id=result_id))
+    elif job.kind == "run":
+        result_id = job.result["file_id"]
+        if result_id in in_memory_files:
+            return redirect(url_for("analysis_hub", file_id=result_id))
+    elif job.kind == "fitting":
+        result_id = job.result["fitting_id"]
+        if result_id in in_memory_files:
+            return _render_fitting_results(result_id, processing_time)
+    elif job.kind == "comparison":
+        result_id = job.result["comparison_id"]
+        file_id = job.meta.get("file_id")
+        if result_id in in_memory_files:
+            return _render_comparison_results(result_id, file_id, processing_time)
+
+    flash(_missing(result_id, f"{title} results not found. Please run it again."), "danger")
+    return redirect(_job_back_url(job))
 
 
 # ════════════════════════════════════════════════════════════════
 # download / utility routes
 # ════════════════════════════════════════════════════════════════
 
+EXPORT_SPOOL_BYTES = 16 * 1024 * 1024   # an xlsx export larger than this is spooled to disk
+
+
+def _workbook_stream(file_id, file_info):
+    """
+    The run's xlsx as a file object at its start: the cached copy, or a
+    fresh export (_export_workbook), which is cached once it has the plots.
+    """
+    with _graph_lock(file_id, "xlsx"):
+        # A concurrent download may have exported (and cached) it meanwhile
+        file_info = in_memory_files.get(file_id) or file_info
+        if file_info.get("data"):
+            file_stream = BytesIO(file_info["data"])
+        else:
+            # Spooled to disk past EXPORT_SPOOL_BYTES, then streamed from there
+            file_stream = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES)
+            _export_workbook(file_id, file_info, file_stream)
+            if file_info.get("plots_ready"):
+                file_stream.seek(0)
+                in_memory_files.update(file_id, {"data": file_stream.read()})
+    file_stream.seek(0)
+    return file_stream
+
+
 @app.route("/download_memory/<file_id>")
 def download_memory(file_id):
     file_info = in_memory_files.get(file_id)
     if not file_info:
-        flash("File not found in memory.", "danger")
+        flash(_missing(file_id, "File not found in memory."), "danger")
         return redirect(url_for("index"))
 
-    # Block until background R thread finishes embedding plots (max 120s)
-    deadline = time.time() + 120
-    while not file_info.get("plots_ready") and time.time() < deadline:
-        time.sleep(1)
-
-    file_stream = BytesIO(file_info["data"])
-    file_stream.seek(0)
+    # Block until the background R thread has stored the plots (max 120s)
+    file_info = _wait_for_plots(file_id, timeout=120) or file_info
 
     return send_file(
-        file_stream,
+        _workbook_stream(file_id, file_info),
         as_attachment=True,
         download_name=file_info["name"],
         mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
@@ -862,11 +1553,10 @@ def download_memory(file_id):
 def generate_graphs():
     file_id = request.form.get("file_id")
     if not file_id or file_id not in in_memory_files:
-        flash("No Excel file found for graph generation.", "danger")
+        flash(_missing(file_id, "No Excel file found for graph generation."), "danger")
         return redirect(url_for("index"))
 
     file_info = in_memory_files[file_id]
-    file_bytes = file_info["data"]
     filename = file_info["name"]
 
     r_script = os.path.join(os.getcwd(), "process_data.R")
@@ -910,31 +1600,23 @@ def generate_graphs():
         q4_flag = str(quadrants.get("Q4", True)).lower()
 
     try:
-        file_stream = BytesIO(file_bytes)
-        file_stream.seek(0)
-
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp_input:
-            tmp_input.write(file_stream.read())
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".csv") as tmp_input:
             input_path = tmp_input.name
+        write_plate_data_csv(_get_run(file_info), input_path)
 
         with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp_output:
             output_plot_path = tmp_output.name
 
         plot_title = os.path.splitext(filename)[0]
-        subprocess.run(
-            [
-                "Rscript", r_script,
-                input_path, output_plot_path,
-                str(include_timestamp).lower(),
-                q1_colour, q2_colour, q3_colour, q4_colour,
-                plot_title,
-                q1_flag, q2_flag, q3_flag, q4_flag
-            ],
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-        )
+        run_rscript([
+            "Rscript", r_script,
+            input_path, output_plot_path,
+            str(include_timestamp).lower(),
+            q1_colour, q2_colour, q3_colour, q4_colour,
+            plot_title,
+            q1_flag, q2_flag, q3_flag, q4_flag,
+            "summary",
+        ])
 
         with open(output_plot_path, "rb") as f:
             image_bytes = BytesIO(f.read())
@@ -962,25 +1644,130 @@ def generate_graphs():
 
 @app.route("/plots_ready/<file_id>")
 def plots_ready(file_id):
-    info = in_memory_files.get(file_id)
+    """Plot status; with ?wait=N (max 30s) long-polls until the plots are ready."""
+    wait = min(max(request.args.get("wait", 0, type=float), 0), 30)
+    info = _wait_for_plots(file_id, timeout=wait)
     if not info:
         return jsonify({"ready": False, "missing": True})
     return jsonify({"ready": bool(info.get("plots_ready"))})
 
 
+SSE_STREAM_SECONDS = 55   # the browser's EventSource reconnects (with Last-Event-ID) after this
+SSE_KEEPALIVE = 15
+
+
+def _sse(event, data, seq=None):
+    head = f"id: {seq}\n" if seq is not None else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.route("/events/<key>")
+def event_stream(key):
+    """
+    Server-Sent Events for a run (file_id) or a job (job_id).  Opens with the
+    current state — a "plots" or "job" event — then pushes every new event:
+    "plots" once the background R plots are stored, "fitting" /
+    "comparison" when those finish for the run, and a "job" event on each
+    stage change.  Ends when a job finishes (or after SSE_STREAM_SECONDS).
+    """
+    job = _find_job(key)
+    info = in_memory_files.get(key) if job is None else None
+    if job is None and info is None:
+        return jsonify({"status": "error", "message": "Not found"}), 404
+
+    result_url = url_for("job_result", job_id=key) if job is not None else None
+    last_seq = request.headers.get("Last-Event-ID", type=int)
+
+    def with_result_url(data):
+        # A finished job's event tells the page where its results are
+        if data.get("status") in ("queued", "running"):
+            return data
+        return dict(data, result_url=result_url)
+
+    def current():
+        """The state as stored now: how changes made by another server process show up."""
+        if job is not None:
+            latest = _find_job(key) or job
+            return "job", with_result_url(latest.to_dict())
+        latest = in_memory_files.get(key)
+        return "plots", {"ready": bool(latest and latest.get("plots_ready"))}
+
+    def changed(old, new):
+        return any(old.get(f) != new.get(f) for f in ("status", "stage", "progress", "ready"))
+
+    def stream():
+        after = last_seq if last_seq is not None else events.latest_seq(key)
+        kind, state = current()
+        yield _sse(kind, state)
+        if "result_url" in state:
+            return
+
+        deadline = time.time() + SSE_STREAM_SECONDS
+        sent = time.time()
+        while time.time() < deadline:
+            wait = min(SSE_KEEPALIVE, deadline - time.time())
+            if in_memory_files.shared:
+                wait = min(wait, STORE_POLL)
+            batch = events.since(key, after, timeout=wait)
+            if not batch and in_memory_files.shared:
+                _, latest = current()
+                if changed(state, latest):
+                    batch = [(None, kind, latest)]
+            for seq, event, data in batch:
+                if seq is not None:
+                    after = seq
+                if event == "job":
+                    data = with_result_url(data)
+                if event == kind:
+                    state = data
+                yield _sse(event, data, seq)
+                sent = time.time()
+                if "result_url" in data:
+                    return
+            if time.time() - sent >= SSE_KEEPALIVE:
+                yield ": keep-alive\n\n"
+                sent = time.time()
+
+    return Response(stream_with_context(stream()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route("/server_stats")
+def server_stats():
+    """Result store, job queue and warm R pool counters (JSON), for monitoring memory and load."""
+    return jsonify({
+        "store": in_memory_files.stats(),
+        "jobs": job_queue.stats(),
+        "r_pool": get_r_pool().stats,
+    })
+
+
 @app.route("/summary_plot/<file_id>")
 def summary_plot(file_id):
     if file_id not in in_memory_files:
         return "", 404
     info = in_memory_files[file_id]
-    if not info.get("plots_ready"):
-        return "", 202  # still processing in background
     plot_bytes = info.get("summary_plot")
     if not plot_bytes:
-        return "", 404
+        # Stored as soon as its render finishes, before the plate plots are done
+        return ("", 202) if not info.get("plots_ready") else ("", 404)
     return send_file(BytesIO(plot_bytes), mimetype="image/png")
 
 
+@app.route("/plate_plot/<file_id>/<plate>")
+def plate_plot(file_id, plate):
+    """One plate's graph from the run's background R plots; 202 while it is still being rendered."""
+    entry = in_memory_files.get(_plate_plot_key(file_id, plate))
+    if entry is not None:
+        return send_file(BytesIO(entry["png"]), mimetype="image/png")
+    info = in_memory_files.get(file_id)
+    if info is None or plate not in _get_run(info).names:
+        return "", 404
+    if not info.get("plots_ready"):
+        return "", 202
+    return "", 404
+
+
 @app.route("/save_quadrants", methods=["POST"])
 def save_quadrants():
     quadrants = request.get_json()
@@ -999,12 +1786,9 @@ def get_settings():
 def get_template_dilutions():
     try:
         template_path = load_template_path()
-        wb = load_workbook(template_path, data_only=True)
-        ws = wb.active
         
         dilutions = []
-        for row in range(5, 13):
-            cell_value = ws[f'A{row}'].value
+        for cell_value in compiled_template(template_path).dilution_values:
             try:
                 num_val = float(cell_value)
                 if num_val == 0:
@@ -1062,8 +1846,7 @@ def create_template_variant():
         return jsonify({"status": "error", "message": f"A file named '{safe_name}.xlsx' already exists. Choose a different name."}), 400
 
     try:
-        import openpyxl as _xl
-        wb = _xl.load_workbook(source_path)
+        wb = load_template_workbook(source_path)
         ws = wb.active
         for i, val in enumerate(dilutions):
             ws[f"A{5 + i}"] = val
@@ -1109,21 +1892,47 @@ def delete_custom_template():
 
 @app.route("/validate_csv_mode", methods=["POST"])
 def validate_csv_mode_route():
-    """JSON API: check whether the uploaded CSV matches the selected data mode."""
-    file = request.files.get("csv_file")
+    """
+    JSON API: check whether the uploaded CSV matches the selected data mode.
+    The upload is parsed once and staged: the response's "token" can be sent
+    to /process (as upload_token) instead of the file, or back here with
+    another data_mode, until it expires.  "plates" / "preview" describe the
+    plates read in the selected mode (see PlateBlock.diagnostics).
+    """
     selected_mode = request.form.get("data_mode", "standard")
+    if selected_mode not in ("data_only", "standard"):
+        selected_mode = "standard"
+
+    token = request.form.get("upload_token", "")
+    staged = _staged_upload(token) if token else None
+    if staged is None:
+        file = request.files.get("csv_file")
+        if not file:
+            return jsonify({"ok": True, "expired": bool(token)})
+        csv_data = file.read()
+        blocks, scan = scan_plate_csv(BytesIO(csv_data), selected_mode)
+        parsed = {selected_mode: (blocks, scan.diagnostics)}
+        if scan.detected not in ("unknown", selected_mode):
+            # Likely to be switched to, so read that way too while the bytes are here
+            other, other_scan = scan_plate_csv(BytesIO(csv_data), scan.detected)
+            parsed[scan.detected] = (other, other_scan.diagnostics)
+        token = _stage_upload(csv_data, file.filename, scan.detected, parsed)
+        detected, diagnostics = scan.detected, scan.diagnostics
+        logger.info("CSV      staged %s: %.1f KB, %s, %d plate(s) as %s",
+                    token[:8], len(csv_data) / 1024, detected, len(blocks), selected_mode)
+    else:
+        detected = staged["detected"]
+        blocks, diagnostics = _staged_blocks(token, staged, selected_mode)
 
-    if not file:
-        return jsonify({"ok": True})
-
-    csv_bytes = BytesIO(file.read())
-    csv_bytes.seek(0)
-
-    ok, detected, message = validate_csv_mode(csv_bytes, selected_mode)
+    ok, detected, message = check_csv_mode(detected, selected_mode)
     return jsonify({
         "ok": ok,
         "detected_mode": detected,
         "message": message,
+        "token": token,
+        "expires_in": STAGED_UPLOAD_TTL,
+        "plates": len(blocks),
+        "preview": diagnostics,
     })
 
 
@@ -1162,30 +1971,162 @@ def set_active_preset():
     return "Preset updated", 200
 
 
-def _run_fitting(file_id, include_lod_override=None):
+def _run_fit_sigmoids_r(r_script, sigmoid_csv_path, output_dir, ic50_filename, r_args, workers=1,
+                        cancel=None, progress=None):
     """
-    Run fit_sigmoids.R for the given file_id and store results in memory.
-    include_lod_override: True/False to override settings, None to use settings.
-    Returns a Flask response.
+    Run fit_sigmoids.R on sigmoid_csv_path, writing ic50_filename and any
+    plots into output_dir.  With workers > 1 the CSV is split into shards of
+    whole plates, one Rscript per shard runs in parallel (at most `workers`
+    at a time), and the shard IC50 CSVs and plots are merged back.
+
+    r_args:   the trailing fit_sigmoids.R arguments
+              [assay_title, timestamp, r2_threshold, include_lod]
+    cancel:   optional threading.Event; setting it kills the R processes
+    progress: optional callback(shards_done, n_shards)
+    Raises subprocess.CalledProcessError if any shard fails.
     """
-    file_info = in_memory_files[file_id]
-    file_bytes = file_info["data"]
-    filename = file_info["name"]
+    shard_root = os.path.join(output_dir, "_shards")
+    shard_csvs = shard_sigmoid_csv(sigmoid_csv_path, workers, shard_root)
+
+    def _fit(shard_csv, shard_out):
+        run_rscript(["Rscript", r_script, shard_csv, shard_out, *r_args], cancel=cancel)
 
+    if len(shard_csvs) == 1:
+        _fit(sigmoid_csv_path, output_dir)
+        return
+
+    workers = min(workers, len(shard_csvs))
+    logger.info("FITTING  %d shard(s) across %d worker(s)", len(shard_csvs), workers)
+    shard_outs = [os.path.join(shard_root, f"out_{k + 1}") for k in range(len(shard_csvs))]
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_fit, c, o) for c, o in zip(shard_csvs, shard_outs)]
+            # result() re-raises the first failure; leaving the block waits for the rest
+            for done, future in enumerate(as_completed(futures), 1):
+                future.result()
+                if progress:
+                    progress(done, len(futures))
+
+        merge_ic50_csvs(
+            [os.path.join(d, ic50_filename) for d in shard_outs],
+            os.path.join(output_dir, ic50_filename),
+        )
+        for k, shard_out in enumerate(shard_outs):
+            for name in os.listdir(shard_out):
+                if not name.endswith(".png"):
+                    continue
+                dest = os.path.join(output_dir, name)
+                if os.path.exists(dest):
+                    dest = os.path.join(output_dir, f"shard{k + 1}_{name}")
+                shutil.move(os.path.join(shard_out, name), dest)
+    finally:
+        shutil.rmtree(shard_root, ignore_errors=True)
+
+
+def _worker_setting(settings, key, default):
+    """The worker-count setting key as a positive int, capped at the machine's core count."""
     try:
-        file_stream = BytesIO(file_bytes)
-        file_stream.seek(0)
+        workers = int(settings.get(key, default))
+    except (TypeError, ValueError):
+        workers = default
+    return max(1, min(workers, os.cpu_count() or 1))
+
 
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp_excel:
-            tmp_excel.write(file_stream.read())
-            excel_path = tmp_excel.name
+def _fit_options(settings, include_lod_override=None):
+    """(r2_threshold, include_lod) for a fit, falling back to settings."""
+    r2_threshold = float(settings.get("sigmoid_r2_threshold", 0.5))
+    if include_lod_override is not None:
+        include_lod = include_lod_override
+    else:
+        include_lod = settings.get("lod_censor_include", False)
+    return r2_threshold, bool(include_lod)
+
+
+def _fit_script_version():
+    """Changes whenever fit_sigmoids.R would produce different fits."""
+    with open(os.path.join(os.getcwd(), "fit_sigmoids.R"), "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _fit_key(sigmoid_sha, r2_threshold, include_lod):
+    """Cache key of one fitting variant: the sigmoidData hash plus every option the IC50s depend on."""
+    options = {"data": sigmoid_sha, "r2": r2_threshold, "lod": include_lod,
+               "version": _fit_script_version()}
+    return hashlib.sha256(json.dumps(options, sort_keys=True).encode()).hexdigest()
+
+
+def _find_fitting(file_id, fit_key):
+    """fitting_id of a stored fitting variant of file_id, or None."""
+    file_info = in_memory_files.get(file_id)
+    fitting_id = (file_info.get("fittings") or {}).get(fit_key) if file_info else None
+    return fitting_id if fitting_id and fitting_id in in_memory_files else None
+
+
+def _cached_fitting(file_id, include_lod_override=None):
+    """
+    fitting_id of an already computed fit of file_id with these options and
+    the current R² threshold, or None (also None before its first fit, when
+    the sigmoidData hash is not known yet).
+    """
+    file_info = in_memory_files.get(file_id)
+    sigmoid_sha = file_info.get("sigmoid_sha") if file_info else None
+    if not sigmoid_sha:
+        return None
+    options = _fit_options(load_settings(), include_lod_override)
+    return _find_fitting(file_id, _fit_key(sigmoid_sha, *options))
+
+
+def _link_fitting(file_id, fitting_id, sigmoid_sha=None, fit_key=None):
+    """
+    Make fitting_id the file's current fitting (recording it as a cached
+    variant under fit_key); a cached comparison is cleared when it changes.
+    """
+    file_info = in_memory_files.get(file_id)
+    if file_info is None:
+        return
+    changed = file_info.get("fitting_id") != fitting_id
+    fields = {"fitting_id": fitting_id} if changed else {}
+    if fit_key:
+        fields["sigmoid_sha"] = sigmoid_sha
+        fields["fittings"] = {**(file_info.get("fittings") or {}), fit_key: fitting_id}
+    if fields:
+        in_memory_files.update(file_id, fields, drop=("comparison_id",) if changed else ())
+    if changed:
+        events.publish(file_id, "fitting", {"fitting_id": fitting_id})
+
+
+def _run_fitting(job, file_id, include_lod_override=None):
+    """
+    Job body: run fit_sigmoids.R for the given file_id and store results in memory.
+    include_lod_override: True/False to override settings, None to use settings.
 
-        output_dir = tempfile.mkdtemp(prefix="sigmoid_")
+    Each variant (R² threshold, LOD mode) is kept under _fit_key() and
+    reused when asked for again.  A new LOD mode of a stored fit is
+    relabelled from its IC50s (relabel_ic50_lod) instead of re-fitted.
+    Returns {"fitting_id": …}; raises JobFailed with the message to show.
+    """
+    file_info = in_memory_files.get(file_id)
+    if file_info is None:
+        raise JobFailed(_missing(file_id, "No Excel file found for curve fitting."))
+    filename = file_info["name"]
 
+    output_dir = tempfile.mkdtemp(prefix="sigmoid_")
+    try:
+        job.set_stage("Preparing sigmoid data", 0.05)
         sigmoid_csv_path = os.path.join(output_dir, "sigmoidData.csv")
-        generate_sigmoid_csv(excel_path, sigmoid_csv_path)
+        write_sigmoid_csv(_get_run(file_info), sigmoid_csv_path)
+        with open(sigmoid_csv_path, "rb") as f:
+            sigmoid_sha = hashlib.sha256(f.read()).hexdigest()
 
         settings = load_settings()
+        r2_value, lod_bool = _fit_options(settings, include_lod_override)
+        fit_key = _fit_key(sigmoid_sha, r2_value, lod_bool)
+        cached_id = _find_fitting(file_id, fit_key)
+        if cached_id:
+            logger.info("FITTING  reusing stored fit %s", cached_id[:8])
+            _link_fitting(file_id, cached_id, sigmoid_sha, fit_key)
+            return {"fitting_id": cached_id}
+
         include_timestamp = settings.get("timestamp_in_filename", True)
 
         assay_title = os.path.splitext(filename)[0]
@@ -1198,24 +2139,8 @@ def _run_fitting(file_id, include_lod_override=None):
 
         r_script = os.path.join(os.getcwd(), "fit_sigmoids.R")
         r2_threshold = str(settings.get("sigmoid_r2_threshold", 0.5))
-
-        if include_lod_override is not None:
-            lod_bool = include_lod_override
-        else:
-            lod_bool = settings.get("lod_censor_include", False)
         include_lod = "TRUE" if lod_bool else "FALSE"
 
-        _proc_start = time.time()
-        logger.info("FITTING  starting fit_sigmoids.R \u2026")
-        subprocess.run(
-            ["Rscript", r_script, sigmoid_csv_path, output_dir, assay_title, timestamp, r2_threshold, include_lod],
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-        )
-        logger.info("FITTING  R complete in %.1fs", time.time() - _proc_start)
-
         if assay_title and timestamp:
             ic50_filename = f"IC50s_{assay_title}_{timestamp}.csv"
         elif assay_title:
@@ -1226,6 +2151,30 @@ def _run_fitting(file_id, include_lod_override=None):
             ic50_filename = "IC50s.csv"
 
         ic50_path = os.path.join(output_dir, ic50_filename)
+
+        _proc_start = time.time()
+        sibling_id = _find_fitting(file_id, _fit_key(sigmoid_sha, r2_value, not lod_bool))
+        if sibling_id:
+            job.set_stage("Applying LOD censoring to stored fit", 0.5)
+            sibling = in_memory_files[sibling_id]
+            with open(ic50_path, "wb") as f:
+                f.write(relabel_ic50_lod(
+                    sibling["data"][sibling["ic50_filename"]], sigmoid_csv_path, lod_bool))
+            logger.info("FITTING  relabelled stored fit %s (include LOD: %s)", sibling_id[:8], lod_bool)
+        else:
+            job.set_stage("Fitting curves (R)", 0.1)
+            logger.info("FITTING  starting fit_sigmoids.R \u2026")
+            _run_fit_sigmoids_r(
+                r_script, sigmoid_csv_path, output_dir, ic50_filename,
+                [assay_title, timestamp, r2_threshold, include_lod],
+                workers=_worker_setting(settings, "fitting_workers", 1),
+                cancel=job.cancel_event,
+                progress=lambda done, total: job.set_stage(
+                    f"Fitting curves (R) \u00b7 {done}/{total} shards", 0.1 + 0.8 * done / total),
+            )
+            logger.info("FITTING  R complete in %.1fs", time.time() - _proc_start)
+
+        job.set_stage("Collecting results", 0.9)
         plot_files = [f for f in os.listdir(output_dir) if f.endswith('.png')]
 
         output_files = {}
@@ -1240,11 +2189,6 @@ def _run_fitting(file_id, include_lod_override=None):
             with open(plot_path, 'rb') as f:
                 output_files[plot_file] = f.read()
 
-        os.remove(excel_path)
-        for f in os.listdir(output_dir):
-            os.remove(os.path.join(output_dir, f))
-        os.rmdir(output_dir)
-
         fitting_id = uuid.uuid4().hex
         in_memory_files[fitting_id] = {
             "data": output_files,
@@ -1253,66 +2197,103 @@ def _run_fitting(file_id, include_lod_override=None):
             "ic50_filename": ic50_filename,
             "excel_file_id": file_id,
             "include_lod": lod_bool,
+            "r2_threshold": r2_value,
         }
         # Store fitting_id server-side so analysis hub can unlock comparison card
         # Also clear any cached comparison since the IC50s have changed
-        in_memory_files[file_id]["fitting_id"] = fitting_id
-        in_memory_files[file_id].pop("comparison_id", None)
-
-        _proc_elapsed = round(time.time() - _proc_start, 1)
-        return render_template(
-            "curve_fitting_results.html",
-            fitting_id=fitting_id,
-            excel_file_id=file_id,
-            output_files=list(output_files.keys()),
-            ic50_filename=ic50_filename,
-            lod_used=lod_bool,
-            settings=load_settings(),
-            processing_time=_proc_elapsed,
-        )
+        _link_fitting(file_id, fitting_id, sigmoid_sha, fit_key)
+        _prerender_pool.submit(_prerender_sigmoid_graphs, fitting_id, lod_bool)
+        return {"fitting_id": fitting_id}
 
     except subprocess.CalledProcessError as e:
-        flash(f"R script failed: {e.stderr}", "danger")
-        return redirect(url_for("analysis_hub", file_id=file_id))
+        raise JobFailed(f"R script failed: {e.stderr}")
+    except (JobFailed, RCancelled, JobCancelled):
+        raise
     except Exception as e:
-        flash(f"Curve fitting error: {str(e)}", "danger")
-        return redirect(url_for("analysis_hub", file_id=file_id))
+        if job.cancel_event.is_set():
+            raise
+        logger.exception("FITTING  failed for %s", file_id)
+        raise JobFailed(f"Curve fitting error: {str(e)}")
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
+def _queue_fitting(file_id, include_lod_override=None):
+    """Queue (or join the identical running) fitting job for file_id."""
+    return job_queue.submit(
+        "fitting", _holding(_run_fitting, file_id), file_id, include_lod_override,
+        meta={"file_id": file_id, "include_lod": include_lod_override},
+    )
+
+
+def _submit_fitting(file_id, include_lod_override=None):
+    """Queue a fitting job for file_id and send the browser to its progress page."""
+    job = _queue_fitting(file_id, include_lod_override)
+    return redirect(url_for("job_page", job_id=job.id))
+
+
+def _render_fitting_results(fitting_id, processing_time=None):
+    info = in_memory_files[fitting_id]
+    return render_template(
+        "curve_fitting_results.html",
+        fitting_id=fitting_id,
+        excel_file_id=info["excel_file_id"],
+        output_files=list(info["data"].keys()),
+        ic50_filename=info["ic50_filename"],
+        lod_used=info.get("include_lod", load_settings().get("lod_censor_include", False)),
+        settings=load_settings(),
+        processing_time=processing_time,
+    )
 
 
 @app.route("/perform_curve_fitting", methods=["POST"])
 def perform_curve_fitting():
     file_id = request.form.get("file_id")
     if not file_id or file_id not in in_memory_files:
-        flash("No Excel file found for curve fitting.", "danger")
+        flash(_missing(file_id, "No Excel file found for curve fitting."), "danger")
         return redirect(url_for("index"))
 
     file_info = in_memory_files[file_id]
 
     # Return cached results immediately if already computed for this file
+    # (unless the R² threshold has been changed since)
     existing_fitting_id = file_info.get("fitting_id")
     if existing_fitting_id and existing_fitting_id in in_memory_files:
-        return redirect(url_for("curve_fitting_results", fitting_id=existing_fitting_id))
+        r2_threshold = float(load_settings().get("sigmoid_r2_threshold", 0.5))
+        if in_memory_files[existing_fitting_id].get("r2_threshold", r2_threshold) == r2_threshold:
+            return redirect(url_for("curve_fitting_results", fitting_id=existing_fitting_id))
 
-    return _run_fitting(file_id)
+    cached_id = _cached_fitting(file_id)
+    if cached_id:
+        _link_fitting(file_id, cached_id)
+        return redirect(url_for("curve_fitting_results", fitting_id=cached_id))
+
+    return _submit_fitting(file_id)
 
 
 @app.route("/refit_sigmoids", methods=["POST"])
 def refit_sigmoids():
-    """Re-run fitting with a toggled LOD setting, bypassing the cache."""
+    """Show the fit with a toggled LOD setting, fitting only if that variant isn't stored yet."""
     file_id = request.form.get("file_id")
     if not file_id or file_id not in in_memory_files:
-        flash("No Excel file found for curve fitting.", "danger")
+        flash(_missing(file_id, "No Excel file found for curve fitting."), "danger")
         return redirect(url_for("index"))
 
     raw = request.form.get("include_lod", "false").strip().lower()
     include_lod_override = raw == "true"
 
-    return _run_fitting(file_id, include_lod_override=include_lod_override)
+    cached_id = _cached_fitting(file_id, include_lod_override)
+    if cached_id:
+        _link_fitting(file_id, cached_id)
+        return redirect(url_for("curve_fitting_results", fitting_id=cached_id))
+
+    return _submit_fitting(file_id, include_lod_override=include_lod_override)
+
 
 @app.route("/download_sigmoid/<fitting_id>/<filename>")
 def download_sigmoid(fitting_id, filename):
     if fitting_id not in in_memory_files:
-        flash("Fitting results not found.", "danger")
+        flash(_missing(fitting_id, "Fitting results not found."), "danger")
         return redirect(url_for("index"))
 
     file_info = in_memory_files[fitting_id]
@@ -1351,12 +2332,118 @@ def download_sigmoid(fitting_id, filename):
     )
 
 
+# Quality filters offered on the results page (All, Good, Unstable, Poor Fit),
+# as (good, unstable, poor_fit), most used first
+SIGMOID_GRAPH_FILTERS = (
+    (True, True, True),
+    (True, False, False),
+    (False, True, False),
+    (False, False, True),
+)
+PRERENDER_IDLE_WAIT = 120   # seconds a pre-render waits for running jobs to finish
+
+_graph_locks = {}
+_graph_locks_lock = threading.Lock()
+_graph_cache_lock = threading.Lock()
+_prerender_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prerender")
+
+
+def _graph_key(good, unstable, poor_fit, show_lod):
+    return "".join("1" if flag else "0" for flag in (good, unstable, poor_fit, show_lod))
+
+
+def _graph_lock(fitting_id, key):
+    """Lock serialising renders of one graph, so concurrent requests share a render."""
+    with _graph_locks_lock:
+        if len(_graph_locks) > 512:
+            for k in [k for k, lock in _graph_locks.items() if not lock.locked()]:
+                del _graph_locks[k]
+        return _graph_locks.setdefault((fitting_id, key), threading.Lock())
+
+
+def _render_sigmoid_graph(file_info, good, unstable, poor_fit, show_lod):
+    """Run plot_sigmoids.R on a fitting's sigmoidData and IC50s; returns the PNG bytes."""
+    tmp_dir = tempfile.mkdtemp(prefix="sigplot_")
+    try:
+        raw_csv = os.path.join(tmp_dir, "sigmoidData.csv")
+        with open(raw_csv, "wb") as f:
+            f.write(file_info["data"]["sigmoidData.csv"])
+
+        ic50_filename = file_info["ic50_filename"]
+        ic50_csv = os.path.join(tmp_dir, ic50_filename)
+        with open(ic50_csv, "wb") as f:
+            f.write(file_info["data"][ic50_filename])
+
+        output_png = os.path.join(tmp_dir, "sigmoid_combined.png")
+
+        r_script = os.path.join(os.getcwd(), "plot_sigmoids.R")
+        run_rscript(
+            ["Rscript", r_script, raw_csv, ic50_csv, output_png,
+             str(good).lower(), str(unstable).lower(),
+             str(show_lod).lower(), str(poor_fit).lower()],
+        )
+
+        with open(output_png, "rb") as f:
+            return f.read()
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _sigmoid_graph(fitting_id, good, unstable, poor_fit, show_lod):
+    """
+    PNG of a fitting's sigmoid curves with these filters, from the fitting's
+    "sigmoid_graphs" cache or rendered (and cached) on first use.
+    None if the fitting is no longer stored.
+    """
+    key = _graph_key(good, unstable, poor_fit, show_lod)
+    with _graph_lock(fitting_id, key):
+        file_info = in_memory_files.get(fitting_id)
+        if file_info is None:
+            return None
+        png_bytes = (file_info.get("sigmoid_graphs") or {}).get(key)
+        if png_bytes is not None:
+            return png_bytes
+
+        _t = time.time()
+        png_bytes = _render_sigmoid_graph(file_info, good, unstable, poor_fit, show_lod)
+        logger.info("GRAPHS   %s [%s] rendered in %.1fs", fitting_id[:8], key, time.time() - _t)
+        with _graph_cache_lock:
+            file_info = in_memory_files.get(fitting_id)
+            if file_info is not None:
+                graphs = {**(file_info.get("sigmoid_graphs") or {}), key: png_bytes}
+                in_memory_files.update(fitting_id, {"sigmoid_graphs": graphs})
+        return png_bytes
+
+
+def _prerender_sigmoid_graphs(fitting_id, show_lod):
+    """
+    Render the results page's filter combinations ahead of time, one at a
+    time on the pre-render thread.  Only the default view goes straight
+    away; the rest wait (up to PRERENDER_IDLE_WAIT) for running jobs to
+    finish so they do not compete with them for R.
+    """
+    for n, (good, unstable, poor_fit) in enumerate(SIGMOID_GRAPH_FILTERS):
+        deadline = time.time() + PRERENDER_IDLE_WAIT
+        while n and job_queue.active_jobs() and time.time() < deadline:
+            time.sleep(1)
+        try:
+            if _sigmoid_graph(fitting_id, good, unstable, poor_fit, show_lod) is None:
+                return
+        except Exception as e:
+            logger.warning("GRAPHS   pre-render for %s stopped: %s", fitting_id[:8], e)
+            return
+
+
 @app.route("/cached_sigmoid_graph/<fitting_id>")
 def cached_sigmoid_graph(fitting_id):
-    """Serve the last-generated sigmoid PNG from in-memory cache (no R re-run)."""
+    """Serve the last-generated (or pre-rendered default) sigmoid PNG from memory (no R re-run)."""
     if fitting_id not in in_memory_files:
         return "", 404
-    png_bytes = in_memory_files[fitting_id].get("data", {}).get("sigmoid_combined.png")
+    file_info = in_memory_files[fitting_id]
+    png_bytes = file_info.get("data", {}).get("sigmoid_combined.png")
+    if not png_bytes:
+        default = _graph_key(*SIGMOID_GRAPH_FILTERS[0], file_info.get("include_lod", False))
+        png_bytes = (file_info.get("sigmoid_graphs") or {}).get(default)
     if not png_bytes:
         return "", 404
     return send_file(BytesIO(png_bytes), mimetype="image/png")
@@ -1365,7 +2452,7 @@ def cached_sigmoid_graph(fitting_id):
 @app.route("/generate_sigmoid_graph/<fitting_id>")
 def generate_sigmoid_graph(fitting_id):
     if fitting_id not in in_memory_files:
-        return jsonify({"error": "Fitting results not found"}), 404
+        return jsonify({"error": _missing(fitting_id, "Fitting results not found")}), 404
 
     file_info = in_memory_files[fitting_id]
     if file_info.get("type") != "sigmoid_results":
@@ -1382,37 +2469,15 @@ def generate_sigmoid_graph(fitting_id):
         _plot_settings_lod = load_settings()
         show_lod_bool = _plot_settings_lod.get("lod_censor_include", False)
 
-    tmp_dir = None
     try:
-        tmp_dir = tempfile.mkdtemp(prefix="sigplot_")
-
-        raw_csv = os.path.join(tmp_dir, "sigmoidData.csv")
-        with open(raw_csv, "wb") as f:
-            f.write(file_info["data"]["sigmoidData.csv"])
-
-        ic50_filename = file_info["ic50_filename"]
-        ic50_csv = os.path.join(tmp_dir, ic50_filename)
-        with open(ic50_csv, "wb") as f:
-            f.write(file_info["data"][ic50_filename])
-
-        output_png = os.path.join(tmp_dir, "sigmoid_combined.png")
-
-        r_script = os.path.join(os.getcwd(), "plot_sigmoids.R")
-        subprocess.run(
-            ["Rscript", r_script, raw_csv, ic50_csv, output_png,
-             str(show_good).lower(), str(show_unstable).lower(),
-             str(show_lod_bool).lower(), str(show_poor_fit).lower()],
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-        )
-
-        with open(output_png, "rb") as f:
-            png_bytes = f.read()
+        png_bytes = _sigmoid_graph(fitting_id, show_good, show_unstable, show_poor_fit, show_lod_bool)
+        if png_bytes is None:
+            return jsonify({"error": _missing(fitting_id, "Fitting results not found")}), 404
 
         # Store latest render for download
-        in_memory_files[fitting_id]["data"]["sigmoid_combined.png"] = png_bytes
+        file_info = in_memory_files.get(fitting_id) or file_info
+        if file_info["data"].get("sigmoid_combined.png") != png_bytes:
+            in_memory_files.update(fitting_id, {"data": {**file_info["data"], "sigmoid_combined.png": png_bytes}})
 
         return send_file(BytesIO(png_bytes), mimetype="image/png")
 
@@ -1420,17 +2485,6 @@ def generate_sigmoid_graph(fitting_id):
         return jsonify({"error": f"R script failed: {e.stderr}"}), 500
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-    finally:
-        if tmp_dir and os.path.exists(tmp_dir):
-            for fn in os.listdir(tmp_dir):
-                try:
-                    os.remove(os.path.join(tmp_dir, fn))
-                except Exception:
-                    pass
-            try:
-                os.rmdir(tmp_dir)
-            except Exception:
-                pass
 
 
 # ════════════════════════════════════════════════════════════════
@@ -1444,71 +2498,98 @@ def compare_titres():
     fitting_id = request.form.get("fitting_id")
     
     if not excel_file_id or excel_file_id not in in_memory_files:
-        flash("Excel results not found.", "danger")
+        flash(_missing(excel_file_id, "Excel results not found."), "danger")
         return redirect(url_for("index"))
     
     if not fitting_id or fitting_id not in in_memory_files:
-        flash("Curve fitting results not found. Please perform curve fitting first.", "danger")
+        flash(_missing(fitting_id, "Curve fitting results not found. Please perform curve fitting first."), "danger")
         return redirect(url_for("index"))
 
-    return _run_comparison(excel_file_id, fitting_id)
+    return _submit_comparison(excel_file_id, fitting_id)
 
 
-def _run_comparison(excel_file_id, fitting_id):
+def _submit_comparison(excel_file_id, fitting_id):
     """
-    Shared comparison logic used by both POST and GET routes.
-    
-    R now handles both the NT50 linear interpolation (reading Plate sheets
-    directly from the Excel file) and the IC50 comparison, so Python just
-    orchestrates temp files and reads back the CSV results.
+    Shared by both POST and GET routes: check the fitting results, queue a
+    comparison job and send the browser to its progress page.
     """
-    try:
-        excel_info = in_memory_files[excel_file_id]
-        excel_bytes = BytesIO(excel_info["data"])
+    problem = _comparison_problem(in_memory_files[fitting_id])
+    if problem:
+        flash(problem, "danger")
+        return redirect(url_for("index"))
 
-        fitting_info = in_memory_files[fitting_id]
-        if fitting_info.get("type") != "sigmoid_results":
-            flash("Invalid fitting results.", "danger")
-            return redirect(url_for("index"))
+    job = _queue_comparison(excel_file_id, fitting_id)
+    return redirect(url_for("job_page", job_id=job.id))
 
-        ic50_filename = fitting_info.get("ic50_filename", "IC50s.csv")
-        if ic50_filename not in fitting_info["data"]:
-            flash("IC50 file not found in fitting results.", "danger")
-            return redirect(url_for("index"))
 
+def _comparison_problem(fitting_info):
+    """Why these fitting results can't be compared, or None."""
+    if fitting_info.get("type") != "sigmoid_results":
+        return "Invalid fitting results."
+    if fitting_info.get("ic50_filename", "IC50s.csv") not in fitting_info["data"]:
+        return "IC50 file not found in fitting results."
+    return None
+
+
+def _queue_comparison(excel_file_id, fitting_id):
+    """Queue (or join the identical running) comparison job."""
+    return job_queue.submit(
+        "comparison", _holding(_run_comparison, excel_file_id, fitting_id), excel_file_id, fitting_id,
+        meta={"file_id": excel_file_id, "fitting_id": fitting_id},
+    )
+
+
+def _run_comparison(job, excel_file_id, fitting_id):
+    """
+    Job body for the titre comparison.
+
+    R handles both the NT50 linear interpolation (from the run's plateData.csv
+    hand-off) and the IC50 comparison, so Python just orchestrates temp files
+    and reads back the CSV results.  Returns {"comparison_id": …}; raises
+    JobFailed with the message to show.
+    """
+    excel_info = in_memory_files.get(excel_file_id)
+    fitting_info = in_memory_files.get(fitting_id)
+    if excel_info is None:
+        raise JobFailed(_missing(excel_file_id, "Excel results not found."))
+    if fitting_info is None:
+        raise JobFailed(_missing(fitting_id, "Curve fitting results not found."))
+
+    work_dir = tempfile.mkdtemp(prefix="comparison_")
+    try:
+        job.set_stage("Preparing plate data", 0.05)
+        ic50_filename = fitting_info.get("ic50_filename", "IC50s.csv")
         ic50_bytes = fitting_info["data"][ic50_filename]
 
-        # Write Excel and IC50 CSV to temp files for R
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp_excel:
-            tmp_excel.write(excel_bytes.getvalue())
-            excel_path = tmp_excel.name
+        # Write the plate data and IC50 CSV to temp files for R
+        plate_data_path = os.path.join(work_dir, "plateData.csv")
+        write_plate_data_csv(_get_run(excel_info), plate_data_path)
 
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".csv") as tmp_ic50:
-            tmp_ic50.write(ic50_bytes)
-            ic50_path = tmp_ic50.name
+        ic50_path = os.path.join(work_dir, ic50_filename)
+        with open(ic50_path, "wb") as f:
+            f.write(ic50_bytes)
 
-        output_dir = tempfile.mkdtemp(prefix="comparison_")
+        output_dir = os.path.join(work_dir, "output")
+        os.makedirs(output_dir)
 
-        # R now receives the Excel file directly (not a pre-computed NT50 CSV)
         r_script = os.path.join(os.getcwd(), "compare_titres.R")
         cmp_settings = load_settings()
         disagreement_threshold = str(cmp_settings.get("comparison_disagreement_threshold", 1.0))
 
+        job.set_stage("Comparing titres (R)", 0.15)
         _proc_start = time.time()
         logger.info("COMPARE  starting compare_titres.R \u2026")
-        result = subprocess.run(
-            ["Rscript", r_script, excel_path, ic50_path, output_dir, disagreement_threshold],
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
+        result = run_rscript(
+            ["Rscript", r_script, plate_data_path, ic50_path, output_dir, disagreement_threshold],
             timeout=180,
+            cancel=job.cancel_event,
         )
         logger.info("COMPARE  R complete in %.1fs", time.time() - _proc_start)
 
         if result.stderr:
             logger.warning("compare_titres.R stderr:\n%s", result.stderr.strip())
 
+        job.set_stage("Reading results", 0.9)
         # Collect output files
         output_files = {}
         for fname in ['comparison_stats.csv', 'merged_titres.csv',
@@ -1519,19 +2600,13 @@ def _run_comparison(excel_file_id, fitting_id):
                 with open(filepath, 'rb') as f:
                     output_files[fname] = f.read()
 
-        # Clean up temp files
-        os.remove(excel_path)
-        os.remove(ic50_path)
-        for f in os.listdir(output_dir):
-            os.remove(os.path.join(output_dir, f))
-        os.rmdir(output_dir)
-
         # Store results in memory
         comparison_id = uuid.uuid4().hex
         in_memory_files[comparison_id] = {
             "data": output_files,
             "name": "titre_comparison",
-            "type": "comparison_results"
+            "type": "comparison_results",
+            "excel_file_id": excel_file_id,
         }
 
         # Parse stats and mismatches for template rendering
@@ -1566,41 +2641,51 @@ def _run_comparison(excel_file_id, fitting_id):
 
         # Cache parsed render data so future visits skip reprocessing
         has_plot = 'titre_comparison.png' in output_files
-        in_memory_files[comparison_id]["stats"]      = stats
-        in_memory_files[comparison_id]["mismatches"] = mismatches
-        in_memory_files[comparison_id]["has_plot"]   = has_plot
+        in_memory_files.update(comparison_id, {
+            "stats":      stats,
+            "mismatches": mismatches,
+            "has_plot":   has_plot,
+        })
         # Store back-reference so the hub and compare_titres_page can find the cache
-        in_memory_files[excel_file_id]["comparison_id"] = comparison_id
+        in_memory_files.update(excel_file_id, {"comparison_id": comparison_id})
 
-        _proc_elapsed = round(time.time() - _proc_start, 1)
-        return render_template(
-            "titre_comparison_results.html",
-            comparison_id=comparison_id,
-            excel_file_id=excel_file_id,
-            stats=stats,
-            mismatches=mismatches,
-            has_plot=has_plot,
-            settings=load_settings(),
-            processing_time=_proc_elapsed,
-        )
+        events.publish(excel_file_id, "comparison", {"comparison_id": comparison_id})
+        return {"comparison_id": comparison_id}
 
     except subprocess.TimeoutExpired:
-        flash("Comparison timed out (>3 min). Check your terminal for R output.", "danger")
-        return redirect(url_for("analysis_hub", file_id=excel_file_id))
+        raise JobFailed("Comparison timed out (>3 min). Check your terminal for R output.")
     except subprocess.CalledProcessError as e:
         logger.error("compare_titres.R FAILED\nSTDOUT: %s\nSTDERR: %s", e.stdout, e.stderr)
-        flash(f"R script failed — see terminal for details. Error: {(e.stderr or e.stdout or '').strip()[:300]}", "danger")
-        return redirect(url_for("analysis_hub", file_id=excel_file_id))
+        raise JobFailed(f"R script failed — see terminal for details. Error: {(e.stderr or e.stdout or '').strip()[:300]}")
+    except (JobFailed, RCancelled, JobCancelled):
+        raise
     except Exception as e:
+        if job.cancel_event.is_set():
+            raise
         logger.exception("_run_comparison exception: %s", e)
-        flash(f"Comparison error: {str(e)}", "danger")
-        return redirect(url_for("analysis_hub", file_id=excel_file_id))
+        raise JobFailed(f"Comparison error: {str(e)}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _render_comparison_results(comparison_id, excel_file_id, processing_time=None):
+    cached = in_memory_files[comparison_id]
+    return render_template(
+        "titre_comparison_results.html",
+        comparison_id=comparison_id,
+        excel_file_id=excel_file_id,
+        stats=cached["stats"],
+        mismatches=cached["mismatches"],
+        has_plot=cached["has_plot"],
+        settings=load_settings(),
+        processing_time=processing_time,
+    )
 
 
 @app.route("/download_comparison/<comparison_id>/<filename>")
 def download_comparison(comparison_id, filename):
     if comparison_id not in in_memory_files:
-        flash("Comparison results not found.", "danger")
+        flash(_missing(comparison_id, "Comparison results not found."), "danger")
         return redirect(url_for("index"))
     
     file_info = in_memory_files[comparison_id]
@@ -1644,6 +2729,415 @@ def download_comparison(comparison_id, filename):
     )
 
 
+# ════════════════════════════════════════════════════════════════
+# JSON API (v1) — headless access for LIMS and scripts
+# ════════════════════════════════════════════════════════════════
+#
+# Same inputs and results as the HTML routes, as JSON: no templates or
+# flash messages, and the read routes work from the stored run alone
+# (settings are only read when something is submitted).  Submissions are
+# asynchronous: POST returns 202 with the job's URL to poll, unless
+# ?wait=N (seconds, max API_MAX_WAIT) sees the job finish first, in which
+# case the result itself comes back.
+
+API_MAX_WAIT = 60
+FIT_NUMERIC_COLUMNS = ("Lower", "Upper", "Slope", "IC50", "Titre", "R2")
+QC_FIELDS = ("type", "plate", "quadrant", "pseudotype", "sample_id", "dilution",
+             "rep1", "rep2", "rep3", "flagged", "log2_fold_diff")
+
+
+def _api_error(message, code):
+    return jsonify({"status": "error", "message": message}), code
+
+
+def _api_entry(key, kind):
+    """The stored run / fitting / comparison (kind "run", "fit", "comparison") for key, or None."""
+    entry = in_memory_files.get(key) if key else None
+    if entry is None:
+        return None
+    if kind == "run":
+        return entry if "run" in entry else None
+    return entry if entry.get("type") == {"fit": "sigmoid_results",
+                                          "comparison": "comparison_results"}[kind] else None
+
+
+def _api_missing(key, what):
+    return _api_error(_missing(key, f"{what} not found"), 404)
+
+
+def _api_number(value):
+    """A CSV cell as a float, None for blank / NA."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _csv_records(data, numeric=()):
+    """Rows of CSV bytes as dicts, the `numeric` columns converted with _api_number."""
+    rows = list(csv.DictReader(data.decode("utf-8-sig").splitlines()))
+    for row in rows:
+        for col in numeric:
+            if col in row:
+                row[col] = _api_number(row[col])
+    return rows
+
+
+def _api_run(file_id, file_info):
+    """The run's description: labels, QC summary, status and the URLs of everything it has."""
+    run = _get_run(file_info)
+    export = file_info.get("export") or {}
+    fitting_id = file_info.get("fitting_id")
+    comparison_id = file_info.get("comparison_id")
+    return {
+        "status": "success",
+        "run_id": file_id,
+        "name": file_info["name"],
+        "assay_title": run.assay_title,
+        "plates": list(run.names),
+        "plots_ready": bool(file_info.get("plots_ready")),
+        "qc": {
+            "error_flagging": bool(export.get("error_flagging")),
+            "outlier_threshold_log2": export.get("outlier_threshold_log2", 1.0),
+            "flagged_triplicates": run.error_count if run.errors_flagged else None,
+        },
+        "fitting_id": fitting_id if fitting_id in in_memory_files else None,
+        "comparison_id": comparison_id if comparison_id in in_memory_files else None,
+        "links": {
+            "self": url_for("api_run", run_id=file_id),
+            "titres": url_for("api_run_titres", run_id=file_id),
+            "qc": url_for("api_run_qc", run_id=file_id),
+            "fits": url_for("api_run_fits", run_id=file_id),
+            "comparisons": url_for("api_run_comparisons", run_id=file_id),
+            "workbook": url_for("download_memory", file_id=file_id),
+            "summary_plot": url_for("summary_plot", file_id=file_id),
+            "plate_plots": {name: url_for("plate_plot", file_id=file_id, plate=name) for name in run.names},
+            "hub": url_for("analysis_hub", file_id=file_id),
+        },
+    }
+
+
+def _api_fit(fitting_id, info):
+    """A fitting's options, per-quadrant IC50 rows and file URLs."""
+    ic50 = info["data"].get(info.get("ic50_filename", "IC50s.csv"))
+    return {
+        "status": "success",
+        "fitting_id": fitting_id,
+        "run_id": info["excel_file_id"],
+        "include_lod": info.get("include_lod"),
+        "r2_threshold": info.get("r2_threshold"),
+        "data": _csv_records(ic50, FIT_NUMERIC_COLUMNS) if ic50 else [],
+        "links": {
+            "self": url_for("api_fit", fitting_id=fitting_id),
+            "files": {name: url_for("download_sigmoid", fitting_id=fitting_id, filename=name)
+                      for name in info["data"]},
+        },
+    }
+
+
+def _api_comparison(comparison_id, info):
+    """A comparison's statistics, mismatches, merged titre rows and file URLs."""
+    merged = info["data"].get("merged_titres.csv")
+    rows = _csv_records(merged) if merged else []
+    for row in rows:
+        for col, value in row.items():
+            if col not in ("Plate", "Quadrant", "Sample_ID", "Pseudotype", "Sigmoid Quality"):
+                number = _api_number(value)
+                row[col] = number if number is not None or value in ("", "NA") else value
+    return {
+        "status": "success",
+        "comparison_id": comparison_id,
+        "run_id": info["excel_file_id"],
+        "stats": info.get("stats", {}),
+        "mismatches": info.get("mismatches", []),
+        "data": rows,
+        "links": {
+            "self": url_for("api_comparison", comparison_id=comparison_id),
+            "files": {name: url_for("download_comparison", comparison_id=comparison_id, filename=name)
+                      for name in info["data"]},
+        },
+    }
+
+
+def _api_result(job):
+    """(kind, id) of the resource a finished job produced, or (None, None)."""
+    result = job.result or {}
+    if job.kind == "run":
+        return "run", result.get("file_id")
+    if job.kind == "fitting":
+        return "fit", result.get("fitting_id")
+    if job.kind == "comparison":
+        return "comparison", result.get("comparison_id")
+    return None, None
+
+
+def _api_result_url(kind, key):
+    return {"run": lambda: url_for("api_run", run_id=key),
+            "fit": lambda: url_for("api_fit", fitting_id=key),
+            "comparison": lambda: url_for("api_comparison", comparison_id=key)}[kind]()
+
+
+def _api_job(job):
+    data = {"status": "success", "job": job.to_dict(), "job_url": url_for("api_job", job_id=job.id)}
+    if job.status == "done":
+        kind, key = _api_result(job)
+        if kind:
+            data["result_url"] = _api_result_url(kind, key)
+    return data
+
+
+def _api_accepted(job):
+    """
+    Response to a submission: 202 with the job to poll, or — when ?wait=N
+    sees it finish — 201 with the result (422 if it failed or was cancelled).
+    """
+    wait = min(max(request.args.get("wait", 0, type=float), 0), API_MAX_WAIT)
+    deadline = time.time() + wait
+    while True:
+        seq = events.latest_seq(job.id)
+        remaining = deadline - time.time()
+        if not job.active or remaining <= 0:
+            break
+        events.since(job.id, seq, timeout=remaining)
+
+    if job.active:
+        data = _api_job(job)
+        return jsonify(data), 202, {"Location": data["job_url"]}
+    if job.status != "done":
+        return jsonify({"status": "error", "message": job.error or f"Job {job.status}",
+                        "job": job.to_dict()}), 422
+    kind, key = _api_result(job)
+    entry = _api_entry(key, kind)
+    if entry is None:
+        return _api_missing(key, "Result")
+    body = {"run": _api_run, "fit": _api_fit, "comparison": _api_comparison}[kind](key, entry)
+    return jsonify(body), 201, {"Location": _api_result_url(kind, key)}
+
+
+def _api_inputs():
+    """
+    The /process inputs of an API upload, from a multipart form (csv_file or
+    upload_token plus the form fields) or a JSON body ("csv" holding the
+    file's text).  Lists are accepted for pseudotype_text / sample_id_text.
+    Returns (csv bytes or None, fields).
+    """
+    body = request.get_json(silent=True)
+    if isinstance(body, dict):
+        fields = dict(body)
+        csv_text = fields.pop("csv", None)
+        csv_data = csv_text.encode("utf-8") if isinstance(csv_text, str) else None
+    else:
+        fields = request.form.to_dict()
+        file = request.files.get("csv_file")
+        csv_data = file.read() if file else None
+    token = fields.pop("upload_token", "")
+    if csv_data is None and token:
+        staged = _staged_upload(token)
+        csv_data = staged["csv"] if staged else None
+    for key in ("pseudotype_text", "sample_id_text"):
+        if isinstance(fields.get(key), list):
+            fields[key] = ",".join(str(v) for v in fields[key])
+    return csv_data, fields
+
+
+def _run_upload(job, csv_data, options, template_path, settings):
+    """Job body for an API upload: parse, store the run (_start_run) and start its R plots."""
+    job.set_stage("Reading plates", 0.1)
+    try:
+        blocks, data_mode = read_plates(csv_data, options["data_mode"],
+                                        settings.get("default_data_mode", "standard"))
+        job.set_stage("Calculating titres", 0.4)
+        file_id, reused = _start_run(csv_data, dict(options, data_mode=data_mode),
+                                     template_path, settings, blocks=blocks)
+    except ValueError as e:
+        raise JobFailed(str(e))
+    if not reused:
+        file_info = in_memory_files[file_id]
+        threading.Thread(
+            target=_run_r_in_background,
+            args=_plot_job_args(file_id, file_info["run"], file_info["name"], settings),
+            daemon=True,
+        ).start()
+    return {"file_id": file_id, "reused": reused}
+
+
+@app.route("/api/v1/runs", methods=["POST"])
+def api_runs():
+    """
+    Submit a plate reader CSV with the /process inputs (assay_title,
+    pseudotype_text, sample_id_text, num_pseudotypes, plate_configs;
+    data_mode "standard", "data_only" or omitted to detect it).
+    """
+    csv_data, fields = _api_inputs()
+    if not csv_data:
+        return _api_error("No CSV uploaded (csv_file, csv or a current upload_token).", 400)
+    auto = fields.get("data_mode") in (None, "", "auto")
+    try:
+        options = run_options(fields)
+    except ValueError as e:
+        return _api_error(str(e), 400)
+    if auto:
+        options["data_mode"] = None
+    try:
+        template_path = load_template_path()
+    except Exception as e:
+        return _api_error(str(e), 500)
+
+    settings = load_settings()
+    # The same upload submitted again while it is still processing joins that job
+    job = job_queue.submit("run", _run_upload, csv_data, options, template_path, settings,
+                           meta={"upload_key": _upload_key(csv_data, template_path, options, settings)})
+    logger.info("API      run ← %r (%.1f KB) as job %s", options["assay_title"],
+                len(csv_data) / 1024, job.id[:8])
+    return _api_accepted(job)
+
+
+@app.route("/api/v1/runs/<run_id>")
+def api_run(run_id):
+    file_info = _api_entry(run_id, "run")
+    if file_info is None:
+        return _api_missing(run_id, "Run")
+    return jsonify(_api_run(run_id, file_info))
+
+
+@app.route("/api/v1/runs/<run_id>/titres")
+def api_run_titres(run_id):
+    """Per-quadrant linear titres, as /titres (?threshold=50,90)."""
+    file_info = _api_entry(run_id, "run")
+    if file_info is None:
+        return _api_missing(run_id, "Run")
+    try:
+        thresholds = parse_thresholds(request.args.get("threshold"), default=(50, 90))
+    except ValueError as e:
+        return _api_error(str(e), 400)
+    return jsonify({
+        "status": "success",
+        "run_id": run_id,
+        "titre_labels": [titre_label(t) for t in thresholds],
+        "data": _get_run(file_info).titre_rows(thresholds),
+    })
+
+
+@app.route("/api/v1/runs/<run_id>/qc")
+def api_run_qc(run_id):
+    """
+    Triplicate outliers (the Errors sheet rows) at ?threshold_log2=, by
+    default the threshold the run was flagged with.
+    """
+    file_info = _api_entry(run_id, "run")
+    if file_info is None:
+        return _api_missing(run_id, "Run")
+    default = (file_info.get("export") or {}).get("outlier_threshold_log2", 1.0)
+    threshold = request.args.get("threshold_log2", default, type=float)
+    run = _get_run(file_info)
+    dilutions = [float(d) for d in run.dilutions[0]] if len(run) else []
+    rows = []
+    for row in triplicate_error_rows(run, threshold_log2=threshold, dilution_labels=dilutions):
+        record = dict(zip(QC_FIELDS, row))
+        if record["type"] != "Raw Triplicate":
+            record["dilution"] = None   # an NT50 / NT90 replicate check, named by type
+        for rep in ("rep1", "rep2", "rep3"):
+            if not isinstance(record[rep], (int, float)):
+                record[rep] = None
+        record["flagged"] = [int(r.split()[-1]) for r in record["flagged"].split(", ") if r]
+        record["log2_fold_diff"] = float(record["log2_fold_diff"])
+        rows.append(record)
+    return jsonify({"status": "success", "run_id": run_id, "threshold_log2": threshold, "data": rows})
+
+
+@app.route("/api/v1/runs/<run_id>/fits", methods=["GET", "POST"])
+def api_run_fits(run_id):
+    """
+    GET: the run's stored fitting variants.  POST: fit sigmoids, optionally
+    with include_lod (bool); a variant that is already stored comes back at
+    once (200).
+    """
+    file_info = _api_entry(run_id, "run")
+    if file_info is None:
+        return _api_missing(run_id, "Run")
+
+    if request.method == "GET":
+        ids = {fid for fid in (file_info.get("fittings") or {}).values() if fid in in_memory_files}
+        return jsonify({
+            "status": "success",
+            "run_id": run_id,
+            "current": file_info.get("fitting_id") if file_info.get("fitting_id") in ids else None,
+            "fits": [{"fitting_id": fid, "url": url_for("api_fit", fitting_id=fid)} for fid in sorted(ids)],
+        })
+
+    body = request.get_json(silent=True) or request.form.to_dict()
+    include_lod = body.get("include_lod")
+    if isinstance(include_lod, str):
+        include_lod = include_lod.strip().lower() in ("1", "true", "yes", "on")
+
+    cached_id = _cached_fitting(run_id, include_lod)
+    if cached_id:
+        _link_fitting(run_id, cached_id)
+        return jsonify(_api_fit(cached_id, in_memory_files[cached_id]))
+    return _api_accepted(_queue_fitting(run_id, include_lod))
+
+
+@app.route("/api/v1/runs/<run_id>/comparisons", methods=["GET", "POST"])
+def api_run_comparisons(run_id):
+    """
+    GET: the run's current comparison.  POST: compare NT50 with the IC50s of
+    fitting_id (default: the run's current fitting).
+    """
+    file_info = _api_entry(run_id, "run")
+    if file_info is None:
+        return _api_missing(run_id, "Run")
+
+    if request.method == "GET":
+        comparison_id = file_info.get("comparison_id")
+        info = _api_entry(comparison_id, "comparison")
+        return jsonify({
+            "status": "success",
+            "run_id": run_id,
+            "current": comparison_id if info is not None else None,
+            "url": url_for("api_comparison", comparison_id=comparison_id) if info is not None else None,
+        })
+
+    body = request.get_json(silent=True) or request.form.to_dict()
+    fitting_id = body.get("fitting_id") or file_info.get("fitting_id")
+    fitting_info = _api_entry(fitting_id, "fit")
+    if fitting_info is None:
+        return _api_error(_missing(fitting_id, "Curve fitting results not found. Fit the run first."), 409)
+    problem = _comparison_problem(fitting_info)
+    if problem:
+        return _api_error(problem, 409)
+    return _api_accepted(_queue_comparison(run_id, fitting_id))
+
+
+@app.route("/api/v1/fits/<fitting_id>")
+def api_fit(fitting_id):
+    info = _api_entry(fitting_id, "fit")
+    if info is None:
+        return _api_missing(fitting_id, "Fitting")
+    return jsonify(_api_fit(fitting_id, info))
+
+
+@app.route("/api/v1/comparisons/<comparison_id>")
+def api_comparison(comparison_id):
+    info = _api_entry(comparison_id, "comparison")
+    if info is None:
+        return _api_missing(comparison_id, "Comparison")
+    return jsonify(_api_comparison(comparison_id, info))
+
+
+@app.route("/api/v1/jobs/<job_id>", methods=["GET", "DELETE"])
+def api_job(job_id):
+    """A submission's state (with result_url once done); DELETE cancels it."""
+    job = _find_job(job_id)
+    if job is None:
+        return _api_error("Job not found", 404)
+    if request.method == "DELETE" and not job_queue.cancel(job_id):
+        if not job.active:
+            return _api_error("Job already finished", 409)
+        # Running in another server process, whose cancel watcher acts on this
+        in_memory_files.update(job_id, {"cancel_requested": True})
+    return jsonify(_api_job(job))
+
+
 # ════════════════════════════════════════════════════════════════
 # LEGACY: Keep /results/<file_id> route as redirect to hub
 # ════════════════════════════════════════════════════════════════
@@ -0,0 +1,269 @@
+"""
+Background job queue for the long-running analyses (curve fitting, titre
+comparison, batch processing).
+
+JobQueue.submit() returns a Job straight away and runs it on a bounded thread
+pool, so request handlers never wait on R.  A running job reports its stage
+and progress through Job.set_stage(); Job.cancel_event is passed on to
+run_rscript(), which kills the underlying R process when the job is
+cancelled.
+
+EventBoard carries those stage updates (and run-level events such as "plots
+ready") to whoever is waiting: Server-Sent-Event streams and requests that
+block until a run is complete, without sleep-polling.
+"""
+
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger("ntaweb")
+
+JOB_STATUSES = ("queued", "running", "done", "failed", "cancelled")
+
+
+class EventBoard:
+    """
+    Per-key (run id / job id) sequence of named events, with blocking waits
+    on a single Condition.  Each key keeps its last `keep` events; keys with
+    no new event for `ttl` seconds are dropped.
+    """
+
+    def __init__(self, keep=50, ttl=3600):
+        self.keep = keep
+        self.ttl = ttl
+        self._cond = threading.Condition()
+        self._events = {}      # key -> [(seq, event, data), …]
+        self._touched = {}     # key -> time of last publish
+        self._seq = 0
+
+    def publish(self, key, event, data=None):
+        """Append an event for key and wake every waiter; returns its sequence number."""
+        with self._cond:
+            self._seq += 1
+            log = self._events.setdefault(key, [])
+            log.append((self._seq, event, data or {}))
+            del log[:-self.keep]
+            now = time.time()
+            self._touched[key] = now
+            for stale in [k for k, t in self._touched.items() if now - t > self.ttl]:
+                self._events.pop(stale, None)
+                self._touched.pop(stale, None)
+            self._cond.notify_all()
+            return self._seq
+
+    def latest_seq(self, key):
+        with self._cond:
+            log = self._events.get(key)
+            return log[-1][0] if log else 0
+
+    def since(self, key, after=0, timeout=None):
+        """Events for key with seq > after, waiting up to `timeout` seconds for the first one."""
+        with self._cond:
+            self._cond.wait_for(
+                lambda: any(seq > after for seq, _, _ in self._events.get(key, ())), timeout)
+            return [e for e in self._events.get(key, ()) if e[0] > after]
+
+
+class JobCancelled(Exception):
+    """Raised inside a job body when it notices it has been cancelled."""
+
+
+class JobFailed(Exception):
+    """A job failure whose message is meant for the user (flashed as-is)."""
+
+
+class Job:
+    """One submitted unit of work and its observable state."""
+
+    def __init__(self, kind, meta=None, on_change=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.meta = dict(meta or {})
+        self.status = "queued"
+        self.stage = "Queued"
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel_event = threading.Event()
+        self._on_change = on_change
+
+    @property
+    def active(self):
+        return self.status in ("queued", "running")
+
+    @property
+    def elapsed(self):
+        """Seconds spent running (so far, if still running)."""
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    def set_stage(self, stage, progress=None):
+        """Record the current stage (and 0–1 progress); raises JobCancelled if cancelled."""
+        self.check_cancelled()
+        self.stage = stage
+        if progress is not None:
+            self.progress = max(self.progress, min(1.0, float(progress)))
+        logger.info("JOB      %s %s · %s", self.id[:8], self.kind, stage)
+        self.publish()
+
+    def publish(self):
+        """Report a state change to the owning queue (event board, shared store)."""
+        if self._on_change is not None:
+            self._on_change(self)
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": round(self.progress, 3),
+            "error": self.error,
+            "elapsed": round(self.elapsed, 1),
+            "queued_for": round((self.started or time.time()) - self.created, 1),
+        }
+
+    def snapshot(self):
+        """Everything needed to rebuild this job's state in another process (see from_snapshot)."""
+        return {
+            "id": self.id, "kind": self.kind, "meta": self.meta, "status": self.status,
+            "stage": self.stage, "progress": self.progress, "result": self.result,
+            "error": self.error, "created": self.created, "started": self.started,
+            "finished": self.finished,
+        }
+
+    @classmethod
+    def from_snapshot(cls, snap):
+        """A read-only copy of a job running (or run) by another process."""
+        job = cls(snap["kind"], snap["meta"])
+        for field, value in snap.items():
+            setattr(job, field, value)
+        return job
+
+
+class JobQueue:
+    """
+    Runs jobs on `workers` threads, keeping the most recent `keep` finished
+    jobs for status lookups.  State changes are published to `events`
+    (an EventBoard) and passed to `record(job)` when those are given.
+    """
+
+    def __init__(self, workers=2, keep=200, events=None, record=None):
+        self.workers = max(1, int(workers))
+        self.keep = keep
+        self.events = events
+        self.record = record
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, kind, fn, *args, meta=None, **kwargs):
+        """
+        Queue fn(job, *args, **kwargs).  Its return value becomes job.result;
+        JobFailed / other exceptions mark the job failed.  If an identical job
+        (same kind and meta) is still queued or running, that job is returned
+        instead of starting a second one.
+        """
+        with self._lock:
+            existing = self._find_active(kind, meta or {})
+            if existing is not None:
+                return existing
+            job = Job(kind, meta, self._changed)
+            self._jobs[job.id] = job
+            self._prune()
+        job.publish()
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        logger.info("JOB      %s %s queued", job.id[:8], kind)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Request cancellation; False if the job is unknown or already finished."""
+        job = self.get(job_id)
+        if job is None or not job.active:
+            return False
+        job.cancel_event.set()
+        if job.status == "queued":
+            job.status = "cancelled"
+            job.stage = "Cancelled"
+            job.finished = time.time()
+            job.publish()
+        logger.info("JOB      %s %s cancel requested", job.id[:8], job.kind)
+        return True
+
+    def active_jobs(self):
+        with self._lock:
+            return [job for job in self._jobs.values() if job.active]
+
+    def stats(self):
+        with self._lock:
+            counts = {s: 0 for s in JOB_STATUSES}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+        return {"workers": self.workers, **counts}
+
+    def _changed(self, job):
+        if self.events is not None:
+            self.events.publish(job.id, "job", job.to_dict())
+        if self.record is not None:
+            try:
+                self.record(job)
+            except Exception:
+                logger.exception("JOB      %s could not record state", job.id[:8])
+
+    def _find_active(self, kind, meta):
+        for job in reversed(self._jobs.values()):
+            if job.kind == kind and job.meta == meta and job.active:
+                return job
+        return None
+
+    def _prune(self):
+        finished = [jid for jid, job in self._jobs.items() if not job.active]
+        for jid in finished[:max(0, len(finished) - self.keep)]:
+            del self._jobs[jid]
+
+    def _run(self, job, fn, args, kwargs):
+        if job.cancel_event.is_set():
+            return
+        job.status = "running"
+        job.stage = "Starting"
+        job.started = time.time()
+        job.publish()
+        try:
+            job.result = fn(job, *args, **kwargs)
+        except Exception as e:
+            job.finished = time.time()
+            if job.cancel_event.is_set():
+                job.status = "cancelled"
+                job.stage = "Cancelled"
+                logger.info("JOB      %s %s cancelled after %.1fs", job.id[:8], job.kind, job.elapsed)
+            else:
+                job.status = "failed"
+                job.error = str(e) or e.__class__.__name__
+                if isinstance(e, JobFailed):
+                    logger.warning("JOB      %s %s failed: %s", job.id[:8], job.kind, job.error)
+                else:
+                    logger.exception("JOB      %s %s failed", job.id[:8], job.kind)
+            job.publish()
+            return
+        job.finished = time.time()
+        job.progress = 1.0
+        job.stage = "Done"
+        job.status = "done"
+        logger.info("JOB      %s %s done in %.1fs", job.id[:8], job.kind, job.elapsed)
+        job.publish()
@@ -0,0 +1,382 @@
+"""
+Offline batch runner: process a directory (or glob) of plate reader CSVs
+without the web app, e.g. a whole archive overnight on a many-core machine.
+
+    python -m nta_batch data/ --pseudotypes "Alpha, Beta" -o results/
+
+Each CSV goes through the same code as /process and its workbook download
+(nta_utils.read_plates, run_options, WorkbookPipeline load → export →
+finish), so titres, Errors sheets and workbooks match the web app's.  Files
+are spread over a process pool (--workers, one per CPU by default); with
+--fit r each worker also fits the curves with fit_sigmoids.R, on a warm R
+worker of its own.
+
+Written to the output directory:
+    <name>.xlsx         one workbook per CSV (input subdirectories mirrored)
+    <name>_IC50s.csv    with --fit
+    titres.csv          the combined Data Summary, as /batch_summary?format=csv
+    ic50s.csv           with --fit, every file's IC50s prefixed with File
+    manifest.jsonl      one record per finished file, appended as files finish
+
+A restart with the same output directory skips every file whose CSV, options
+and workbook are unchanged since its manifest record (--no-resume
+reprocesses everything), so an interrupted run picks up where it stopped.
+"""
+
+import argparse
+import csv
+import glob
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from nta_utils import (
+    WorkbookPipeline,
+    batch_file_options,
+    load_settings,
+    load_template_path,
+    parse_thresholds,
+    read_plates,
+    write_sigmoid_csv,
+)
+from r_pool import configure_r_pool, run_rscript
+
+logger = logging.getLogger("ntaweb")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FIT_SCRIPT = os.path.join(BASE_DIR, "fit_sigmoids.R")
+MANIFEST = "manifest.jsonl"
+TIMING_STAGES = ("read", "load", "titres", "flags", "build", "extract", "defaults", "save", "fit")
+
+
+def find_csvs(inputs, recursive=False):
+    """
+    (path, name) of every CSV named by inputs (files, directories or glob
+    patterns), where name is the path relative to its directory or pattern
+    root and becomes the file's output name.
+    """
+    found = {}
+    for item in inputs:
+        if os.path.isdir(item):
+            root = item
+            pattern = os.path.join(item, "**", "*") if recursive else os.path.join(item, "*")
+            paths = glob.glob(pattern, recursive=recursive)
+        else:
+            root = os.path.dirname(item.split("*", 1)[0]) if "*" in item else os.path.dirname(item)
+            paths = glob.glob(item, recursive=True)
+        for path in sorted(paths):
+            if not os.path.isfile(path) or not path.lower().endswith(".csv"):
+                continue
+            name = os.path.relpath(path, root or ".")
+            found.setdefault(os.path.abspath(path), name.replace(os.sep, "/"))
+    names = list(found.values())
+    duplicates = sorted({n for n in names if names.count(n) > 1})
+    if duplicates:
+        raise ValueError(f"Several inputs give the same output name: {', '.join(duplicates)}")
+    return list(found.items())
+
+
+def _sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _options_key(csv_sha, options, settings):
+    """Resume key of one file: its CSV hash plus every option its outputs depend on."""
+    key = {"csv": csv_sha, "options": options, **settings}
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def _fit_curves(run, title, settings, ic50_path):
+    """Fit run's sigmoid curves with fit_sigmoids.R and write its IC50s CSV to ic50_path."""
+    with tempfile.TemporaryDirectory(prefix="sigmoid_") as output_dir:
+        sigmoid_csv_path = os.path.join(output_dir, "sigmoidData.csv")
+        write_sigmoid_csv(run, sigmoid_csv_path)
+        r2_value, lod_bool = settings["r2_threshold"], settings["include_lod"]
+        run_rscript(["Rscript", FIT_SCRIPT, sigmoid_csv_path, output_dir, title, "",
+                     str(r2_value), "TRUE" if lod_bool else "FALSE"])
+        ic50_files = [f for f in os.listdir(output_dir) if f.startswith("IC50s") and f.endswith(".csv")]
+        if not ic50_files:
+            raise RuntimeError("fit_sigmoids.R wrote no IC50s file")
+        shutil.move(os.path.join(output_dir, ic50_files[0]), ic50_path)
+
+
+def process_file(path, name, options, settings, out_dir):
+    """
+    Worker body: one CSV through the /process pipeline, its workbook and
+    (with settings["fit"]) IC50s written under out_dir.  Returns the file's
+    manifest record; failures are recorded rather than raised.
+    """
+    _t = time.time()
+    base = os.path.splitext(name)[0]
+    record = {"file": name, "title": options["assay_title"], "status": "failed",
+              "workbook": None, "ic50": None, "timings": {}}
+    try:
+        with open(path, "rb") as f:
+            csv_data = f.read()
+        record["timings"]["read"] = time.time() - _t
+
+        blocks, data_mode = read_plates(csv_data, options["data_mode"], settings["default_data_mode"])
+        pipeline = WorkbookPipeline().load(
+            None, settings["template"], options["num_pseudotypes"], options["pseudotypes"],
+            options["assay_title"], options["sample_ids"], data_mode, options["plate_configs"],
+            blocks=blocks,
+        )
+        # The sheets of the web app's workbook download (app._export_workbook)
+        pipeline.export(settings["template"]).finish(
+            error_flagging=settings["error_flagging"], threshold_log2=settings["outlier_threshold_log2"])
+        if not settings["error_flagging"]:
+            pipeline.check_errors(threshold_log2=settings["outlier_threshold_log2"])
+
+        workbook = base + ".xlsx"
+        target = os.path.join(out_dir, workbook)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # Written under a temporary name so an interrupted save never looks finished
+        with open(target + ".part", "wb") as f:
+            pipeline.save(f)
+        os.replace(target + ".part", target)
+        record["timings"].update(pipeline.timings)
+
+        if settings["fit"] != "none":
+            _f = time.time()
+            ic50 = base + "_IC50s.csv"
+            _fit_curves(pipeline.run, options["assay_title"], settings, os.path.join(out_dir, ic50))
+            record["timings"]["fit"] = time.time() - _f
+            record["ic50"] = ic50
+
+        record.update({
+            "status": "done",
+            "workbook": workbook,
+            "data_mode": data_mode,
+            "plates": len(pipeline.run),
+            "flagged_triplicates": pipeline.error_count,
+            "titres": pipeline.run.titre_rows(settings["thresholds"]),
+        })
+    except Exception as e:
+        record["error"] = str(e) or e.__class__.__name__
+    record["seconds"] = time.time() - _t
+    return record
+
+
+def _init_worker(fit, settings, verbose):
+    """Pool initializer: quiet per-plate logging and, for the R fitter, one warm R worker per process."""
+    logging.getLogger("ntaweb").setLevel(logging.INFO if verbose else logging.WARNING)
+    configure_r_pool(1 if fit == "r" and int(settings.get("r_pool_size", 2)) > 0 else 0,
+                     int(settings.get("r_pool_max_jobs", 50)))
+
+
+def read_manifest(out_dir):
+    """Latest manifest record per file name (a torn last line from a crash is ignored)."""
+    records = {}
+    path = os.path.join(out_dir, MANIFEST)
+    if not os.path.exists(path):
+        return records
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            records[record["file"]] = record
+    return records
+
+
+def _is_current(record, key, out_dir):
+    if not record or record.get("status") != "done" or record.get("key") != key:
+        return False
+    outputs = [record["workbook"]] + ([record["ic50"]] if record.get("ic50") else [])
+    return all(os.path.exists(os.path.join(out_dir, p)) for p in outputs)
+
+
+def _write_csv(path, rows):
+    fieldnames = []
+    for row in rows:
+        fieldnames.extend(k for k in row if k not in fieldnames)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def write_tables(records, out_dir):
+    """titres.csv (and ic50s.csv when any file was fitted) from the done records, in file order."""
+    done = [r for r in records if r.get("status") == "done"]
+    _write_csv(os.path.join(out_dir, "titres.csv"),
+               [{"File": r["file"], "Assay": r["title"], **row} for r in done for row in r["titres"]])
+    ic50_rows = []
+    for r in done:
+        if not r.get("ic50"):
+            continue
+        with open(os.path.join(out_dir, r["ic50"]), newline="", encoding="utf-8") as f:
+            ic50_rows.extend({"File": r["file"], **row} for row in csv.DictReader(f))
+    if ic50_rows:
+        _write_csv(os.path.join(out_dir, "ic50s.csv"), ic50_rows)
+
+
+def print_summary(records, skipped, elapsed, workers, slowest=5):
+    """Per-stage totals / means and the slowest files of this run's processed records."""
+    done = [r for r in records if r["status"] == "done"]
+    failed = [r for r in records if r["status"] != "done"]
+    print(f"\n{len(done)} processed, {skipped} skipped (unchanged), {len(failed)} failed "
+          f"in {elapsed:.1f}s on {workers} worker(s)")
+    if done:
+        print(f"\n{'Stage':<10} {'Total (s)':>10} {'Mean (s)':>10}")
+        for stage in TIMING_STAGES:
+            values = [r["timings"][stage] for r in done if stage in r["timings"]]
+            if values:
+                print(f"{stage:<10} {sum(values):>10.2f} {sum(values) / len(values):>10.3f}")
+        total = sum(r["seconds"] for r in done)
+        print(f"{'per file':<10} {total:>10.2f} {total / len(done):>10.3f}")
+        print("\nSlowest files:")
+        for r in sorted(done, key=lambda r: r["seconds"], reverse=True)[:slowest]:
+            stages = ", ".join(f"{s} {r['timings'][s]:.2f}" for s in TIMING_STAGES if s in r["timings"])
+            print(f"  {r['seconds']:7.2f}s  {r['file']}  ({r['plates']} plate(s); {stages})")
+    if failed:
+        print("\nFailed:")
+        for r in failed:
+            print(f"  {r['file']}: {r.get('error')}")
+
+
+def build_parser(settings):
+    parser = argparse.ArgumentParser(
+        prog="python -m nta_batch",
+        description="Process many plate reader CSVs into NTA workbooks and one combined titre table.",
+    )
+    parser.add_argument("inputs", nargs="+", help="CSV files, directories of them, or glob patterns (quote them)")
+    parser.add_argument("-o", "--out", required=True, help="output directory (also holds the resume manifest)")
+    parser.add_argument("-r", "--recursive", action="store_true", help="include CSVs in subdirectories of directory inputs")
+    parser.add_argument("--template", help="Excel template (default: the app's active template)")
+
+    labels = parser.add_argument_group("labels (shared by every file; see --labels for per-file ones)")
+    labels.add_argument("--pseudotypes", default="", help="comma-separated pseudotype names")
+    labels.add_argument("--sample-ids", default="", help="comma-separated sample IDs")
+    labels.add_argument("--num-pseudotypes", default=str(settings.get("default_num_pseudotypes", 1)),
+                        choices=["1", "2", "2alt", "3", "4"], help="pseudotypes per plate")
+    labels.add_argument("--data-mode", default="auto", choices=["auto", "standard", "data_only"],
+                        help="CSV layout; auto detects it per file (default)")
+    labels.add_argument("--assay-title", default="", help="assay title of every file (default: the file name)")
+    labels.add_argument("--labels", help="JSON file of per-file labels: {\"name.csv\": {\"assay_title\": …, "
+                                         "\"pseudotype_text\": …, \"sample_id_text\": …, \"num_pseudotypes\": …, "
+                                         "\"data_mode\": …, \"plate_configs\": […]}}, keyed by output name")
+
+    analysis = parser.add_argument_group("analysis (defaults from settings.json)")
+    flagging = analysis.add_mutually_exclusive_group()
+    flagging.add_argument("--flag-errors", dest="error_flagging", action="store_true", default=None,
+                          help="add the Errors sheet to each workbook")
+    flagging.add_argument("--no-flag-errors", dest="error_flagging", action="store_false")
+    analysis.add_argument("--outlier-threshold", type=float, default=settings.get("outlier_threshold_log2", 1.0),
+                          help="triplicate outlier threshold (log2)")
+    analysis.add_argument("--threshold", default="50,90", help="titre thresholds of titres.csv (default 50,90)")
+    analysis.add_argument("--fit", choices=["none", "r"], default="none",
+                          help="also fit sigmoid curves for IC50s (default none)")
+    analysis.add_argument("--r2-threshold", type=float, default=settings.get("sigmoid_r2_threshold", 0.5))
+    lod = analysis.add_mutually_exclusive_group()
+    lod.add_argument("--include-lod", dest="include_lod", action="store_true", default=None,
+                     help="report IC50s outside the dilution range as censored values")
+    lod.add_argument("--no-include-lod", dest="include_lod", action="store_false")
+
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1,
+                        help="worker processes (default: one per CPU)")
+    parser.add_argument("--no-resume", action="store_true", help="reprocess files already in the manifest")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log every plate as it is read")
+    return parser
+
+
+def main(argv=None):
+    file_settings = load_settings()
+    parser = build_parser(file_settings)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s", datefmt="%H:%M:%S")
+    logger.setLevel(logging.INFO if args.verbose else logging.WARNING)
+
+    try:
+        template = os.path.abspath(args.template or load_template_path())
+        thresholds = parse_thresholds(args.threshold, default=(50, 90))
+        files = find_csvs(args.inputs, args.recursive)
+        file_labels = {}
+        if args.labels:
+            with open(args.labels, encoding="utf-8") as f:
+                file_labels = json.load(f)
+            if not isinstance(file_labels, dict):
+                raise ValueError("--labels must hold a JSON object keyed by file name")
+        form = {"pseudotype_text": args.pseudotypes, "sample_id_text": args.sample_ids,
+                "num_pseudotypes": args.num_pseudotypes, "data_mode": args.data_mode,
+                "assay_title": args.assay_title}
+        # Per-file entries may be keyed by output name or bare file name
+        options = [batch_file_options(name, form, {name: file_labels.get(name, file_labels.get(os.path.basename(name)))})
+                   for _, name in files]
+    except (OSError, ValueError) as e:
+        parser.exit(2, f"nta_batch: error: {e}\n")
+    if not files:
+        parser.exit(2, "nta_batch: error: no CSV files found\n")
+    if not os.path.isfile(template):
+        parser.exit(2, f"nta_batch: error: template not found: {template}\n")
+
+    settings = {
+        "template": template,
+        "default_data_mode": file_settings.get("default_data_mode", "standard"),
+        "error_flagging": bool(file_settings.get("error_flagging", False)
+                               if args.error_flagging is None else args.error_flagging),
+        "outlier_threshold_log2": args.outlier_threshold,
+        "thresholds": thresholds,
+        "fit": args.fit,
+        "r2_threshold": args.r2_threshold,
+        "include_lod": bool(file_settings.get("lod_censor_include", False)
+                            if args.include_lod is None else args.include_lod),
+    }
+    key_settings = {**settings, "template": _sha256_file(template)}
+    if args.fit == "r":
+        key_settings["fit_version"] = _sha256_file(FIT_SCRIPT)
+
+    os.makedirs(args.out, exist_ok=True)
+    previous = {} if args.no_resume else read_manifest(args.out)
+    todo, kept = [], {}
+    for (path, name), opts in zip(files, options):
+        key = _options_key(_sha256_file(path), opts, key_settings)
+        if _is_current(previous.get(name), key, args.out):
+            kept[name] = previous[name]
+        else:
+            todo.append((path, name, opts, key))
+
+    workers = max(1, min(args.workers, len(todo) or 1))
+    print(f"{len(files)} CSV file(s): {len(todo)} to process, {len(kept)} unchanged since the last run")
+    _t = time.time()
+    records = {}
+    if todo:
+        with open(os.path.join(args.out, MANIFEST), "a", encoding="utf-8") as manifest, \
+                ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                    initargs=(args.fit, file_settings, args.verbose)) as pool:
+            futures = {pool.submit(process_file, path, name, opts, settings, args.out): key
+                       for path, name, opts, key in todo}
+            try:
+                for done, future in enumerate(as_completed(futures), 1):
+                    record = {**future.result(), "key": futures[future]}
+                    records[record["file"]] = record
+                    manifest.write(json.dumps(record) + "\n")
+                    manifest.flush()
+                    status = "done" if record["status"] == "done" else f"FAILED: {record['error']}"
+                    print(f"[{done:>{len(str(len(todo)))}}/{len(todo)}] {record['seconds']:6.2f}s  "
+                          f"{record['file']}  {status}")
+            except KeyboardInterrupt:
+                pool.shutdown(wait=False, cancel_futures=True)
+                print("\nInterrupted; run the same command again to resume.")
+                return 130
+
+    # Combined tables cover every current file, processed now or on an earlier run
+    write_tables([records.get(name) or kept.get(name) or {} for _, name in files], args.out)
+    print_summary(list(records.values()), len(kept), time.time() - _t, workers)
+    print(f"\nWrote {os.path.join(args.out, 'titres.csv')}")
+    return 1 if any(r["status"] != "done" for r in records.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,22 @@
+import io
 import os
 import json
 import csv
+import re
 import math
+import time
+import pickle
+import hashlib
 import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
 import openpyxl
 from openpyxl.styles import Alignment, PatternFill, Font, Border, Side
 from openpyxl.utils import get_column_letter
 from openpyxl import load_workbook
-from io import BytesIO
+from io import BytesIO, StringIO
 
 logger = logging.getLogger("ntaweb")
 
@@ -18,7 +27,12 @@ SETTINGS_PATH = os.path.join(BASE_DIR, "settings.json")
 
 # In-memory caches to avoid repeated disk reads
 _settings_cache: dict | None = None
+_settings_mtime: float | None = None   # settings.json mtime behind _settings_cache
 _template_path_cache: str | None = None
+_compiled_templates: "OrderedDict[str, CompiledTemplate]" = OrderedDict()   # sha256 -> compiled template
+_template_files: dict = {}   # absolute path -> ((mtime_ns, size), sha256) of the file last compiled from it
+_template_cache_lock = threading.Lock()
+COMPILED_TEMPLATES_MAX = 16
 
 def load_config():
     if os.path.exists(CONFIG_PATH):
@@ -28,78 +42,237 @@ def load_config():
 
 config = load_config()
 
-def load_csv_blocks(csv_stream):
-    blocks = []
-    current_block = []
-    csv_stream.seek(0)
-    reader = csv.reader(line.decode() for line in csv_stream.readlines())
-    for row in reader:
-        if not any(cell.strip() for cell in row):
-            if current_block:
-                blocks.append(current_block)
-                current_block = []
-        else:
-            current_block.append(row[:12])
-    if current_block:
-        blocks.append(current_block)
-    return blocks
+# ════════════════════════════════════════════════════════════════
+# CSV ingest — one streaming pass over the plate reader export
+# ════════════════════════════════════════════════════════════════
 
+PLATE_ROW_LETTERS = ("A", "B", "C", "D", "E", "F", "G", "H")
 
-def detect_csv_mode(csv_stream):
-    """
-    Examine a CSV to determine whether it looks like Standard or Data Only format.
-    Returns 'standard', 'data_only', or 'unknown'.
-    Does NOT consume the stream — resets to 0 before returning.
-    """
-    csv_stream.seek(0)
-    raw = csv_stream.read()
-    csv_stream.seek(0)
 
-    if isinstance(raw, bytes):
-        text = raw.decode("utf-8-sig", errors="replace")
-    else:
-        text = raw
+def _parse_number(val):
+    """float(val) for a finite number (negatives and 1e5 notation included), else None."""
+    try:
+        num = float(val)
+    except (ValueError, TypeError):
+        return None
+    return num if math.isfinite(num) else None
 
-    lines = text.splitlines()
 
-    # Standard mode signature: look for rows starting with A–H labels
-    row_letters_found = set()
-    for line in lines:
-        cells = [c.strip() for c in line.split(",")]
-        if cells and cells[0] in ("A", "B", "C", "D", "E", "F", "G", "H"):
-            # Check that subsequent cells are numeric
-            numeric_count = 0
-            for val in cells[1:13]:
-                try:
-                    float(val)
-                    numeric_count += 1
-                except (ValueError, TypeError):
-                    pass
-            if numeric_count >= 6:
-                row_letters_found.add(cells[0])
+class PlateBlock:
+    """
+    One 8×12 plate read from the CSV by iter_plate_blocks().
 
-    has_standard_markers = len(row_letters_found) >= 4  # at least A-D found
+    values – (8, 12) float array of the wells, NaN where blank or not a number
+    text   – {(row, col): str} the non-blank cells that are not numbers
+    line   – CSV line of the block's first row
+    rows   – data rows the block had (a Data Only block may have more or fewer than 8)
+    """
 
-    # Data Only signature: look for rows that are pure numeric 12-column blocks
-    pure_numeric_rows = 0
-    for line in lines:
-        cells = [c.strip() for c in line.split(",") if c.strip()]
-        if len(cells) >= 12:
-            try:
-                [float(c) for c in cells[:12]]
-                pure_numeric_rows += 1
-            except (ValueError, TypeError):
-                pass
+    __slots__ = ("values", "text", "line", "rows")
+
+    def __init__(self, line):
+        self.values = np.full((8, 12), np.nan)
+        self.text = {}
+        self.line = line
+        self.rows = 0
+
+    def add_row(self, cells):
+        r = self.rows
+        self.rows += 1
+        if r >= 8:
+            return
+        for c, val in enumerate(cells[:12]):
+            num = _parse_number(val)
+            if num is not None:
+                self.values[r, c] = num
+            elif val.strip():
+                self.text[(r, c)] = val.strip()
+
+    @property
+    def numeric(self):
+        return int(np.isfinite(self.values).sum())
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes + sum(len(v) for v in self.text.values())
+
+    def diagnostics(self, plate):
+        """Counts for one plate, with a note for anything that looks off."""
+        numeric, text = self.numeric, len(self.text)
+        notes = []
+        if self.rows != 8:
+            notes.append(f"{self.rows} data row(s), expected 8")
+        if text:
+            notes.append(f"{text} non-numeric cell(s), e.g. {next(iter(self.text.values()))!r}")
+        return {"plate": plate, "line": self.line, "rows": self.rows, "numeric": numeric,
+                "text": text, "blank": 96 - numeric - text, "notes": notes}
+
+
+class CsvScan:
+    """
+    State of one pass over a plate reader CSV: feed() takes each row and
+    returns a PlateBlock when one is complete, while tallying the evidence
+    for detected (Standard / Data Only).
+
+    Data Only: every run of non-blank rows is a plate (the first 8 rows, 12
+    columns).  Standard: a plate is 8 rows labelled A–H whose first row has
+    at least 12 data columns, with at least 12 numeric wells (summary blocks
+    the reader appends have fewer); rejected blocks are listed in skipped.
+    """
 
-    if has_standard_markers and pure_numeric_rows < 8:
-        return "standard"
-    elif pure_numeric_rows >= 8 and not has_standard_markers:
-        return "data_only"
-    elif has_standard_markers:
-        return "standard"
-    else:
+    def __init__(self, data_mode=None):
+        self.data_mode = data_mode
+        self.plates = 0
+        self.diagnostics = []     # PlateBlock.diagnostics() for every plate returned
+        self.skipped = []         # {"line", "reason"} for Standard blocks that were not plates
+        self._letters = set()     # A–H row labels seen with ≥ 6 numbers after them
+        self._numeric_rows = 0    # rows of ≥ 12 cells whose first 12 are all numbers
+        self._block = None
+        self._valid = True
+
+    @property
+    def detected(self):
+        """'standard', 'data_only' or 'unknown', from the rows fed so far."""
+        if len(self._letters) >= 4:   # at least A–D found
+            return "standard"
+        if self._numeric_rows >= 8:
+            return "data_only"
         return "unknown"
 
+    def feed(self, line, row):
+        """Take CSV row number `line`; returns the PlateBlock it completes, if any."""
+        cells = [c.strip() for c in row]
+        self._detect(cells)
+        if self.data_mode == "standard":
+            while cells and not cells[-1]:
+                cells.pop()   # trailing commas the instrument sometimes adds
+            return self._feed_standard(line, cells)
+        if self.data_mode == "data_only":
+            return self._feed_data_only(line, row, cells)
+        return None
+
+    def finish(self):
+        """End of file: the PlateBlock still open, if it counts as a plate."""
+        block, self._block = self._block, None
+        if block is None:
+            return None
+        if self.data_mode == "standard":
+            if self._valid:
+                self.skipped.append({"line": block.line, "reason": "file ends inside the block"})
+            return None
+        return self._accept(block)
+
+    def _detect(self, cells):
+        if cells and cells[0] in PLATE_ROW_LETTERS and cells[0] not in self._letters:
+            if sum(_parse_number(v) is not None for v in cells[1:13]) >= 6:
+                self._letters.add(cells[0])
+        filled = [c for c in cells if c]
+        if len(filled) >= 12 and all(_parse_number(v) is not None for v in filled[:12]):
+            self._numeric_rows += 1
+
+    def _feed_data_only(self, line, row, cells):
+        if not any(cells):
+            block, self._block = self._block, None
+            return self._accept(block) if block is not None else None
+        if self._block is None:
+            self._block = PlateBlock(line)
+        self._block.add_row(row)
+        return None
+
+    def _feed_standard(self, line, cells):
+        block = self._block
+        if block is None:
+            # A block starts at an 'A' row with the letter plus 12 data columns
+            if cells and cells[0] == "A" and len(cells) >= 13:
+                self._block, self._valid = PlateBlock(line), True
+                self._block.add_row(cells[1:13])
+            return None
+
+        # The 7 lines after an 'A' row belong to its block, valid or not
+        expected = PLATE_ROW_LETTERS[block.rows]
+        if self._valid and (not cells or cells[0] != expected):
+            self._valid = False
+            self.skipped.append({"line": line, "reason": f"expected row {expected}"})
+        block.add_row(cells[1:13])
+        if block.rows < 8:
+            return None
+        self._block = None
+        if not self._valid:
+            return None
+        if block.numeric < 12:
+            self.skipped.append({"line": block.line, "reason": f"only {block.numeric} numeric well(s)"})
+            return None
+        return self._accept(block)
+
+    def _accept(self, block):
+        self.plates += 1
+        self.diagnostics.append(block.diagnostics(self.plates))
+        return block
+
+
+def iter_plate_blocks(csv_stream, data_mode=None, scan=None):
+    """
+    Stream the CSV (bytes or text file object) once, yielding each plate's
+    PlateBlock as soon as its last row is read; memory use does not grow
+    with the file.  data_mode: 'standard' or 'data_only' (None yields
+    nothing and only detects).  Pass a CsvScan as `scan` to read the
+    detected mode, diagnostics and skipped blocks afterwards.
+    The stream is rewound before and after.
+    """
+    scan = scan if scan is not None else CsvScan(data_mode)
+    csv_stream.seek(0)
+    text = csv_stream
+    if not isinstance(csv_stream, io.TextIOBase):
+        text = io.TextIOWrapper(csv_stream, encoding="utf-8-sig", errors="replace", newline="")
+    try:
+        reader = csv.reader(text)
+        for row in reader:
+            block = scan.feed(reader.line_num, row)
+            if block is not None:
+                yield block
+        block = scan.finish()
+        if block is not None:
+            yield block
+    finally:
+        if text is not csv_stream:
+            text.detach()   # leave the caller's stream open
+        csv_stream.seek(0)
+
+
+def scan_plate_csv(csv_stream, data_mode=None):
+    """(blocks, scan): every PlateBlock of the CSV read as data_mode, and the finished CsvScan."""
+    scan = CsvScan(data_mode)
+    blocks = list(iter_plate_blocks(csv_stream, data_mode, scan))
+    return blocks, scan
+
+
+def read_plates(csv_data, data_mode=None, default_mode="standard"):
+    """
+    (PlateBlocks, data mode) of CSV bytes read as data_mode, which is
+    detected from the file when None (default_mode if it can't be told).
+    Raises ValueError when the file looks like the other mode or has no plates.
+    """
+    if data_mode is None:
+        detected = detect_csv_mode(BytesIO(csv_data))
+        data_mode = detected if detected != "unknown" else default_mode
+    blocks, scan = scan_plate_csv(BytesIO(csv_data), data_mode)
+    ok, detected, _ = check_csv_mode(scan.detected, data_mode)
+    if not ok:
+        raise ValueError(f"This CSV looks like {detected.replace('_', ' ')} format, "
+                         f"not {data_mode.replace('_', ' ')}.")
+    if not blocks:
+        raise ValueError("No plates found in this CSV.")
+    return blocks, data_mode
+
+
+def detect_csv_mode(csv_stream):
+    """
+    Examine a CSV to determine whether it looks like Standard or Data Only format.
+    Returns 'standard', 'data_only', or 'unknown'.
+    Does NOT consume the stream — resets to 0 before returning.
+    """
+    return scan_plate_csv(csv_stream)[1].detected
+
 
 def validate_csv_mode(csv_stream, selected_mode):
     """
@@ -108,7 +281,11 @@ def validate_csv_mode(csv_stream, selected_mode):
     """
     detected = detect_csv_mode(csv_stream)
     csv_stream.seek(0)
+    return check_csv_mode(detected, selected_mode)
 
+
+def check_csv_mode(detected, selected_mode):
+    """validate_csv_mode() for a mode already detected (e.g. by a CsvScan)."""
     if detected == "unknown":
         return True, detected, ""  # Can't determine — let it proceed
 
@@ -131,96 +308,23 @@ def validate_csv_mode(csv_stream, selected_mode):
     return True, detected, ""
 
 
-def load_csv_blocks_standard(csv_stream):
-    """
-    Parse a Standard Mode CSV from the plate reader.
-
-    In Standard Mode the 8×12 data blocks are bounded by row labels A–H
-    down the left side and a header row with column numbers 1–12 above.
-    This function locates every such block, strips the row letters and
-    column header, and returns the same list-of-blocks structure as
-    load_csv_blocks() so downstream processing is identical.
-    """
-    csv_stream.seek(0)
-    raw_bytes = csv_stream.read()
-    # Handle both bytes and str
-    if isinstance(raw_bytes, bytes):
-        text = raw_bytes.decode("utf-8-sig")
-    else:
-        text = raw_bytes
-
-    lines = text.splitlines()
-
-    ROW_LETTERS = [chr(65 + r) for r in range(8)]  # A–H
-
-    blocks = []
-    i = 0
-    while i < len(lines):
-        # Strip trailing commas that the instrument sometimes adds
-        line = lines[i].strip().rstrip(",")
-        cells = [c.strip() for c in line.split(",")]
+# Label cells for Q1–Q4 on each Plate sheet; data columns are 3 per quadrant
+QUADRANT_PT_CELLS = ["B3", "E3", "H3", "K3"]
+QUADRANT_SID_CELLS = ["B4", "E4", "H4", "K4"]
+QUADRANT_DATA_COLS = [['B', 'C', 'D'], ['E', 'F', 'G'], ['H', 'I', 'J'], ['K', 'L', 'M']]
 
-        # Detect the start of a block: first cell is 'A' and at least 13
-        # fields (letter + 12 data columns)
-        if cells and cells[0] == "A" and len(cells) >= 13:
-            block = []
-            valid = True
-            for r in range(8):
-                row_idx = i + r
-                if row_idx >= len(lines):
-                    valid = False
-                    break
-                row_line = lines[row_idx].strip().rstrip(",")
-                row_cells = [c.strip() for c in row_line.split(",")]
-                if row_cells[0] != ROW_LETTERS[r]:
-                    valid = False
-                    break
-                # Take columns 1–12 (skip the letter in column 0)
-                block.append(row_cells[1:13])
-
-            if valid and len(block) == 8:
-                # Validate the block contains actual numeric data, not
-                # placeholder dashes or empty cells.  At least one cell
-                # in the 8×12 grid must be a valid number.
-                has_numeric = False
-                for row in block:
-                    for val in row:
-                        try:
-                            float(val)
-                            has_numeric = True
-                            break
-                        except (ValueError, TypeError):
-                            pass
-                    if has_numeric:
-                        break
-                if has_numeric:
-                    # Require at least 12 numeric values (one full row's worth)
-                    # to filter spurious summary/stats blocks the plate reader
-                    # appends at the end of the CSV.
-                    numeric_count = 0
-                    for row in block:
-                        for val in row:
-                            try:
-                                float(val)
-                                numeric_count += 1
-                            except (ValueError, TypeError):
-                                pass
-                    if numeric_count >= 12:
-                        blocks.append(block)
-            i += 8  # skip past this block regardless
-        else:
-            i += 1
 
-    return blocks
-
-
-def _apply_quadrant_labels(ws, num_pseudotypes, pt_list, sid_list, sample_index):
+def _resolve_quadrant_labels(num_pseudotypes, pt_list, sid_list, sample_index):
     """
-    Write pseudotype and sample-ID labels into the four quadrant header cells of
-    a plate worksheet.  Returns the updated sample_index.
+    Work out the pseudotype and sample-ID labels of the four quadrants of one
+    plate for the given layout.
 
     pt_list   – list of pseudotype name strings for this plate
     sid_list  – list of sample ID strings to draw from (global or per-plate)
+
+    Returns (labels, blanked, sample_index): four (pseudotype, sample_id) pairs
+    ('' when blank), the quadrant indexes whose data is cleared (the unused Q4
+    of the 3-pseudotype layout) and the updated sample_index.
     """
     # Pad pt_list with "Unlabelled" if fewer names provided than slots needed
     _np_count = 2 if num_pseudotypes == '2alt' else num_pseudotypes
@@ -234,86 +338,62 @@ def _apply_quadrant_labels(ws, num_pseudotypes, pt_list, sid_list, sample_index)
         new_idx = idx + 1 if idx < len(sid_list) else idx
         return val, new_idx
 
+    def _pt(idx):
+        return pt_list[idx] if idx < len(pt_list) else ''
+
+    blanked = []
     if num_pseudotypes == 1:
-        val = pt_list[0] if pt_list else ''
-        for cell in ['B3', 'E3', 'H3', 'K3']:
-            ws[cell] = val
-        for cell in ['B4', 'E4', 'H4', 'K4']:
+        pts = [_pt(0)] * 4
+        sids = []
+        for _ in range(4):
             v, sample_index = _consume(sample_index)
-            ws[cell] = v
+            sids.append(v)
     elif num_pseudotypes == 2:
-        ws['B3'] = pt_list[0] if len(pt_list) > 0 else ''
-        ws['E3'] = pt_list[0] if len(pt_list) > 0 else ''
-        ws['H3'] = pt_list[1] if len(pt_list) > 1 else ''
-        ws['K3'] = pt_list[1] if len(pt_list) > 1 else ''
+        pts = [_pt(0), _pt(0), _pt(1), _pt(1)]
         val1, sample_index = _consume(sample_index)
         val2, sample_index = _consume(sample_index)
-        ws['B4'] = val1; ws['H4'] = val1
-        ws['E4'] = val2; ws['K4'] = val2
+        sids = [val1, val2, val1, val2]
     elif num_pseudotypes == '2alt':
-        ws['B3'] = pt_list[0] if len(pt_list) > 0 else ''
-        ws['E3'] = pt_list[1] if len(pt_list) > 1 else ''
-        ws['H3'] = pt_list[0] if len(pt_list) > 0 else ''
-        ws['K3'] = pt_list[1] if len(pt_list) > 1 else ''
+        pts = [_pt(0), _pt(1), _pt(0), _pt(1)]
         val1, sample_index = _consume(sample_index)
         val2, sample_index = _consume(sample_index)
-        ws['B4'] = val1; ws['E4'] = val1   # Q1/Q2 = first sample
-        ws['H4'] = val2; ws['K4'] = val2   # Q3/Q4 = second sample
+        sids = [val1, val1, val2, val2]   # Q1/Q2 = first sample, Q3/Q4 = second
     elif num_pseudotypes == 3:
-        ws['B3'] = pt_list[0] if len(pt_list) > 0 else ''
-        ws['E3'] = pt_list[1] if len(pt_list) > 1 else ''
-        ws['H3'] = pt_list[2] if len(pt_list) > 2 else ''
-        ws['K3'] = ''
+        pts = [_pt(0), _pt(1), _pt(2), '']
         val, sample_index = _consume(sample_index)
-        ws['B4'] = val; ws['E4'] = val; ws['H4'] = val; ws['K4'] = ''
-        for row in range(5, 13):
-            for col in ['K', 'L', 'M']:
-                ws[f'{col}{row}'] = ''
+        sids = [val, val, val, '']
+        blanked = [3]
     elif num_pseudotypes == 4:
-        for idx, cell in enumerate(['B3', 'E3', 'H3', 'K3']):
-            ws[cell] = pt_list[idx] if idx < len(pt_list) else ''
+        pts = [_pt(0), _pt(1), _pt(2), _pt(3)]
         val, sample_index = _consume(sample_index)
-        for cell in ['B4', 'E4', 'H4', 'K4']:
-            ws[cell] = val
+        sids = [val] * 4
     else:
-        for cell in ['B3', 'E3', 'H3', 'K3', 'B4', 'E4', 'H4', 'K4']:
-            ws[cell] = ''
+        pts = [''] * 4
+        sids = [''] * 4
 
-    return sample_index
+    return list(zip(pts, sids)), blanked, sample_index
 
 
-def process_csv_to_template(
-    csv_path,
-    template_path,
-    output_path,
+def _write_quadrant_labels(ws, labels):
+    for (pt, sid), pt_cell, sid_cell in zip(labels, QUADRANT_PT_CELLS, QUADRANT_SID_CELLS):
+        ws[pt_cell] = pt
+        ws[sid_cell] = sid
+
+
+def resolve_plate_labels(
+    n_plates,
     num_pseudotypes,
     pseudotype_texts,
-    assay_title_text,
     sample_id_text,
-    data_mode="data_only",
     plate_configs=None,
 ):
     """
-    plate_configs – optional list of per-plate dicts:
-        [{"num_pseudotypes": 4, "pseudotypes": ["A","B","C","D"], "sample_ids": ["P1"]}, ...]
-    When provided, each plate uses its own config instead of the global values.
-    sample_ids within a plate config resets the index for that plate only.
-    If a plate config omits sample_ids, the global sample_id_list with a
-    continuing counter is used instead.
-    """
-    if data_mode == "standard":
-        blocks = load_csv_blocks_standard(csv_path)
-    else:
-        blocks = load_csv_blocks(csv_path)
-
-    logger.info("PLATES   %d plate(s) detected in CSV", len(blocks))
-
-    if not os.path.exists(template_path):
-        raise FileNotFoundError(f"Template not found at {template_path}")
-
-    wb = openpyxl.load_workbook(template_path)
-    template_sheet = wb.active
+    Quadrant labels for every plate of a run.  See build_workbook_from_csv()
+    for the plate_configs format.
 
+    Returns (labels, blanked): per plate, four (pseudotype, sample_id) pairs
+    and the list of quadrant indexes whose data is cleared.
+    """
     # Global fallback lists (used when plate_configs is None or a plate config
     # does not supply its own sample_ids)
     global_pt_list = [pt.strip() for line in pseudotype_texts.splitlines() for pt in line.split(",") if pt.strip()]
@@ -324,24 +404,9 @@ def process_csv_to_template(
     global_sid_list = [sid.strip() for line in sample_id_text.splitlines() for sid in line.split(",") if sid.strip()]
 
     global_sample_index = 0
+    all_labels, all_blanked = [], []
 
-    for i, block in enumerate(blocks):
-        sheet_title = f"Plate{i+1}"
-        new_sheet = wb.copy_worksheet(template_sheet)
-        new_sheet.title = sheet_title
-
-        for r in range(8):
-            for c in range(12):
-                cell = new_sheet.cell(row=5 + r, column=2 + c)
-                try:
-                    val = block[r][c]
-                    cell.value = float(val) if val.replace('.', '', 1).isdigit() else val
-                except IndexError:
-                    cell.value = ""
-
-        ws = new_sheet
-        ws['B2'] = assay_title_text
-
+    for i in range(n_plates):
         # Resolve per-plate config
         if plate_configs and i < len(plate_configs):
             pc = plate_configs[i]
@@ -355,28 +420,317 @@ def process_csv_to_template(
             if 'sample_ids' in pc and pc['sample_ids']:
                 # Per-plate sample list — reset index to 0 for this plate
                 sid_list = [s.strip() for s in pc['sample_ids']]
-                local_index = 0
-                local_index = _apply_quadrant_labels(ws, np_val, pt_list, sid_list, local_index)
+                labels, blanked, _ = _resolve_quadrant_labels(np_val, pt_list, sid_list, 0)
                 # global_sample_index unchanged — per-plate IDs don't consume it
             else:
-                global_sample_index = _apply_quadrant_labels(ws, np_val, pt_list, global_sid_list, global_sample_index)
+                labels, blanked, global_sample_index = _resolve_quadrant_labels(
+                    np_val, pt_list, global_sid_list, global_sample_index
+                )
         else:
-            global_sample_index = _apply_quadrant_labels(ws, num_pseudotypes, global_pt_list, global_sid_list, global_sample_index)
+            labels, blanked, global_sample_index = _resolve_quadrant_labels(
+                num_pseudotypes, global_pt_list, global_sid_list, global_sample_index
+            )
+        all_labels.append(labels)
+        all_blanked.append(blanked)
 
         # Determine how many quadrants are filled for logging
         _np_used = plate_configs[i].get('num_pseudotypes', num_pseudotypes) if plate_configs and i < len(plate_configs) else num_pseudotypes
         _np_count_used = 2 if _np_used == '2alt' else int(_np_used) if str(_np_used).isdigit() else num_pseudotypes
         logger.info("  Plate %d  loaded (%d quadrant(s))", i + 1, min(_np_count_used, 4))
 
-    wb.remove(template_sheet)
+    return all_labels, all_blanked
+
+
+def run_options(form):
+    """
+    The labelling inputs of a /process form, or any dict of its fields
+    (assay_title, pseudotypes, sample_ids, data_mode, num_pseudotypes,
+    plate_configs) as a dict, or raises ValueError with the message to show.
+    """
+    data_mode = form.get("data_mode", "standard")
+    if data_mode not in ("data_only", "standard"):
+        data_mode = "standard"
+
+    pseudotypes = form.get("pseudotype_text", "").strip()
+    if not pseudotypes:
+        raise ValueError("Please enter at least one pseudotype name.")
+
+    raw_np = str(form.get("num_pseudotypes", "1"))
+    if raw_np == "2alt":
+        num_pseudotypes = "2alt"
+    else:
+        try:
+            num_pseudotypes = int(raw_np)
+            if num_pseudotypes not in [1, 2, 3, 4]:
+                raise ValueError()
+        except ValueError:
+            raise ValueError("Invalid pseudotype count. Must be 1–4.")
+
+    # Per-plate config (optional — sent as JSON when custom per-plate mode is active)
+    plate_configs = None
+    raw_pc = form.get("plate_configs", "")
+    if isinstance(raw_pc, str) and raw_pc.strip():
+        try:
+            plate_configs = json.loads(raw_pc)
+        except (ValueError, TypeError):
+            plate_configs = None
+    elif isinstance(raw_pc, list):
+        plate_configs = raw_pc
+    if not isinstance(plate_configs, list):
+        plate_configs = None
+
+    return {
+        "assay_title": form.get("assay_title", ""),
+        "pseudotypes": pseudotypes,
+        "sample_ids": form.get("sample_id_text", ""),
+        "data_mode": data_mode,
+        "num_pseudotypes": num_pseudotypes,
+        "plate_configs": plate_configs,
+    }
+
+
+def batch_file_options(name, form, file_labels):
+    """
+    Labelling options (see run_options) for one file of a batch: the shared
+    form fields, overridden by the file's entry in file_labels.  The assay
+    title defaults to the file name; a data_mode of "auto" (None in the
+    result) is detected per file.
+    """
+    labels = file_labels.get(name)
+    fields = dict(form)
+    if isinstance(labels, dict):
+        fields.update({k: v for k, v in labels.items() if v not in (None, "")})
+    if not str(fields.get("assay_title", "")).strip():
+        fields["assay_title"] = os.path.splitext(name)[0]
+    auto = fields.get("data_mode", "auto") == "auto"
+    options = run_options(fields)
+    if auto:
+        options["data_mode"] = None
+    return options
+
+
+def process_csv_to_template(
+    csv_path,
+    template_path,
+    output_path,
+    num_pseudotypes,
+    pseudotype_texts,
+    assay_title_text,
+    sample_id_text,
+    data_mode="data_only",
+    plate_configs=None,
+):
+    """
+    Build the plate workbook from a CSV and save it to output_path (a path or
+    BytesIO).  See build_workbook_from_csv() for the plate_configs format.
+    """
+    wb = build_workbook_from_csv(
+        csv_path,
+        template_path,
+        num_pseudotypes,
+        pseudotype_texts,
+        assay_title_text,
+        sample_id_text,
+        data_mode=data_mode,
+        plate_configs=plate_configs,
+    )
+    wb.save(output_path)
+
+
+def build_workbook_from_csv(
+    csv_path,
+    template_path,
+    num_pseudotypes,
+    pseudotype_texts,
+    assay_title_text,
+    sample_id_text,
+    data_mode="data_only",
+    plate_configs=None,
+):
+    """
+    Copy the template sheet once per CSV plate block and fill in the raw data
+    and quadrant labels.  Returns the in-memory Workbook (not saved).
+
+    plate_configs – optional list of per-plate dicts:
+        [{"num_pseudotypes": 4, "pseudotypes": ["A","B","C","D"], "sample_ids": ["P1"]}, ...]
+    When provided, each plate uses its own config instead of the global values.
+    sample_ids within a plate config resets the index for that plate only.
+    If a plate config omits sample_ids, the global sample_id_list with a
+    continuing counter is used instead.
+    """
+    blocks = load_plate_blocks(csv_path, data_mode)
+    return build_workbook_from_blocks(
+        blocks,
+        template_path,
+        num_pseudotypes,
+        pseudotype_texts,
+        assay_title_text,
+        sample_id_text,
+        plate_configs=plate_configs,
+    )
+
+
+def load_plate_blocks(csv_path, data_mode="data_only"):
+    """The CSV's plates as PlateBlocks, read with the layout for data_mode (see CsvScan)."""
+    blocks, scan = scan_plate_csv(csv_path, "standard" if data_mode == "standard" else "data_only")
+
+    logger.info("PLATES   %d plate(s) detected in CSV", len(blocks))
+    for diag in scan.diagnostics:
+        if diag["notes"]:
+            logger.warning("  Plate %d  line %d: %s", diag["plate"], diag["line"], "; ".join(diag["notes"]))
+    for skip in scan.skipped:
+        logger.info("  Skipped  block at line %d: %s", skip["line"], skip["reason"])
+    return blocks
+
+
+def build_workbook_from_blocks(
+    blocks,
+    template_path,
+    num_pseudotypes,
+    pseudotype_texts,
+    assay_title_text,
+    sample_id_text,
+    plate_configs=None,
+):
+    """Workbook-building half of build_workbook_from_csv() for already-parsed blocks."""
+    template = compiled_template(template_path)
+    labels, blanked = resolve_plate_labels(
+        len(blocks), num_pseudotypes, pseudotype_texts, sample_id_text, plate_configs
+    )
+    run = Run.from_blocks(
+        blocks, template.dilutions, labels, blanked,
+        assay_title=assay_title_text,
+    )
+    return export_run_workbook(run, template.workbook())
+
+
+class CompiledTemplate:
+    """
+    A template workbook parsed once.  Each caller gets its own Workbook
+    (workbook()) unpickled from the parsed form, several times cheaper than
+    re-parsing the xlsx; the Plate sheets are then stamped from its template
+    sheet (export_run_workbook).
+
+    data            – the xlsx bytes the template was compiled from
+    sha             – their sha256 (hex), the cache key
+    dilutions       – A5:A12 as 8 floats (read_dilutions)
+    dilution_values – A5:A12 as Excel shows them (cached formula results)
+    """
+
+    __slots__ = ("data", "sha", "dilutions", "dilution_values", "_blob")
+
+    def __init__(self, data, sha=None):
+        self.data = data
+        self.sha = sha or hashlib.sha256(data).hexdigest()
+        wb = openpyxl.load_workbook(BytesIO(data))
+        ws = wb.active
+        self.dilutions = read_dilutions(ws)
+        self.dilution_values = [ws[f"A{row}"].value for row in range(5, 13)]
+        if any(isinstance(v, str) and v.startswith("=") for v in self.dilution_values):
+            shown = openpyxl.load_workbook(BytesIO(data), data_only=True).active
+            self.dilution_values = [shown[f"A{row}"].value for row in range(5, 13)]
+        self._blob = pickle.dumps(wb, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def workbook(self):
+        """A fresh, independent copy of the template workbook."""
+        return pickle.loads(self._blob)
+
+
+def compiled_template(template):
+    """
+    The CompiledTemplate for a template path (or the template's xlsx bytes),
+    parsed on first use and again only when the file's mtime or size
+    changes.  Templates are kept by content hash, so a run's stored template
+    bytes share the entry of the file they were read from.
+    """
+    if isinstance(template, (bytes, bytearray)):
+        data, sha = bytes(template), None
+    else:
+        path = os.path.abspath(template)
+        try:
+            st = os.stat(path)
+        except OSError:
+            raise FileNotFoundError(f"Template not found at {template}")
+        stamp = (st.st_mtime_ns, st.st_size)
+        with _template_cache_lock:
+            known = _template_files.get(path)
+            if known is not None and known[0] == stamp and known[1] in _compiled_templates:
+                _compiled_templates.move_to_end(known[1])
+                return _compiled_templates[known[1]]
+        with open(path, "rb") as f:
+            data = f.read()
+        sha = hashlib.sha256(data).hexdigest()
+        with _template_cache_lock:
+            _template_files[path] = (stamp, sha)
+
+    sha = sha or hashlib.sha256(data).hexdigest()
+    with _template_cache_lock:
+        compiled = _compiled_templates.get(sha)
+        if compiled is not None:
+            _compiled_templates.move_to_end(sha)
+            return compiled
+
+    _t = time.time()
+    compiled = CompiledTemplate(data, sha)
+    logger.info("TEMPLATE compiled %s in %.2fs", sha[:8], time.time() - _t)
+    with _template_cache_lock:
+        _compiled_templates[sha] = compiled
+        while len(_compiled_templates) > COMPILED_TEMPLATES_MAX:
+            _compiled_templates.popitem(last=False)
+    return compiled
+
+
+def load_template_workbook(template_path):
+    """A fresh template workbook, from a path or the template's xlsx bytes (see compiled_template)."""
+    return compiled_template(template_path).workbook()
+
+
+def export_run_workbook(run, template_wb):
+    """
+    Write a Run out as Plate sheets: the template sheet is copied once per
+    plate and filled with the raw data, assay title and quadrant labels.
+    Returns template_wb with the template sheet removed.
+    """
+    template_sheet = template_wb.active
+
+    for i, plate in enumerate(run.plates):
+        ws = template_wb.copy_worksheet(template_sheet)
+        ws.title = plate.name
+
+        for r in range(8):
+            for c in range(12):
+                ws.cell(row=5 + r, column=2 + c).value = run.cell_value(i, r, c)
+
+        ws['B2'] = run.assay_title
+        _write_quadrant_labels(ws, run.labels[i])
+
+    template_wb.remove(template_sheet)
+
+    return template_wb
+
+
+def extract_final_titres_openpyxl(output_path):
+    wb = load_workbook(output_path)
+    _write_data_summary(wb)
+    _apply_summary_defaults(wb)
 
     if isinstance(output_path, BytesIO):
+        output_path.seek(0)
         wb.save(output_path)
     else:
         wb.save(output_path)
 
-def extract_final_titres_openpyxl(output_path):
-    wb = load_workbook(output_path)
+
+def _write_data_summary(wb, engine=None):
+    """
+    Create (or replace) the Data Summary sheet as the first sheet of wb.
+
+    Titres come from the TitreEngine (built from the Plate sheets when not
+    supplied) and are written as values, so the summary is populated without
+    Excel having to recalculate the template formulas.
+    """
+    if engine is None:
+        engine = TitreEngine.from_workbook(wb)
 
     if "Data Summary" in wb.sheetnames:
         wb.remove(wb["Data Summary"])
@@ -393,54 +747,25 @@ def extract_final_titres_openpyxl(output_path):
         cell = summary_ws.cell(row=1, column=col)
         cell.alignment = Alignment(horizontal="center", vertical="center")
 
-    
-
-
-    # Excel cell reference location 
-    nt90_cells = [["B14", "C14", "D14"], ["E14", "F14", "G14"], ["H14", "I14", "J14"], ["K14", "L14", "M14"]]
-    nt50_cells = [["B16", "C16", "D16"], ["E16", "F16", "G16"], ["H16", "I16", "J16"], ["K16", "L16", "M16"]]
-    pseudotype_cells = ["B3", "E3", "H3", "K3"]
-    sample_id_cells = ["B4", "E4", "H4", "K4"]
-    nt90_avg_cells = ["C19", "F19", "I19", "L19"]
-    nt50_avg_cells = ["C21", "F21", "I21", "L21"]
-
-    for sheet_name in wb.sheetnames:
-        if not sheet_name.startswith("Plate"):
-            continue
-
-        ws = wb[sheet_name]
-
-        # Count how many pseudotypes are filled
-        filled_pseudotypes = [
-            bool(ws[cell].value and str(ws[cell].value).strip()) 
-            for cell in pseudotype_cells
-        ]
-        num_pseudotypes = sum(filled_pseudotypes)
-
-        # Only include as many columns as valid pseudotypes (up to 4, but can be 3 or fewer)
-        for i in range(num_pseudotypes):
-            pt_formula = f'=IF(TRIM({sheet_name}!{pseudotype_cells[i]})="", "Unlabelled", {sheet_name}!{pseudotype_cells[i]})'
-            sid_cell = sample_id_cells[i]
-            sid_formula = f'=IF(TRIM({sheet_name}!{sid_cell})="", "Unlabelled", {sheet_name}!{sid_cell})'
-            nt90_formulas = [f"={sheet_name}!{cell}" for cell in nt90_cells[i]]
-            nt90_avg = f"={sheet_name}!{nt90_avg_cells[i]}"
-            nt50_formulas = [f"={sheet_name}!{cell}" for cell in nt50_cells[i]]
-            nt50_avg = f"={sheet_name}!{nt50_avg_cells[i]}"
-
-            summary_ws.append([
-                sheet_name,
-                pt_formula,
-                sid_formula,
-                *nt90_formulas,
-                nt90_avg,
-                *nt50_formulas,
-                nt50_avg
-            ])
-
-            last_row = summary_ws.max_row
-            for col in range(4, 12):
-                cell = summary_ws.cell(row=last_row, column=col)
-                cell.number_format = '0'
+    nt90 = engine.titres(90)
+    nt50 = engine.titres(50)
+
+    for i, q, pt, sid in engine.active_quadrants():
+        cols = range(q * 3, q * 3 + 3)
+        summary_ws.append([
+            engine.names[i],
+            pt,
+            sid or "Unlabelled",
+            *[_opt(nt90["rep_nt"][i, c]) for c in cols],
+            _opt(nt90["nt"][i, q]),
+            *[_opt(nt50["rep_nt"][i, c]) for c in cols],
+            _opt(nt50["nt"][i, q]),
+        ])
+
+        last_row = summary_ws.max_row
+        for col in range(4, 12):
+            cell = summary_ws.cell(row=last_row, column=col)
+            cell.number_format = '0'
 
     # === Apply cell colouring ===
     light_green = PatternFill(start_color="AFE1AF", end_color="AFE1AF", fill_type="solid")
@@ -487,17 +812,19 @@ def extract_final_titres_openpyxl(output_path):
     summary_ws["K1"].fill = dark_green
 
 
+def add_default_to_final_titres(output_path):
+    wb = openpyxl.load_workbook(output_path)
+    _apply_summary_defaults(wb)
+
     if isinstance(output_path, BytesIO):
         output_path.seek(0)
         wb.save(output_path)
     else:
         wb.save(output_path)
 
-    add_default_to_final_titres(output_path)
-
 
-def add_default_to_final_titres(output_path):
-    wb = openpyxl.load_workbook(output_path)
+def _apply_summary_defaults(wb):
+    """Fill boundary placeholders (≤A5 / ≥A11), round and centre the Data Summary."""
     summary = wb["Data Summary"]
     plate1 = wb["Plate1"]
 
@@ -516,7 +843,7 @@ def add_default_to_final_titres(output_path):
         a11_val = ""
 
 
-    for row in summary.iter_rows(min_row=2, max_row=summary.max_row, min_col=4, max_col=10):
+    for row in summary.iter_rows(min_row=2, max_row=summary.max_row, min_col=4, max_col=11):
         for cell in row:
             if isinstance(cell.value, str) and cell.value.startswith("="):
                 # leave formulas intact
@@ -538,11 +865,508 @@ def add_default_to_final_titres(output_path):
     for col in range(1, 12):
         summary.column_dimensions[get_column_letter(col)].width = 15
 
-    if isinstance(output_path, BytesIO):
-        output_path.seek(0)
-        wb.save(output_path)
-    else:
-        wb.save(output_path)
+
+# ════════════════════════════════════════════════════════════════
+# Titre engine — vectorised linear interpolation for a whole run
+# ════════════════════════════════════════════════════════════════
+
+def _to_float(val):
+    try:
+        return float(val)
+    except (ValueError, TypeError):
+        return math.nan
+
+
+def _clean_label(val):
+    return str(val).strip() if val is not None and str(val).strip() else ""
+
+
+def _plate_sheet_names(wb):
+    """Plate sheets in plate-number order."""
+    return sorted(
+        [s for s in wb.sheetnames if re.match(r"^Plate\d+$", s)],
+        key=lambda s: int(s[5:]),
+    )
+
+
+def read_dilutions(ws):
+    """A5:A12 of a plate/template sheet as 8 floats (NaN where non-numeric)."""
+    return [_to_float(ws[f"A{row}"].value) for row in range(5, 13)]
+
+
+def read_plate_labels(ws):
+    """The four (pseudotype, sample_id) label pairs of a plate sheet ('' when blank)."""
+    return [
+        (_clean_label(ws[pt].value), _clean_label(ws[sid].value))
+        for pt, sid in zip(QUADRANT_PT_CELLS, QUADRANT_SID_CELLS)
+    ]
+
+
+def compute_titres(lum, dilutions, threshold_pct=50):
+    """
+    Linear-interpolation NT titres for every replicate on every plate at once,
+    reproducing the template's Excel formulas (B14:M16 / C19:L21):
+
+      NSC     = luminescence at row 12 (index 7)
+      target  = NSC × (1 - threshold_pct/100)   e.g. NT50 → NSC × 0.5
+      P16     = Excel MATCH(target, rows 5–11, 1) — a binary search that
+                assumes ascending data, replayed step by step so non-monotonic
+                curves give the same answer as Excel
+      NT      = (target - lum[P16]) / (lum[P16+1] - lum[P16])
+                × (dil[P16+1] - dil[P16]) + dil[P16]
+
+    A replicate where MATCH finds nothing (every dilution is above target) is
+    flagged "low" (NT ≤ A5).  Replicates with a missing/non-positive NSC, a
+    degenerate interpolation or NT ≤ 0 have no titre and no flag.
+
+    lum           – (plates, 8, 12) array of raw luminescence B5:M12, NaN = missing
+    dilutions     – (8,) or (plates, 8) array of A5:A12 (index 7 is the NSC slot)
+    threshold_pct – a single threshold, or one per plate (see compute_titres_multi)
+
+    Returns a dict of arrays:
+      rep_nt       (plates, 12)   per-replicate NT, NaN when none
+      rep_low      (plates, 12)   True where the replicate is below A5
+      nt           (plates, 4)    quadrant mean of valid replicates
+      nt_boundary  (plates, 4)    quadrant mean substituting A5 for "low" replicates
+      has_boundary (plates, 4)    any replicate in the quadrant flagged
+      nsc, target  (plates, 12)   per-replicate NSC and interpolation target
+    """
+    lum = np.asarray(lum, dtype=float)
+    n_plates = lum.shape[0]
+    dil = np.broadcast_to(np.asarray(dilutions, dtype=float), (n_plates, 8))
+    target_fraction = (100 - np.asarray(threshold_pct, dtype=float)) / 100
+    if target_fraction.ndim:
+        target_fraction = target_fraction[:, None]
+
+    nsc = lum[:, 7, :]
+    with np.errstate(invalid="ignore"):
+        ran = np.isfinite(nsc) & (nsc > 0)
+        target = nsc * target_fraction
+
+        # Excel MATCH(target, lum[0:7], 1): at most 3 halvings over 7 rows
+        lo = np.zeros(nsc.shape, dtype=int)
+        hi = np.full(nsc.shape, 6)
+        for _ in range(3):
+            active = lo <= hi
+            mid = np.clip((lo + hi) // 2, 0, 6)
+            val = np.take_along_axis(lum, mid[:, None, :], axis=1)[:, 0, :]
+            below = val <= target  # NaN compares False, as in the row-by-row code
+            lo = np.where(active & below, mid + 1, lo)
+            hi = np.where(active & ~below, mid - 1, hi)
+
+        rep_low = ran & (hi < 0)
+        p16 = np.clip(hi, 0, 6)
+        y1 = np.take_along_axis(lum, p16[:, None, :], axis=1)[:, 0, :]
+        y2 = np.take_along_axis(lum, p16[:, None, :] + 1, axis=1)[:, 0, :]
+        # p16 = 6 interpolates towards the NSC row (dilution slot 7)
+        x1 = np.take_along_axis(dil, p16, axis=1)
+        x2 = np.take_along_axis(dil, p16 + 1, axis=1)
+
+        ok = (ran & (hi >= 0) & np.isfinite(y1) & np.isfinite(y2)
+              & np.isfinite(x1) & np.isfinite(x2) & (y2 != y1))
+        nt = (target - y1) / np.where(ok, y2 - y1, 1.0) * (x2 - x1) + x1
+        rep_nt = np.where(ok & (nt > 0), nt, np.nan)
+
+        # Quadrant averages (3 replicate columns each)
+        q_nt = rep_nt.reshape(n_plates, 4, 3)
+        q_low = rep_low.reshape(n_plates, 4, 3)
+        n_valid = np.isfinite(q_nt).sum(axis=2)
+        nt_avg = np.where(n_valid > 0, np.nansum(q_nt, axis=2) / np.maximum(n_valid, 1), np.nan)
+
+        dil_low = dil[:, 0][:, None, None]
+        q_sub = np.where(q_low & np.isfinite(dil_low), dil_low, q_nt)
+        n_sub = np.isfinite(q_sub).sum(axis=2)
+        nt_boundary = np.where(n_sub > 0, np.nansum(q_sub, axis=2) / np.maximum(n_sub, 1), np.nan)
+
+    return {
+        "threshold": threshold_pct,
+        "rep_nt": rep_nt,
+        "rep_low": rep_low,
+        "nt": nt_avg,
+        "nt_boundary": nt_boundary,
+        "has_boundary": q_low.any(axis=2),
+        "nsc": nsc,
+        "target": target,
+    }
+
+
+def compute_titres_multi(lum, dilutions, thresholds):
+    """
+    compute_titres() for several thresholds in one vectorised pass: the plates
+    are stacked once per threshold and split back afterwards.
+
+    Returns { threshold: compute_titres()-style result }.
+    """
+    thresholds = [float(t) for t in thresholds]
+    if not thresholds:
+        return {}
+    lum = np.asarray(lum, dtype=float)
+    n_plates = lum.shape[0]
+    dil = np.broadcast_to(np.asarray(dilutions, dtype=float), (n_plates, 8))
+
+    stacked = compute_titres(
+        np.tile(lum, (len(thresholds), 1, 1)),
+        np.tile(dil, (len(thresholds), 1)),
+        np.repeat(thresholds, n_plates),
+    )
+
+    results = {}
+    for k, t in enumerate(thresholds):
+        part = slice(k * n_plates, (k + 1) * n_plates)
+        res = {key: val[part] for key, val in stacked.items() if key != "threshold"}
+        res["threshold"] = t
+        results[t] = res
+    return results
+
+
+def parse_thresholds(value, default=(50,)):
+    """
+    Parse NTxx thresholds from a request value: "80", "50,80,99", or a list.
+    Each must be a number strictly between 0 and 100.  Returns a list of
+    floats without duplicates (order kept); raises ValueError otherwise.
+    """
+    if value is None or value == "":
+        return [float(t) for t in default]
+    if isinstance(value, str):
+        value = [v for v in re.split(r"[,\s]+", value) if v]
+    elif not isinstance(value, (list, tuple)):
+        value = [value]
+
+    thresholds = []
+    for v in value:
+        try:
+            t = float(re.sub(r"^NT", "", str(v).strip(), flags=re.IGNORECASE))
+        except ValueError:
+            raise ValueError(f"Invalid threshold: {v!r}")
+        if not 0 < t < 100:
+            raise ValueError(f"Threshold must be between 0 and 100, got {v!r}")
+        if t not in thresholds:
+            thresholds.append(t)
+    if not thresholds:
+        raise ValueError("No thresholds given")
+    return thresholds
+
+
+def titre_label(threshold_pct):
+    """'NT50', 'NT80', 'NT92.5' …"""
+    return f"NT{float(threshold_pct):g}"
+
+
+def _opt(val, ndigits=None):
+    """NaN → None, otherwise a plain (optionally rounded) float for JSON/openpyxl."""
+    val = float(val)
+    if math.isnan(val):
+        return None
+    return round(val, ndigits) if ndigits is not None else val
+
+
+class TitreEngine:
+    """
+    All plate data of a run as contiguous arrays plus cached titre results.
+
+    lum        – (plates, 8, 12) raw luminescence B5:M12 (NaN where non-numeric)
+    dilutions  – (plates, 8) A5:A12 dilution series per plate
+    labels     – per plate, four (pseudotype, sample_id) pairs for Q1–Q4
+    names      – plate sheet names ("Plate1", …)
+
+    Quadrants without a pseudotype label are treated as unused throughout.
+    Titre results are cached per threshold, keeping the TITRE_CACHE_SIZE most
+    recently used; the cache is locked, as a stored run is shared by request
+    and job threads.
+    """
+
+    __slots__ = ("lum", "dilutions", "labels", "names", "_results", "_lock")
+
+    TITRE_CACHE_SIZE = 16
+
+    def __init__(self, lum, dilutions, labels, names=None):
+        self.lum = np.asarray(lum, dtype=float).reshape(-1, 8, 12)
+        n_plates = self.lum.shape[0]
+        self.dilutions = np.array(np.broadcast_to(np.asarray(dilutions, dtype=float), (n_plates, 8)))
+        self.labels = [list(pl) for pl in labels]
+        self.names = list(names) if names else [f"Plate{i + 1}" for i in range(n_plates)]
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Pickled (SQLite store) without the lock, which is per process
+        return {name: getattr(self, name) for cls in type(self).__mro__
+                for name in getattr(cls, "__slots__", ()) if name != "_lock" and hasattr(self, name)}
+
+    def __setstate__(self, state):
+        if isinstance(state, tuple):   # pickled before __getstate__: (None, slots)
+            state = state[1]
+        for name, value in state.items():
+            setattr(self, name, value)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_blocks(cls, blocks, dilutions, labels, blanked=None):
+        """
+        Build from load_plate_blocks() output (PlateBlocks).
+
+        blanked – per plate, quadrant indexes whose data is cleared (see
+                  resolve_plate_labels); defaults to quadrants with no labels
+        """
+        lum = np.full((len(blocks), 8, 12), np.nan)
+        for i, block in enumerate(blocks):
+            lum[i] = block.values
+        for i, quads in enumerate(_blanked_quadrants(labels, blanked)):
+            for q in quads:
+                lum[i, :, q * 3:q * 3 + 3] = np.nan
+        return cls(lum, dilutions, labels)
+
+    @classmethod
+    def from_workbook(cls, wb):
+        """Build from the Plate sheets of an already-loaded workbook."""
+        names = _plate_sheet_names(wb)
+        lum = np.full((len(names), 8, 12), np.nan)
+        dilutions = np.full((len(names), 8), np.nan)
+        labels = []
+        for i, name in enumerate(names):
+            ws = wb[name]
+            for r, row in enumerate(ws.iter_rows(min_row=5, max_row=12, min_col=1, max_col=13, values_only=True)):
+                dilutions[i, r] = _to_float(row[0])
+                lum[i, r] = [_to_float(v) for v in row[1:13]]
+            labels.append(read_plate_labels(ws))
+        return cls(lum, dilutions, labels, names)
+
+    @classmethod
+    def from_bytes(cls, file_bytes):
+        return cls.from_workbook(load_workbook(BytesIO(file_bytes), data_only=True))
+
+    def __len__(self):
+        return self.lum.shape[0]
+
+    def titres(self, threshold_pct=50):
+        """compute_titres() for this run, cached per threshold."""
+        return self.titres_many([threshold_pct])[float(threshold_pct)]
+
+    def titres_many(self, thresholds):
+        """
+        Results for several thresholds; the uncached ones are computed together
+        in a single compute_titres_multi() pass.  Returns { threshold: result }.
+        """
+        keys = [float(t) for t in thresholds]
+        with self._lock:
+            missing = [t for t in dict.fromkeys(keys) if t not in self._results]
+            if missing:
+                self._results.update(compute_titres_multi(self.lum, self.dilutions, missing))
+
+            results = {}
+            for t in keys:
+                self._results.move_to_end(t)
+                results[t] = self._results[t]
+            # Never evict what was just asked for
+            while len(self._results) > max(self.TITRE_CACHE_SIZE, len(results)):
+                self._results.popitem(last=False)
+        return results
+
+    def is_cached(self, threshold_pct):
+        return float(threshold_pct) in self._results
+
+    def plate_has_data(self):
+        """Boolean (plates,) — any numeric well in B5:M12."""
+        return np.isfinite(self.lum).any(axis=(1, 2))
+
+    def active_quadrants(self):
+        """Yield (plate_idx, quad_idx, pseudotype, sample_id) for labelled quadrants."""
+        for i, plate_labels in enumerate(self.labels):
+            for q, (pt, sid) in enumerate(plate_labels):
+                if pt:
+                    yield i, q, pt, sid
+
+    def boxplot_data(self, threshold_pct=50):
+        """
+        Per-quadrant titres grouped by pseudotype, in the format /boxplot_data
+        serves:  { pseudotype: [ { sample, plate, nt, nt_boundary, has_boundary,
+        boundary_low, boundary_high, nsc, target, rep_nts, rep_boundary_flags } ] }
+        """
+        res = self.titres(threshold_pct)
+        target_fraction = (100 - threshold_pct) / 100
+        grouped = {}
+        for i, q, pt, sid in self.active_quadrants():
+            nt = _opt(res["nt"][i, q], 1)
+            nt_boundary = _opt(res["nt_boundary"][i, q], 1)
+            # Skip entries with no data at all
+            if nt is None and nt_boundary is None:
+                continue
+            cols = range(q * 3, q * 3 + 3)
+            ref_nsc = _opt(self.lum[i, 7, q * 3])
+            grouped.setdefault(pt, []).append({
+                "sample":             sid or "Unlabelled",
+                "plate":              self.names[i],
+                "nt":                 nt,           # boundary-excluded average
+                "nt_boundary":        nt_boundary,  # boundary-included average
+                "has_boundary":       bool(res["has_boundary"][i, q]),
+                "boundary_low":       _opt(self.dilutions[i, 0]),
+                "boundary_high":      _opt(self.dilutions[i, 6]),
+                "nsc":                round(ref_nsc, 2) if ref_nsc else None,
+                "target":             round(ref_nsc * target_fraction, 2) if ref_nsc else None,
+                "rep_nts":            [_opt(res["rep_nt"][i, c], 1) for c in cols],
+                "rep_boundary_flags": ["low" if res["rep_low"][i, c] else None for c in cols],
+            })
+        return grouped
+
+    def titre_rows(self, thresholds=(50, 90)):
+        """Flat per-quadrant rows (Plate, Quadrant, Pseudotype, Sample_ID, NTxx…) for CSV export."""
+        results = self.titres_many(thresholds)
+        rows = []
+        for i, q, pt, sid in self.active_quadrants():
+            row = {
+                "Plate": self.names[i],
+                "Quadrant": f"Q{q + 1}",
+                "Pseudotype": pt,
+                "Sample_ID": sid or "Unlabelled",
+            }
+            for t, res in results.items():
+                label = titre_label(t)
+                row[label] = _opt(res["nt"][i, q])
+                row[f"{label}_boundary"] = _opt(res["nt_boundary"][i, q])
+            rows.append(row)
+        return rows
+
+
+def _blanked_quadrants(labels, blanked=None):
+    if blanked is not None:
+        return blanked
+    return [[q for q, (pt, sid) in enumerate(plate_labels) if not pt and not sid]
+            for plate_labels in labels]
+
+
+# ════════════════════════════════════════════════════════════════
+# Run model — compact in-memory representation of a processed run
+# ════════════════════════════════════════════════════════════════
+
+class Quadrant:
+    """One quadrant (3 replicate columns) of a Plate; a view onto the Run arrays."""
+
+    __slots__ = ("plate", "index")
+
+    def __init__(self, plate, index):
+        self.plate = plate
+        self.index = index
+
+    @property
+    def name(self):
+        return f"Q{self.index + 1}"
+
+    @property
+    def pseudotype(self):
+        return self.plate.run.labels[self.plate.index][self.index][0]
+
+    @property
+    def sample_id(self):
+        return self.plate.run.labels[self.plate.index][self.index][1]
+
+    @property
+    def used(self):
+        return bool(self.pseudotype)
+
+    @property
+    def cols(self):
+        """Replicate columns as a slice into B:M."""
+        return slice(self.index * 3, self.index * 3 + 3)
+
+    @property
+    def columns(self):
+        return f"{get_column_letter(2 + self.index * 3)}:{get_column_letter(4 + self.index * 3)}"
+
+    @property
+    def lum(self):
+        """(8, 3) luminescence view, rows 5–12."""
+        return self.plate.lum[:, self.cols]
+
+
+class Plate:
+    """One 8×12 plate of a Run; a view onto the Run arrays."""
+
+    __slots__ = ("run", "index", "quadrants")
+
+    def __init__(self, run, index):
+        self.run = run
+        self.index = index
+        self.quadrants = [Quadrant(self, q) for q in range(4)]
+
+    @property
+    def name(self):
+        return self.run.names[self.index]
+
+    @property
+    def lum(self):
+        """(8, 12) luminescence view of B5:M12."""
+        return self.run.lum[self.index]
+
+    @property
+    def dilutions(self):
+        return self.run.dilutions[self.index]
+
+    @property
+    def has_data(self):
+        """Any numeric well in B5:M12 (blank plates the reader appended have none)."""
+        return bool(np.isfinite(self.lum).any())
+
+
+class Run(TitreEngine):
+    """
+    A processed run: the TitreEngine arrays plus everything else the routes
+    need (assay title, error counts, plate/quadrant views).  Built once in
+    /process and kept in in_memory_files; the plate workbook is an export of
+    it (export_run_workbook).
+
+    raw_text – {(plate, row, col): str} for the few non-numeric data cells,
+               so the export reproduces them
+    """
+
+    __slots__ = ("assay_title", "raw_text", "error_count", "errors_flagged", "plates")
+
+    def __init__(self, lum, dilutions, labels, names=None, assay_title="", raw_text=None):
+        super().__init__(lum, dilutions, labels, names)
+        self.assay_title = assay_title
+        self.raw_text = dict(raw_text or {})
+        self.error_count = 0
+        self.errors_flagged = False
+        self.plates = [Plate(self, i) for i in range(len(self))]
+
+    @classmethod
+    def from_blocks(cls, blocks, dilutions, labels, blanked=None, assay_title=""):
+        blanked = _blanked_quadrants(labels, blanked)
+        run = super().from_blocks(blocks, dilutions, labels, blanked)
+        run.assay_title = assay_title
+        for i, block in enumerate(blocks):
+            for (r, c), val in block.text.items():
+                if c // 3 not in blanked[i]:
+                    run.raw_text[(i, r, c)] = val
+        return run
+
+    @classmethod
+    def from_workbook(cls, wb):
+        run = super().from_workbook(wb)
+        for i, name in enumerate(run.names):
+            ws = wb[name]
+            if i == 0:
+                run.assay_title = ws["B2"].value or ""
+            for r, row in enumerate(ws.iter_rows(min_row=5, max_row=12, min_col=2, max_col=13, values_only=True)):
+                for c, val in enumerate(row):
+                    if isinstance(val, str) and val:
+                        run.raw_text[(i, r, c)] = val
+        run.error_count, run.errors_flagged = _count_errors_in_wb(wb)
+        return run
+
+    def cell_value(self, plate_idx, row, col):
+        """Value of data cell B5:M12 for the workbook export."""
+        text = self.raw_text.get((plate_idx, row, col))
+        if text is not None:
+            return text
+        val = self.lum[plate_idx, row, col]
+        return float(val) if np.isfinite(val) else ""
+
+    @property
+    def nbytes(self):
+        """Approximate size of the numeric arrays, including cached titres."""
+        cached = sum(arr.nbytes for res in self._results.values()
+                     for arr in res.values() if isinstance(arr, np.ndarray))
+        return self.lum.nbytes + self.dilutions.nbytes + cached
 
 
 # ════════════════════════════════════════════════════════════════
@@ -609,102 +1433,38 @@ def flag_triplicate_errors(output_path, threshold_log2=1.0):
     Returns the number of errors found.
     """
     wb = openpyxl.load_workbook(output_path)
-    
-    # Remove existing Errors sheet if present
-    if "Errors" in wb.sheetnames:
-        wb.remove(wb["Errors"])
-    
-    errors_ws = wb.create_sheet("Errors")
-    
-    # Style definitions
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="C0392B", end_color="C0392B", fill_type="solid")
-    section_fill = PatternFill(start_color="FADBD8", end_color="FADBD8", fill_type="solid")
-    section_font = Font(bold=True, color="922B21")
-    warn_fill = PatternFill(start_color="FFF3CD", end_color="FFF3CD", fill_type="solid")
-    center_align = Alignment(horizontal="center", vertical="center")
-    thin_border = Border(
-        left=Side(style="thin"), right=Side(style="thin"),
-        top=Side(style="thin"), bottom=Side(style="thin")
-    )
-    
-    # Header row
-    headers = [
-        "Error Type", "Plate", "Quadrant", "Pseudotype", "Sample ID",
-        "Dilution / Metric", "Rep 1", "Rep 2", "Rep 3",
-        "Flagged Replicate(s)", "Log₂ Fold Diff"
-    ]
-    errors_ws.append(headers)
-    for col_idx in range(1, len(headers) + 1):
-        cell = errors_ws.cell(row=1, column=col_idx)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-        cell.border = thin_border
-    
-    # Column widths
-    col_widths = [18, 10, 10, 18, 18, 18, 12, 12, 12, 20, 14]
-    for i, w in enumerate(col_widths, 1):
-        errors_ws.column_dimensions[get_column_letter(i)].width = w
-    
-    # Quadrant definitions
-    quadrant_defs = [
-        {'name': 'Q1', 'pt_cell': 'B3', 'sid_cell': 'B4', 'data_cols': ['B', 'C', 'D'],
-         'nt90_cells': ['B14', 'C14', 'D14'], 'nt50_cells': ['B16', 'C16', 'D16']},
-        {'name': 'Q2', 'pt_cell': 'E3', 'sid_cell': 'E4', 'data_cols': ['E', 'F', 'G'],
-         'nt90_cells': ['E14', 'F14', 'G14'], 'nt50_cells': ['E16', 'F16', 'G16']},
-        {'name': 'Q3', 'pt_cell': 'H3', 'sid_cell': 'H4', 'data_cols': ['H', 'I', 'J'],
-         'nt90_cells': ['H14', 'I14', 'J14'], 'nt50_cells': ['H16', 'I16', 'J16']},
-        {'name': 'Q4', 'pt_cell': 'K3', 'sid_cell': 'K4', 'data_cols': ['K', 'L', 'M'],
-         'nt90_cells': ['K14', 'L14', 'M14'], 'nt50_cells': ['K16', 'L16', 'M16']},
-    ]
-    
-    # Get dilution labels from first plate
-    dilution_labels = []
-    first_plate = None
-    for sn in wb.sheetnames:
-        if sn.startswith("Plate"):
-            first_plate = sn
-            break
-    if first_plate:
-        ws_fp = wb[first_plate]
-        for row in range(5, 13):
-            val = ws_fp[f'A{row}'].value
-            try:
-                num_val = float(val)
-                if num_val == 0:
-                    dilution_labels.append("NSC")
-                elif num_val >= 1000:
-                    dilution_labels.append(f"1:{int(num_val):,}")
-                elif num_val == int(num_val):
-                    dilution_labels.append(f"1:{int(num_val)}")
-                else:
-                    dilution_labels.append(str(num_val))
-            except (ValueError, TypeError):
-                dilution_labels.append(str(val) if val else f"Row {row}")
-    
-    error_count = 0
-    
-    for sheet_name in wb.sheetnames:
-        if not sheet_name.startswith("Plate"):
-            continue
-        
-        ws = wb[sheet_name]
-        
-        for quad in quadrant_defs:
-            pt_val = ws[quad['pt_cell']].value
-            if not pt_val or not str(pt_val).strip():
+    error_count = _flag_triplicate_errors_wb(wb, threshold_log2=threshold_log2)
+
+    if isinstance(output_path, BytesIO):
+        output_path.seek(0)
+        wb.save(output_path)
+    else:
+        wb.save(output_path)
+
+    return error_count
+
+
+def triplicate_error_rows(engine, threshold_log2=1.0, dilution_labels=()):
+    """
+    The Errors sheet rows (one list per flagged triplicate) for a TitreEngine:
+    raw luminescence triplicates (rows 5-12), then NT90 and NT50 replicates,
+    quadrant by quadrant.  dilution_labels: the 8 labels shown for raw rows.
+    """
+    nt90 = engine.titres(90)
+    nt50 = engine.titres(50)
+
+    for plate_idx, sheet_name in enumerate(engine.names):
+        for quad_idx, (pseudotype, sid) in enumerate(engine.labels[plate_idx]):
+            if not pseudotype:
                 continue  # Skip unused quadrants
             
-            pseudotype = str(pt_val).strip()
-            sid_val = ws[quad['sid_cell']].value
-            sample_id = str(sid_val).strip() if sid_val and str(sid_val).strip() else "Unlabelled"
+            quad_name = f"Q{quad_idx + 1}"
+            quad_cols = range(quad_idx * 3, quad_idx * 3 + 3)
+            sample_id = sid or "Unlabelled"
             
             # ── Check raw luminescence triplicates (rows 5-12) ──
             for row_idx, excel_row in enumerate(range(5, 13)):
-                values = []
-                for col in quad['data_cols']:
-                    values.append(ws[f'{col}{excel_row}'].value)
+                values = [_opt(engine.lum[plate_idx, row_idx, c]) for c in quad_cols]
                 
                 outliers = _is_outlier_in_triple(values, threshold_log2=threshold_log2)
                 if outliers is not None:
@@ -737,10 +1497,10 @@ def flag_triplicate_errors(output_path, threshold_log2=1.0):
                         except (ValueError, TypeError):
                             display_vals.append("—")
                     
-                    errors_ws.append([
+                    yield [
                         "Raw Triplicate",
                         sheet_name,
-                        quad['name'],
+                        quad_name,
                         pseudotype,
                         sample_id,
                         dil_label,
@@ -749,11 +1509,10 @@ def flag_triplicate_errors(output_path, threshold_log2=1.0):
                         display_vals[2],
                         flagged_reps,
                         f"{max_fold:.2f}"
-                    ])
-                    error_count += 1
+                    ]
             
             # ── Check NT90 replicates ──
-            nt90_values = [ws[cell].value for cell in quad['nt90_cells']]
+            nt90_values = [_opt(nt90["rep_nt"][plate_idx, c]) for c in quad_cols]
             nt90_outliers = _is_outlier_in_triple(nt90_values, threshold_log2=threshold_log2)
             if nt90_outliers is not None:
                 nums = []
@@ -781,10 +1540,10 @@ def flag_triplicate_errors(output_path, threshold_log2=1.0):
                     except (ValueError, TypeError):
                         display_vals.append("—")
                 
-                errors_ws.append([
+                yield [
                     "NT90 Replicate",
                     sheet_name,
-                    quad['name'],
+                    quad_name,
                     pseudotype,
                     sample_id,
                     "NT90",
@@ -793,11 +1552,10 @@ def flag_triplicate_errors(output_path, threshold_log2=1.0):
                     display_vals[2],
                     flagged_reps,
                     f"{max_fold:.2f}"
-                ])
-                error_count += 1
+                ]
             
             # ── Check NT50 replicates ──
-            nt50_values = [ws[cell].value for cell in quad['nt50_cells']]
+            nt50_values = [_opt(nt50["rep_nt"][plate_idx, c]) for c in quad_cols]
             nt50_outliers = _is_outlier_in_triple(nt50_values, threshold_log2=threshold_log2)
             if nt50_outliers is not None:
                 nums = []
@@ -825,10 +1583,10 @@ def flag_triplicate_errors(output_path, threshold_log2=1.0):
                     except (ValueError, TypeError):
                         display_vals.append("—")
                 
-                errors_ws.append([
+                yield [
                     "NT50 Replicate",
                     sheet_name,
-                    quad['name'],
+                    quad_name,
                     pseudotype,
                     sample_id,
                     "NT50",
@@ -837,9 +1595,90 @@ def flag_triplicate_errors(output_path, threshold_log2=1.0):
                     display_vals[2],
                     flagged_reps,
                     f"{max_fold:.2f}"
-                ])
-                error_count += 1
+                ]
+
+
+def count_triplicate_errors(engine, threshold_log2=1.0):
+    """Number of rows flag_triplicate_errors() would list, without building a sheet."""
+    return sum(1 for _ in triplicate_error_rows(engine, threshold_log2=threshold_log2))
+
+
+def _flag_triplicate_errors_wb(wb, threshold_log2=1.0, engine=None):
+    """
+    Build the Errors sheet on an in-memory workbook. Returns the error count.
+    Raw wells and NT replicate titres are read from the TitreEngine (built
+    from the Plate sheets when not supplied).
+    """
+    if engine is None:
+        engine = TitreEngine.from_workbook(wb)
+
+    # Remove existing Errors sheet if present
+    if "Errors" in wb.sheetnames:
+        wb.remove(wb["Errors"])
+    
+    errors_ws = wb.create_sheet("Errors")
+    
+    # Style definitions
+    header_font = Font(bold=True, color="FFFFFF")
+    header_fill = PatternFill(start_color="C0392B", end_color="C0392B", fill_type="solid")
+    section_fill = PatternFill(start_color="FADBD8", end_color="FADBD8", fill_type="solid")
+    section_font = Font(bold=True, color="922B21")
+    warn_fill = PatternFill(start_color="FFF3CD", end_color="FFF3CD", fill_type="solid")
+    center_align = Alignment(horizontal="center", vertical="center")
+    thin_border = Border(
+        left=Side(style="thin"), right=Side(style="thin"),
+        top=Side(style="thin"), bottom=Side(style="thin")
+    )
+    
+    # Header row
+    headers = [
+        "Error Type", "Plate", "Quadrant", "Pseudotype", "Sample ID",
+        "Dilution / Metric", "Rep 1", "Rep 2", "Rep 3",
+        "Flagged Replicate(s)", "Log₂ Fold Diff"
+    ]
+    errors_ws.append(headers)
+    for col_idx in range(1, len(headers) + 1):
+        cell = errors_ws.cell(row=1, column=col_idx)
+        cell.font = header_font
+        cell.fill = header_fill
+        cell.alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
+        cell.border = thin_border
+    
+    # Column widths
+    col_widths = [18, 10, 10, 18, 18, 18, 12, 12, 12, 20, 14]
+    for i, w in enumerate(col_widths, 1):
+        errors_ws.column_dimensions[get_column_letter(i)].width = w
+    
+    # Get dilution labels from first plate
+    dilution_labels = []
+    first_plate = None
+    for sn in wb.sheetnames:
+        if sn.startswith("Plate"):
+            first_plate = sn
+            break
+    if first_plate:
+        ws_fp = wb[first_plate]
+        for row in range(5, 13):
+            val = ws_fp[f'A{row}'].value
+            try:
+                num_val = float(val)
+                if num_val == 0:
+                    dilution_labels.append("NSC")
+                elif num_val >= 1000:
+                    dilution_labels.append(f"1:{int(num_val):,}")
+                elif num_val == int(num_val):
+                    dilution_labels.append(f"1:{int(num_val)}")
+                else:
+                    dilution_labels.append(str(num_val))
+            except (ValueError, TypeError):
+                dilution_labels.append(str(val) if val else f"Row {row}")
     
+    error_count = 0
+    for row in triplicate_error_rows(engine, threshold_log2, dilution_labels):
+        errors_ws.append(row)
+        error_count += 1
+
+
     # ── Style data rows ──
     for row in errors_ws.iter_rows(min_row=2, max_row=errors_ws.max_row, min_col=1, max_col=len(headers)):
         error_type = row[0].value
@@ -859,13 +1698,7 @@ def flag_triplicate_errors(output_path, threshold_log2=1.0):
         cell = errors_ws.cell(row=2, column=1)
         cell.font = Font(italic=True, color="28A745")
         cell.alignment = Alignment(horizontal="center", vertical="center")
-    
-    if isinstance(output_path, BytesIO):
-        output_path.seek(0)
-        wb.save(output_path)
-    else:
-        wb.save(output_path)
-    
+
     return error_count
 
 
@@ -876,22 +1709,159 @@ def count_errors_from_workbook(file_bytes):
     """
     try:
         wb = openpyxl.load_workbook(BytesIO(file_bytes), data_only=True)
-        if "Errors" not in wb.sheetnames:
-            return 0, False
-        
-        ws = wb["Errors"]
-        # Count data rows (skip header row 1)
-        error_count = 0
-        for row in ws.iter_rows(min_row=2, max_row=ws.max_row, min_col=1, max_col=1):
-            val = row[0].value
-            if val and val not in ("No errors detected — all triplicates within acceptable range",):
-                error_count += 1
-        
-        return error_count, True
+        return _count_errors_in_wb(wb)
     except Exception:
         return 0, False
 
 
+def _count_errors_in_wb(wb):
+    """Same as count_errors_from_workbook() but on an already-loaded workbook."""
+    if "Errors" not in wb.sheetnames:
+        return 0, False
+
+    ws = wb["Errors"]
+    # Count data rows (skip header row 1)
+    error_count = 0
+    for row in ws.iter_rows(min_row=2, max_row=ws.max_row, min_col=1, max_col=1):
+        val = row[0].value
+        if val and val not in ("No errors detected — all triplicates within acceptable range",):
+            error_count += 1
+
+    return error_count, True
+
+
+# ════════════════════════════════════════════════════════════════
+# Workbook pipeline — one in-memory workbook for the whole of /process
+# ════════════════════════════════════════════════════════════════
+
+class WorkbookPipeline:
+    """
+    Carry a single openpyxl Workbook through every /process stage
+    (build → Data Summary → defaults → Errors sheet → counts) and serialise
+    it exactly once in save().  The path/BytesIO functions above each do a
+    full load+save round trip; this avoids all but the final one.
+
+    The Run (``self.run``) is built straight from the parsed CSV blocks and is
+    the source of truth: the Plate sheets are exported from it, and the
+    Data Summary and Errors sheets use its titres.  load() + check_errors()
+    produce the Run alone; export() adds the workbook later (for_run() picks
+    up a stored Run), so the xlsx is only built when it is downloaded.
+
+    Wall time per stage is recorded in ``timings`` (seconds, keyed by stage).
+    """
+
+    def __init__(self):
+        self.wb = None
+        self.run = None
+        self.timings = {}
+        self.error_count = 0
+        self.errors_flagged = False
+
+    @contextmanager
+    def _timed(self, stage):
+        _t = time.time()
+        try:
+            yield
+        finally:
+            self.timings[stage] = time.time() - _t
+
+    @classmethod
+    def for_run(cls, run):
+        """A pipeline around an already built Run (e.g. one kept in the result store)."""
+        pipeline = cls()
+        pipeline.run = run
+        pipeline.error_count, pipeline.errors_flagged = run.error_count, run.errors_flagged
+        return pipeline
+
+    def load(self, csv_path, template_path, num_pseudotypes, pseudotype_texts,
+             assay_title_text, sample_id_text, data_mode="data_only", plate_configs=None,
+             blocks=None):
+        """
+        Parse the CSV into self.run; only the template's (cached) dilutions
+        are needed.  blocks: the CSV's PlateBlocks if already parsed (a
+        staged upload), in which case csv_path is not read.
+        """
+        with self._timed("load"):
+            if blocks is None:
+                blocks = load_plate_blocks(csv_path, data_mode)
+            template = compiled_template(template_path)
+            labels, blanked = resolve_plate_labels(
+                len(blocks), num_pseudotypes, pseudotype_texts, sample_id_text, plate_configs
+            )
+            self.run = Run.from_blocks(
+                blocks, template.dilutions, labels, blanked,
+                assay_title=assay_title_text,
+            )
+        with self._timed("titres"):
+            # Warm the two thresholds every downstream sheet needs
+            self.run.titres_many([50, 90])
+        return self
+
+    def export(self, template_path):
+        """Write self.run out as Plate sheets of the template (path or xlsx bytes)."""
+        with self._timed("build"):
+            self.wb = export_run_workbook(self.run, load_template_workbook(template_path))
+        return self
+
+    def build(self, csv_path, template_path, num_pseudotypes, pseudotype_texts,
+              assay_title_text, sample_id_text, data_mode="data_only", plate_configs=None):
+        self.load(csv_path, template_path, num_pseudotypes, pseudotype_texts,
+                  assay_title_text, sample_id_text, data_mode, plate_configs)
+        return self.export(template_path)
+
+    def extract_titres(self):
+        with self._timed("extract"):
+            _write_data_summary(self.wb, engine=self.run)
+        return self
+
+    def add_defaults(self):
+        with self._timed("defaults"):
+            _apply_summary_defaults(self.wb)
+        return self
+
+    def flag_errors(self, threshold_log2=1.0):
+        with self._timed("flags"):
+            self.error_count = _flag_triplicate_errors_wb(
+                self.wb, threshold_log2=threshold_log2, engine=self.run,
+            )
+            self.errors_flagged = True
+            self.run.error_count, self.run.errors_flagged = self.error_count, True
+        return self
+
+    def finish(self, error_flagging=False, threshold_log2=1.0):
+        """The sheets every export gets after export(): Data Summary, its defaults and, when flagging, Errors."""
+        self.extract_titres().add_defaults()
+        if error_flagging:
+            self.flag_errors(threshold_log2=threshold_log2)
+        return self
+
+    def check_errors(self, threshold_log2=1.0):
+        """Count the triplicate outliers from the Run alone, without an Errors sheet."""
+        with self._timed("flags"):
+            self.error_count = count_triplicate_errors(self.run, threshold_log2=threshold_log2)
+            self.errors_flagged = True
+            self.run.error_count, self.run.errors_flagged = self.error_count, True
+        return self
+
+    def count_errors(self):
+        """Returns (error_count, has_errors_sheet) like count_errors_from_workbook()."""
+        with self._timed("count"):
+            self.error_count, self.errors_flagged = _count_errors_in_wb(self.wb)
+            self.run.error_count, self.run.errors_flagged = self.error_count, self.errors_flagged
+        return self.error_count, self.errors_flagged
+
+    def save(self, out=None):
+        """Serialise the workbook and return the xlsx bytes, or write it to the file object `out`."""
+        with self._timed("save"):
+            if out is not None:
+                self.wb.save(out)
+                return None
+            out = BytesIO()
+            self.wb.save(out)
+            data = out.getvalue()
+        return data
+
+
 def save_template_path(path, config_file=CONFIG_PATH):
     global _template_path_cache
     config = load_config()
@@ -919,6 +1889,17 @@ DEFAULT_SETTINGS = {
     "outlier_threshold_log2": 1.0,
     "sigmoid_r2_threshold": 0.5,
     "lod_censor_include": False,
+    "fitting_workers": 1,
+    "plot_workers": 2,
+    "batch_workers": 2,
+    "optimise_plot_images": False,
+    "r_pool_size": 2,
+    "r_pool_max_jobs": 50,
+    "job_workers": 2,
+    "store_budget_mb": 256,
+    "store_ttl_hours": 6,
+    "store_backend": "memory",
+    "store_path": "",
     "comparison_disagreement_threshold": 1.0,
     "custom_templates": {},
     "presets": {
@@ -932,9 +1913,18 @@ DEFAULT_SETTINGS = {
     "selected_preset": "default"
 }
 
+def _settings_file_mtime():
+    try:
+        return os.path.getmtime(SETTINGS_PATH)
+    except OSError:
+        return None
+
+
 def load_settings():
-    global _settings_cache
-    if _settings_cache is not None:
+    global _settings_cache, _settings_mtime
+    # Re-read when settings.json changed, e.g. saved by another server process
+    mtime = _settings_file_mtime()
+    if _settings_cache is not None and mtime == _settings_mtime:
         return dict(_settings_cache)
     if os.path.exists(SETTINGS_PATH):
         with open(SETTINGS_PATH, "r") as f:
@@ -946,146 +1936,88 @@ def load_settings():
     else:
         settings = DEFAULT_SETTINGS.copy()
     _settings_cache = settings
+    _settings_mtime = mtime
     return dict(_settings_cache)
 
 def save_settings(settings):
-    global _settings_cache
+    global _settings_cache, _settings_mtime
     with open(SETTINGS_PATH, "w") as f:
         json.dump(settings, f, indent=4)
     _settings_cache = dict(settings)
+    _settings_mtime = _settings_file_mtime()
+
+
+SIGMOID_FIELDNAMES = ['Plate', 'Quadrant', 'Virus', 'Sample', 'Dilution', 'DilutionLog2', 'Rep1', 'Rep2', 'Rep3', 'Rep_Mean', 'NSC_Mean', 'Neutralisation']
 
 
 def generate_sigmoid_csv(excel_path_or_bytes, output_csv_path):
     """
     Generate sigmoidData.csv from processed Excel workbook.
     """
-    import math
-    import tempfile
-    
     if isinstance(excel_path_or_bytes, BytesIO):
         excel_path_or_bytes.seek(0)
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp:
-            tmp.write(excel_path_or_bytes.read())
-            temp_path = tmp.name
-        
-        wb = load_workbook(temp_path)
-        
-        import os
-        os.remove(temp_path)
-    else:
-        wb = load_workbook(excel_path_or_bytes)
-    
+    wb = load_workbook(excel_path_or_bytes)
+    return write_sigmoid_csv(TitreEngine.from_workbook(wb), output_csv_path)
+
+
+def write_sigmoid_csv(engine, output_csv_path):
+    """
+    Generate sigmoidData.csv straight from a run's TitreEngine (no workbook).
+
+    One row per quadrant per tested dilution (rows 5–11): the triplicate mean
+    and its neutralisation relative to the quadrant's mean NSC (row 12).
+    Quadrants with neither a virus nor a sample label are skipped.
+    """
     all_rows = []
     debug_info = []
     sample_counter = 1
-    
-    for sheet_name in wb.sheetnames:
-        if not sheet_name.startswith("Plate"):
-            continue
-        
-        ws = wb[sheet_name]
+
+    for plate_idx, sheet_name in enumerate(engine.names):
         debug_info.append(f"Processing sheet: {sheet_name}")
-        
-        dilutions = []
-        for row in range(5, 12):
-            val = ws[f'A{row}'].value
-            try:
-                dilutions.append(float(val))
-            except (ValueError, TypeError):
-                dilutions.append(None)
-        
+
+        dilutions = [_opt(d) for d in engine.dilutions[plate_idx, :7]]
         debug_info.append(f"  Dilutions: {dilutions}")
-        
-        dilution_log2 = []
-        for d in dilutions:
-            if d and d > 0:
-                dilution_log2.append(-math.log2(d))
-            else:
-                dilution_log2.append(None)
-        
+
+        dilution_log2 = [-math.log2(d) if d and d > 0 else None for d in dilutions]
         debug_info.append(f"  DilutionLog2: {dilution_log2}")
-        
-        quadrants = [
-            {'virus_cell': 'B3', 'sample_cell': 'B4', 'data_cols': ['B', 'C', 'D'], 'nsc_cols': ['B', 'C', 'D']},
-            {'virus_cell': 'E3', 'sample_cell': 'E4', 'data_cols': ['E', 'F', 'G'], 'nsc_cols': ['E', 'F', 'G']},
-            {'virus_cell': 'H3', 'sample_cell': 'H4', 'data_cols': ['H', 'I', 'J'], 'nsc_cols': ['H', 'I', 'J']},
-            {'virus_cell': 'K3', 'sample_cell': 'K4', 'data_cols': ['K', 'L', 'M'], 'nsc_cols': ['K', 'L', 'M']},
-        ]
-        
-        for quad_idx, quad in enumerate(quadrants):
-            virus = ws[quad['virus_cell']].value
-            sample = ws[quad['sample_cell']].value
-            
-            debug_info.append(f"  Quadrant {quad_idx+1}: Virus={virus}, Sample={sample}")
-            
-            virus_empty = not virus or not str(virus).strip()
-            sample_empty = not sample or not str(sample).strip()
-            if virus_empty and sample_empty:
+
+        for quad_idx, (virus, sample) in enumerate(engine.labels[plate_idx]):
+            debug_info.append(f"  Quadrant {quad_idx+1}: Virus={virus or None}, Sample={sample or None}")
+
+            if not virus and not sample:
                 debug_info.append(f"    Skipped: Both virus and sample are empty (unused quadrant)")
                 continue
-            
-            nsc_values = []
-            for col in quad['nsc_cols']:
-                cell_ref = f"{col}12"
-                val = ws[cell_ref].value
-                try:
-                    nsc_values.append(float(val))
-                except (ValueError, TypeError):
-                    pass
-            
+
+            quad = engine.lum[plate_idx, :, quad_idx * 3:quad_idx * 3 + 3]
+            nsc_values = [float(v) for v in quad[7] if np.isfinite(v)]
+
             if not nsc_values:
                 debug_info.append(f"    Skipped: No valid NSC values")
                 continue
-            
+
             nsc_mean = sum(nsc_values) / len(nsc_values)
-            
+
             if nsc_mean == 0:
                 debug_info.append(f"    Skipped: NSC mean is zero")
                 continue
-            
-            has_data = False
-            for row in range(5, 12):
-                for col in quad['data_cols']:
-                    cell_ref = f"{col}{row}"
-                    val = ws[cell_ref].value
-                    try:
-                        float(val)
-                        has_data = True
-                        break
-                    except (ValueError, TypeError):
-                        pass
-                if has_data:
-                    break
-            
-            if not has_data:
+
+            if not np.isfinite(quad[:7]).any():
                 debug_info.append(f"    Skipped: No data in dilution rows")
                 continue
-            
-            if not virus or str(virus).strip() == '':
-                virus_str = 'Unlabelled'
+
+            virus_str = virus or 'Unlabelled'
+            if sample:
+                sample_str = sample
             else:
-                virus_str = str(virus).strip()
-            
-            if not sample or str(sample).strip() == '':
                 sample_str = f'Unlabelled{sample_counter}'
                 sample_counter += 1
-            else:
-                sample_str = str(sample).strip()
-            
+
             debug_info.append(f"    Processing as: Virus={virus_str}, Sample={sample_str}")
             debug_info.append(f"    NSC mean: {nsc_mean}")
-            
-            quad_data_count = 0
-            for i, row in enumerate(range(5, 12)):
-                rep_values = []
-                for col in quad['data_cols']:
-                    cell_ref = f"{col}{row}"
-                    val = ws[cell_ref].value
-                    try:
-                        rep_values.append(float(val))
-                    except (ValueError, TypeError):
-                        rep_values.append(None)
 
+            quad_data_count = 0
+            for i in range(7):
+                rep_values = [_opt(v) for v in quad[i]]
                 valid_values = [v for v in rep_values if v is not None]
                 if not valid_values:
                     continue
@@ -1101,9 +2033,9 @@ def generate_sigmoid_csv(excel_path_or_bytes, output_csv_path):
                         'Sample': sample_str,
                         'Dilution': dilutions[i],
                         'DilutionLog2': dilution_log2[i],
-                        'Rep1': rep_values[0] if len(rep_values) > 0 and rep_values[0] is not None else '',
-                        'Rep2': rep_values[1] if len(rep_values) > 1 and rep_values[1] is not None else '',
-                        'Rep3': rep_values[2] if len(rep_values) > 2 and rep_values[2] is not None else '',
+                        'Rep1': rep_values[0] if rep_values[0] is not None else '',
+                        'Rep2': rep_values[1] if rep_values[1] is not None else '',
+                        'Rep3': rep_values[2] if rep_values[2] is not None else '',
                         'Rep_Mean': round(triplicate_mean, 4),
                         'NSC_Mean': round(nsc_mean, 4),
                         'Neutralisation': round(neutralisation, 4)
@@ -1114,53 +2046,168 @@ def generate_sigmoid_csv(excel_path_or_bytes, output_csv_path):
 
     if all_rows:
         with open(output_csv_path, 'w', newline='') as csvfile:
-            fieldnames = ['Plate', 'Quadrant', 'Virus', 'Sample', 'Dilution', 'DilutionLog2', 'Rep1', 'Rep2', 'Rep3', 'Rep_Mean', 'NSC_Mean', 'Neutralisation']
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+            writer = csv.DictWriter(csvfile, fieldnames=SIGMOID_FIELDNAMES)
             writer.writeheader()
             writer.writerows(all_rows)
         logger.info("SIGMOID  CSV generated — %d data points", len(all_rows))
     else:
         debug_str = "\n".join(debug_info)
         raise ValueError(f"No valid data found in Plate sheets to generate sigmoid CSV.\n\nDebug info:\n{debug_str}")
-    
+
     return output_csv_path
 
 
+PLATE_DATA_FIELDNAMES = ['Plate', 'Quadrant', 'Row', 'Col', 'Dilution', 'Luminescence', 'Pseudotype', 'Sample_ID']
 
-def extract_nt50_titres_to_csv(excel_path, output_csv_path):
+
+def write_plate_data_csv(engine, output_csv_path):
     """
-    Directly reads the source values from Plate sheets (C21, F21, I21, L21)
-    and saves them to a CSV so R doesn't have to deal with Excel formulas.
+    Write plateData.csv, the long-format hand-off the R scripts read instead
+    of the workbook: one row per well B5:M12 of every plate (Row 1–8 =
+    sheet rows 5–12, Col 1–12 = B–M) with that row's A5:A12 dilution and the
+    well's quadrant labels.  Missing values are left empty.
     """
-    from openpyxl import load_workbook
-    import csv
+    def _num(val):
+        return _csv_num(val) if np.isfinite(val) else ''
+
+    with open(output_csv_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(PLATE_DATA_FIELDNAMES)
+        for plate_idx, sheet_name in enumerate(engine.names):
+            lum = engine.lum[plate_idx]
+            dilutions = engine.dilutions[plate_idx]
+            labels = engine.labels[plate_idx]
+            for r in range(8):
+                dilution = _num(dilutions[r])
+                for c in range(12):
+                    pt, sid = labels[c // 3]
+                    writer.writerow([sheet_name, f'Q{c // 3 + 1}', r + 1, c + 1,
+                                     dilution, _num(lum[r, c]), pt, sid])
+    return output_csv_path
+
+
+def shard_sigmoid_csv(sigmoid_csv_path, n_shards, shard_dir):
+    """
+    Split sigmoidData.csv into up to n_shards CSVs of whole plates, so each
+    can be fitted by its own fit_sigmoids.R process.  Plates stay in order and
+    each shard is a contiguous run of plates of roughly equal row count, so
+    concatenating the shards' IC50 CSVs reproduces the unsharded row order.
+
+    Returns the list of shard CSV paths (one path, the input, when there is
+    nothing to split).
+    """
+    with open(sigmoid_csv_path, newline='') as f:
+        reader = csv.DictReader(f)
+        fieldnames = reader.fieldnames
+        plates = {}
+        for row in reader:
+            plates.setdefault(row['Plate'], []).append(row)
+
+    n_shards = max(1, min(int(n_shards), len(plates)))
+    if n_shards == 1:
+        return [sigmoid_csv_path]
+
+    total = sum(len(rows) for rows in plates.values())
+    shards, current, current_rows = [], [], 0
+    for i, rows in enumerate(plates.values()):
+        current.extend(rows)
+        current_rows += len(rows)
+        plates_left = len(plates) - i - 1
+        shards_left = n_shards - len(shards) - 1
+        if shards_left and (current_rows >= total / n_shards or plates_left == shards_left):
+            shards.append(current)
+            current, current_rows = [], 0
+    if current:
+        shards.append(current)
+
+    os.makedirs(shard_dir, exist_ok=True)
+    paths = []
+    for k, rows in enumerate(shards):
+        path = os.path.join(shard_dir, f"sigmoidData_{k + 1}.csv")
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(rows)
+        paths.append(path)
+    return paths
+
+
+def merge_ic50_csvs(shard_csv_paths, output_csv_path):
+    """Concatenate per-shard IC50s CSVs (text-level, one header) in shard order."""
+    with open(output_csv_path, 'w', newline='') as out:
+        for k, path in enumerate(shard_csv_paths):
+            with open(path, newline='') as f:
+                lines = f.read().splitlines(keepends=True)
+            if lines and not lines[-1].endswith("\n"):
+                lines[-1] += "\n"
+            out.writelines(lines if k == 0 else lines[1:])
+    return output_csv_path
 
-    wb = load_workbook(excel_path, data_only=True)
-    
-    nt50_avg_cells = ["C21", "F21", "I21", "L21"]
-    pseudotype_cells = ["B3", "E3", "H3", "K3"]
-    sample_id_cells = ["B4", "E4", "H4", "K4"]
 
-    data_for_r = []
+# ════════════════════════════════════════════════════════════════
+# Sigmoid fitting — IC50s CSV helpers
+# ════════════════════════════════════════════════════════════════
+
+def _csv_num(val):
+    """Format a number the way readr::write_csv does for these columns (NA for missing)."""
+    if val is None or (isinstance(val, float) and math.isnan(val)):
+        return "NA"
+    val = float(val)
+    return str(int(val)) if val.is_integer() else repr(val)
+
 
-    for sheet_name in wb.sheetnames:
-        if not sheet_name.startswith("Plate"):
+def relabel_ic50_lod(ic50_csv_bytes, sigmoid_csv_path, include_lod):
+    """
+    Switch an IC50s CSV from fit_sigmoids.R between the two LOD modes
+    without re-fitting: LOD censoring only changes the IC50/Titre of rows
+    flagged outside LOD, which become the boundary dilution (include_lod)
+    or NA.  Every other row is kept byte-for-byte.
+    """
+    with open(sigmoid_csv_path, newline='') as f:
+        rows = list(csv.DictReader(f))
+    dilution_log2 = [float(row['DilutionLog2']) for row in rows]
+    dilutions = [float(row['Dilution']) for row in rows]
+    boundary = {
+        "<Lower LOD": (round(max(dilution_log2), 4), min(dilutions)),
+        ">Upper LOD": (round(min(dilution_log2), 4), max(dilutions)),
+    }
+
+    text = ic50_csv_bytes.decode("utf-8")
+    newline = "\r\n" if "\r\n" in text else "\n"
+    lines = text.splitlines()
+    header = next(csv.reader(lines[:1]))
+    ic50_col, titre_col, flag_col = (header.index(k) for k in ("IC50", "Titre", "LOD_Flag"))
+    out = StringIO()
+    out.write(lines[0] + newline)
+    writer = csv.writer(out, lineterminator=newline)
+    for line in lines[1:]:
+        row = next(csv.reader([line]))
+        if row[flag_col] not in boundary:
+            out.write(line + newline)
             continue
-        
-        ws = wb[sheet_name]
-        
-        for i in range(4):
-            pt_val = ws[pseudotype_cells[i]].value
-            if pt_val and str(pt_val).strip():
-                data_for_r.append({
-                    'Pseudotype': str(pt_val).strip(),
-                    'Sample_ID': str(ws[sample_id_cells[i]].value or "Unlabelled").strip(),
-                    'NT50': ws[nt50_avg_cells[i]].value
-                })
+        ic50, titre = boundary[row[flag_col]] if include_lod else (None, None)
+        row[ic50_col], row[titre_col] = _csv_num(ic50), _csv_num(titre)
+        writer.writerow(row)
+    return out.getvalue().encode("utf-8")
+
+
+def extract_nt50_titres_to_csv(excel_path, output_csv_path):
+    """
+    Compute the NT50 quadrant averages from the Plate sheets with the
+    TitreEngine and save them to a CSV so R doesn't have to deal with Excel
+    formulas (which openpyxl-written workbooks have no cached values for).
+    """
+    wb = load_workbook(excel_path, data_only=True)
+    engine = TitreEngine.from_workbook(wb)
+
+    data_for_r = [
+        {'Pseudotype': row['Pseudotype'], 'Sample_ID': row['Sample_ID'], 'NT50': row['NT50']}
+        for row in engine.titre_rows(thresholds=(50,))
+    ]
 
     with open(output_csv_path, 'w', newline='') as f:
         writer = csv.DictWriter(f, fieldnames=['Pseudotype', 'Sample_ID', 'NT50'])
         writer.writeheader()
         writer.writerows(data_for_r)
     
-    return output_csv_path
\ No newline at end of file
+    return output_csv_path
@@ -0,0 +1,404 @@
+"""
+Pool of warm, long-lived R worker processes.
+
+Each worker is one `Rscript r_worker.R` process that loads the R packages
+once and then runs jobs (script + arguments + working directory) sent over
+its stdin, so a job no longer pays for R start-up and library() calls.
+
+run_rscript() is the drop-in for
+    subprocess.run(["Rscript", script, *args], check=True, stdout=PIPE, stderr=PIPE, text=True)
+and transparently falls back to exactly that when the pool is disabled or a
+worker cannot be started.  Passing a threading.Event as `cancel` lets another
+thread abort the job: the R process running it is killed and RCancelled is
+raised.
+"""
+
+import atexit
+import itertools
+import logging
+import os
+import queue
+import select
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from urllib.parse import quote, unquote
+
+logger = logging.getLogger("ntaweb")
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "r_worker.R")
+
+STARTUP_TIMEOUT = 120     # seconds to load packages and print READY
+PING_TIMEOUT = 5          # seconds for a health-check reply
+PING_AFTER_IDLE = 60      # health-check a worker idle for longer than this
+CANCEL_POLL = 0.25        # seconds between checks of a job's cancel event
+
+
+class WorkerError(Exception):
+    """A worker died, timed out on start-up or broke the line protocol."""
+
+
+class RCancelled(Exception):
+    """The job's cancel event was set; its R process has been killed."""
+
+
+def _encode(fields):
+    return ("\t".join(quote(str(f), safe="") for f in fields) + "\n").encode("utf-8")
+
+
+def _decode(line):
+    return [unquote(f) for f in line.split("\t")]
+
+
+class RWorker:
+    """One warm Rscript process, driven synchronously by a single caller at a time."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self):
+        self.proc = subprocess.Popen(
+            ["Rscript", WORKER_SCRIPT],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=None,            # package warnings go to the server log
+            cwd=os.path.dirname(WORKER_SCRIPT),
+        )
+        self._fd = self.proc.stdout.fileno()
+        self._buf = b""
+        self.jobs = 0
+        self.last_used = time.time()
+        try:
+            reply = self._readline(STARTUP_TIMEOUT)
+        except (WorkerError, TimeoutError):
+            self.kill()
+            raise
+        if not reply or reply[0] != "READY":
+            self.kill()
+            raise WorkerError(f"unexpected start-up reply {reply!r}")
+        logger.info("R POOL   worker pid %s ready", reply[1] if len(reply) > 1 else "?")
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def _send(self, fields):
+        try:
+            self.proc.stdin.write(_encode(fields))
+            self.proc.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            raise WorkerError(f"worker stdin closed: {e}")
+
+    def _readline(self, timeout, cancel=None):
+        """
+        Next protocol line as decoded fields; WorkerError on EOF, TimeoutError
+        on timeout, RCancelled as soon as `cancel` is set.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while b"\n" not in self._buf:
+            wait = None if deadline is None else max(0.0, deadline - time.time())
+            if cancel is not None:
+                wait = CANCEL_POLL if wait is None else min(wait, CANCEL_POLL)
+            ready, _, _ = select.select([self._fd], [], [], wait)
+            if cancel is not None and cancel.is_set():
+                raise RCancelled()
+            if not ready:
+                if deadline is not None and time.time() >= deadline:
+                    raise TimeoutError
+                continue
+            chunk = os.read(self._fd, 65536)
+            if not chunk:
+                raise WorkerError(f"worker exited (status {self.proc.poll()})")
+            self._buf += chunk
+        line, _, self._buf = self._buf.partition(b"\n")
+        return _decode(line.decode("utf-8", "replace"))
+
+    def _expect(self, kind, job_id, timeout, cancel=None):
+        while True:
+            reply = self._readline(timeout, cancel)
+            if reply[0] == kind and len(reply) > 1 and reply[1] == job_id:
+                return reply
+
+    def ping(self):
+        job_id = f"ping{next(self._ids)}"
+        try:
+            self._send(["PING", job_id])
+            self._expect("PONG", job_id, PING_TIMEOUT)
+            return True
+        except (WorkerError, TimeoutError):
+            return False
+
+    def run(self, script, args, cwd, timeout=None, cancel=None):
+        """
+        Run one script; returns (status, stdout, stderr).
+        Raises WorkerError if the worker dies, and TimeoutError / RCancelled if
+        the job overruns `timeout` or is cancelled (the worker must then be
+        killed).
+        """
+        job_id = f"job{next(self._ids)}"
+        log_dir = tempfile.mkdtemp(prefix="rjob_")
+        out_log = os.path.join(log_dir, "stdout.txt")
+        err_log = os.path.join(log_dir, "stderr.txt")
+        try:
+            self._send(["RUN", job_id, cwd, out_log, err_log, script, *args])
+            reply = self._expect("DONE", job_id, timeout, cancel)
+            self.jobs += 1
+            self.last_used = time.time()
+
+            def _read(path):
+                try:
+                    with open(path, encoding="utf-8", errors="replace") as f:
+                        return f.read()
+                except OSError:
+                    return ""
+
+            stdout, stderr = _read(out_log), _read(err_log)
+            try:
+                status = int(reply[2])
+            except (IndexError, ValueError):
+                status = 1
+            if status and not stderr and len(reply) > 3:
+                stderr = reply[3]
+            return status, stdout, stderr
+        finally:
+            shutil.rmtree(log_dir, ignore_errors=True)
+
+    def stop(self):
+        if self.alive():
+            try:
+                self._send(["EXIT"])
+                self.proc.wait(timeout=5)
+            except (WorkerError, subprocess.TimeoutExpired):
+                pass
+        self.kill()
+
+    def kill(self):
+        if self.alive():
+            self.proc.kill()
+            try:
+                self.proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                pass
+        for stream in (self.proc.stdin, self.proc.stdout):
+            try:
+                stream.close()
+            except OSError:
+                pass
+
+
+class RWorkerPool:
+    """
+    Up to `size` warm workers, started on first use.  A worker that dies,
+    fails a health check or times out is discarded and replaced on demand;
+    one that has run `max_jobs` jobs is retired so leaked R state cannot
+    accumulate.  After `size` consecutive start-up failures the pool disables
+    itself and every call falls back to plain Rscript.
+    """
+
+    def __init__(self, size=2, max_jobs=50):
+        self.size = max(0, int(size))
+        self.max_jobs = max(1, int(max_jobs))
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._count = 0
+        self._start_failures = 0
+        self.disabled = self.size == 0 or os.name == "nt" or shutil.which("Rscript") is None
+        self.stats = {"jobs": 0, "fallbacks": 0, "started": 0, "restarted": 0, "recycled": 0}
+
+    @property
+    def available(self):
+        return not self.disabled
+
+    def _spawn(self):
+        try:
+            worker = RWorker()
+        except (WorkerError, TimeoutError, OSError) as e:
+            with self._lock:
+                self._count -= 1
+                self._start_failures += 1
+                if self._start_failures >= max(1, self.size):
+                    self.disabled = True
+                    logger.warning("R POOL   disabled after %d failed start(s); using plain Rscript",
+                                   self._start_failures)
+            logger.warning("R POOL   worker failed to start: %s", e)
+            return None
+        with self._lock:
+            self._start_failures = 0
+            self.stats["started"] += 1
+        return worker
+
+    def _acquire(self, cancel=None):
+        """An idle (or newly started) healthy worker, or None if the pool is unusable."""
+        while not self.disabled:
+            if cancel is not None and cancel.is_set():
+                raise RCancelled()
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    spawn = self._count < self.size
+                    if spawn:
+                        self._count += 1
+                if spawn:
+                    return self._spawn()
+                try:
+                    worker = self._idle.get(timeout=1)
+                except queue.Empty:
+                    continue
+            if worker.alive() and (time.time() - worker.last_used < PING_AFTER_IDLE or worker.ping()):
+                return worker
+            logger.warning("R POOL   worker pid %s failed health check; restarting", worker.proc.pid)
+            self._discard(worker, "restarted")
+        return None
+
+    def _release(self, worker):
+        if self.disabled:
+            worker.stop()
+            self._forget("recycled")
+        elif worker.jobs >= self.max_jobs:
+            logger.info("R POOL   recycling worker pid %s after %d job(s)", worker.proc.pid, worker.jobs)
+            worker.stop()
+            self._forget("recycled")
+        else:
+            self._idle.put(worker)
+
+    def _discard(self, worker, stat):
+        worker.kill()
+        self._forget(stat)
+
+    def _forget(self, stat):
+        with self._lock:
+            self._count -= 1
+            self.stats[stat] += 1
+
+    def run(self, cmd, cwd=None, timeout=None, cancel=None):
+        """
+        Run `cmd` (["Rscript", script, *args]) on a pool worker with the same
+        contract as subprocess.run(cmd, check=True, capture_output, text=True):
+        returns a CompletedProcess, raises CalledProcessError on a non-zero
+        status and TimeoutExpired on timeout.  Raises RCancelled once the
+        optional `cancel` event is set.
+        """
+        worker = self._acquire(cancel)
+        if worker is None:
+            return self._fallback(cmd, cwd, timeout, cancel)
+
+        script = os.path.abspath(cmd[1])
+        args = [str(a) for a in cmd[2:]]
+        try:
+            status, stdout, stderr = worker.run(
+                script, args, os.path.abspath(cwd or os.getcwd()), timeout, cancel)
+        except TimeoutError:
+            self._discard(worker, "restarted")
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        except RCancelled:
+            logger.info("R POOL   job cancelled; killing worker pid %s", worker.proc.pid)
+            self._discard(worker, "restarted")
+            raise
+        except WorkerError as e:
+            logger.warning("R POOL   worker pid %s died mid-job (%s); rerunning with Rscript",
+                           worker.proc.pid, e)
+            self._discard(worker, "restarted")
+            return self._fallback(cmd, cwd, timeout, cancel)
+
+        self._release(worker)
+        with self._lock:
+            self.stats["jobs"] += 1
+        if status:
+            raise subprocess.CalledProcessError(status, cmd, output=stdout, stderr=stderr)
+        return subprocess.CompletedProcess(cmd, 0, stdout=stdout, stderr=stderr)
+
+    def _fallback(self, cmd, cwd, timeout, cancel=None):
+        with self._lock:
+            self.stats["fallbacks"] += 1
+        if cancel is None:
+            return subprocess.run(
+                cmd,
+                check=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                cwd=cwd,
+                timeout=timeout,
+            )
+
+        # Same as above, but polled so a cancel can kill the process
+        deadline = None if timeout is None else time.time() + timeout
+        with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                              text=True, cwd=cwd) as proc:
+            while True:
+                try:
+                    stdout, stderr = proc.communicate(timeout=CANCEL_POLL)
+                    break
+                except subprocess.TimeoutExpired:
+                    if cancel.is_set():
+                        proc.kill()
+                        proc.communicate()
+                        raise RCancelled()
+                    if deadline is not None and time.time() >= deadline:
+                        proc.kill()
+                        proc.communicate()
+                        raise subprocess.TimeoutExpired(cmd, timeout)
+        if proc.returncode:
+            raise subprocess.CalledProcessError(proc.returncode, cmd, output=stdout, stderr=stderr)
+        return subprocess.CompletedProcess(cmd, 0, stdout=stdout, stderr=stderr)
+
+    def warm(self):
+        """Start workers up to `size` in the background so the first jobs find them ready."""
+        def _start():
+            while not self.disabled:
+                with self._lock:
+                    if self._count >= self.size:
+                        return
+                    self._count += 1
+                worker = self._spawn()
+                if worker is None:
+                    continue
+                self._idle.put(worker)
+
+        if self.available:
+            threading.Thread(target=_start, daemon=True).start()
+
+    def shutdown(self):
+        self.disabled = True
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            worker.stop()
+            self._forget("recycled")
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def configure_r_pool(size, max_jobs, warm=False):
+    """(Re)create the shared pool; idle workers of a replaced pool are stopped."""
+    global _pool
+    with _pool_lock:
+        old = None
+        if _pool is None or (_pool.size, _pool.max_jobs) != (size, max_jobs):
+            old, _pool = _pool, RWorkerPool(size, max_jobs)
+    if old is not None:
+        old.shutdown()
+    if warm:
+        _pool.warm()
+    return _pool
+
+
+def get_r_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = RWorkerPool()
+        return _pool
+
+
+def run_rscript(cmd, cwd=None, timeout=None, cancel=None):
+    """subprocess.run(["Rscript", ...], check=True, ...) routed through the warm pool."""
+    return get_r_pool().run(cmd, cwd=cwd, timeout=timeout, cancel=cancel)
+
+
+atexit.register(lambda: _pool is not None and _pool.shutdown())
@@ -59,7 +59,7 @@ sudo chown -R ubuntu:ubuntu /var/www/ntaweb
 
 python3 -m venv /var/www/ntaweb/venv
 /var/www/ntaweb/venv/bin/pip install --upgrade pip -q
-/var/www/ntaweb/venv/bin/pip install flask openpyxl pillow gunicorn -q
+/var/www/ntaweb/venv/bin/pip install flask openpyxl pillow gunicorn numpy -q
 
 # ── 6. Open OS firewall ports ──
 echo "[6/9] Opening firewall ports 80 and 443..."
@@ -106,8 +106,10 @@ User=ubuntu
 Group=ubuntu
 WorkingDirectory=/var/www/ntaweb/app
 Environment="PATH=/var/www/ntaweb/venv/bin"
+Environment="NTAWEB_STORE=sqlite"
 ExecStart=/var/www/ntaweb/venv/bin/gunicorn \
     --workers 2 \
+    --threads 8 \
     --bind 127.0.0.1:8000 \
     --timeout 300 \
     --keep-alive 5 \
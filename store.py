@@ -0,0 +1,634 @@
+"""
+Bounded store for per-run results: processed workbooks (keyed by file_id)
+and the fitting / comparison outputs derived from them.
+
+ResultStore is used like the dict it replaces (get, [], in, pop), but
+accounts for the bytes each entry holds and evicts least-recently-used
+entries once a memory budget is exceeded, as well as entries not used for
+`ttl_hours`.  A run and its derived entries form a family — every entry
+whose "excel_file_id" names the run (fittings, comparisons, plate plots,
+upload dedup keys), plus those its "fitting_id" / "comparison_id" point to.
+Using any member keeps the run in use; members are only evicted together
+with their run.  Entries without a run (staged uploads, jobs, batches) live
+on their own.  An entry with an "expires" time (a staged upload) is dropped
+by the first sweep after it, whatever the TTL.
+Keys that have gone are remembered for a while so routes can tell the user
+their results expired rather than "not found".
+
+SQLiteStore offers the same interface backed by a SQLite file, so several
+server processes share one set of results and they outlive a restart;
+open_store() picks the backend.  With either, changes to a stored entry must
+go through update() — with a shared store, get() returns a copy.
+"""
+
+import logging
+import os
+import pickle
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+logger = logging.getLogger("ntaweb")
+
+CHILD_FIELDS = ("fitting_id", "comparison_id")
+PARENT_FIELD = "excel_file_id"
+EXPIRES_FIELD = "expires"
+SWEEP_INTERVAL = 30    # seconds between TTL / size sweeps triggered by reads
+GONE_KEEP = 1000       # evicted keys remembered for gone_reason()
+
+
+def sizeof(value):
+    """Approximate bytes held by a stored value: blobs, containers, arrays, nta_utils.Run."""
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(sizeof(v) for v in value.values())
+    if isinstance(value, (list, tuple, set)):
+        return sum(sizeof(v) for v in value)
+    nbytes = getattr(value, "nbytes", None)
+    if nbytes is not None and not callable(nbytes):
+        return int(nbytes)
+    return sys.getsizeof(value)
+
+
+class ResultStore:
+    """
+    Dict-like store of result entries (each a dict) with byte accounting,
+    LRU eviction past `budget_mb` and expiry after `ttl_hours` unused
+    (0 disables either limit).  Evicting a run also evicts the entries
+    derived from it; entries in use by a job are protected with hold().
+    """
+
+    shared = False   # entries live in this process only
+
+    def __init__(self, budget_mb=256, ttl_hours=6):
+        self._lock = threading.RLock()
+        self._entries = OrderedDict()   # key -> entry, least recently used first
+        self._used = {}                 # key -> time of last access
+        self._sizes = {}                # key -> bytes when last written
+        self._total = 0                 # sum of _sizes
+        self._dependants = {}           # run key -> keys whose PARENT_FIELD names it
+        self._expires = {}              # key -> its EXPIRES_FIELD time, for entries with one
+        self._held = {}                 # key -> hold count
+        self._gone = OrderedDict()      # key -> "expired" / "evicted"
+        self._last_sweep = time.time()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = {"expired": 0, "evicted": 0}
+        self.configure(budget_mb, ttl_hours)
+
+    def configure(self, budget_mb, ttl_hours):
+        """Set the memory budget (MB) and idle lifetime (hours), evicting straight away if now over."""
+        with self._lock:
+            self.budget = int(float(budget_mb) * 1024 * 1024) if budget_mb else 0
+            self.ttl = float(ttl_hours) * 3600 if ttl_hours else 0
+            self._sweep()
+
+    # ── dict interface ─────────────────────────────────────────────
+
+    def get(self, key, default=None):
+        with self._lock:
+            self._maybe_sweep()
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._touch(key)
+            return entry
+
+    def __getitem__(self, key):
+        entry = self.get(key)
+        if entry is None:
+            raise KeyError(key)
+        return entry
+
+    def __contains__(self, key):
+        with self._lock:
+            self._maybe_sweep()
+            if key in self._entries:
+                return True
+            self.misses += 1
+            return False
+
+    def __setitem__(self, key, entry):
+        with self._lock:
+            old = self._entries.get(key)
+            self._entries[key] = entry
+            self._gone.pop(key, None)
+            self._written(key, old, entry)
+            self._touch(key)
+            self._sweep(protect=key)
+
+    def update(self, key, fields, drop=(), create=False):
+        """
+        Set `fields` on (and remove `drop` from) the stored entry for key and
+        return it; None if there is no such entry, unless `create`.  Stores
+        that are not plain memory only see changes made through here.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                if not create:
+                    return None
+                self[key] = entry = {}
+            old_parent = entry.get(PARENT_FIELD)
+            entry.update(fields)
+            for field in drop:
+                entry.pop(field, None)
+            self._written(key, {PARENT_FIELD: old_parent}, entry)
+            self._touch(key)
+            self._sweep(protect=key)
+            return entry
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return default
+            self._forget(key, entry)
+            return entry
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries)
+
+    def items(self):
+        with self._lock:
+            return list(self._entries.items())
+
+    # ── lifetime ───────────────────────────────────────────────────
+
+    @contextmanager
+    def hold(self, *keys):
+        """Keep these entries (and any run linking to them) from being evicted inside the block."""
+        with self._lock:
+            for key in keys:
+                self._held[key] = self._held.get(key, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                for key in keys:
+                    if self._held.get(key, 0) <= 1:
+                        self._held.pop(key, None)
+                    else:
+                        self._held[key] -= 1
+
+    def gone_reason(self, key):
+        """Why key is no longer stored ("expired" or "evicted"), or None if it never was."""
+        with self._lock:
+            return self._gone.get(key)
+
+    def sweep(self):
+        """Re-measure every entry and apply the TTL and budget."""
+        with self._lock:
+            self._sweep(remeasure=True)
+
+    def stats(self):
+        with self._lock:
+            total = self._total
+            return {
+                "backend": "memory",
+                "entries": len(self._entries),
+                "bytes": total,
+                "budget_bytes": self.budget,
+                "ttl_hours": round(self.ttl / 3600, 2),
+                "held": len(self._held),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / max(1, self.hits + self.misses), 3),
+                **{f"{reason}_entries": n for reason, n in self.evictions.items()},
+            }
+
+    # ── internals (call with the lock held) ────────────────────────
+
+    def _written(self, key, old, entry):
+        """Re-measure a just written entry and file it under its run (old: the entry it replaced)."""
+        size = sizeof(entry)
+        self._total += size - self._sizes.get(key, 0)
+        self._sizes[key] = size
+        old_parent = (old or {}).get(PARENT_FIELD)
+        parent = entry.get(PARENT_FIELD)
+        if old_parent != parent:
+            self._dependants.get(old_parent, set()).discard(key)
+        if parent:
+            self._dependants.setdefault(parent, set()).add(key)
+        if entry.get(EXPIRES_FIELD):
+            self._expires[key] = entry[EXPIRES_FIELD]
+        else:
+            self._expires.pop(key, None)
+
+    def _forget(self, key, entry):
+        """Bookkeeping of an entry that has just left _entries."""
+        self._used.pop(key, None)
+        self._expires.pop(key, None)
+        self._total -= self._sizes.pop(key, 0)
+        self._dependants.get(entry.get(PARENT_FIELD), set()).discard(key)
+
+    def _parent(self, key):
+        """The stored run key belongs to, or None if it is a run (or its run is gone)."""
+        parent = self._entries.get(key, {}).get(PARENT_FIELD)
+        return parent if parent in self._entries and parent != key else None
+
+    def _derived(self, key):
+        """key followed by its dependants and the entries it links to through CHILD_FIELDS."""
+        family = [key]
+        links = [self._entries.get(key, {}).get(field) for field in CHILD_FIELDS]
+        for member in [*self._dependants.get(key, ()), *links]:
+            if member in self._entries and member not in family:
+                family.append(member)
+        return family
+
+    def _touch(self, key):
+        """Mark key and its run as just used (the run's age stands for the family's)."""
+        now = time.time()
+        for member in (key, self._parent(key)):
+            if member is not None:
+                self._used[member] = now
+                self._entries.move_to_end(member)
+
+    def _maybe_sweep(self):
+        if time.time() - self._last_sweep >= SWEEP_INTERVAL:
+            self._sweep(remeasure=True)
+
+    def _sweep(self, protect=None, remeasure=False):
+        """
+        Drop entries past their EXPIRES_FIELD time, then apply the TTL and
+        budget to runs and entries without one (dependants go with their
+        run).  Writes keep sizes current; `remeasure` also re-measures every
+        entry, which is O(entries) and so only done on the periodic sweep.
+        """
+        now = time.time()
+        self._last_sweep = now
+        if remeasure:
+            for key, entry in self._entries.items():
+                self._sizes[key] = sizeof(entry)
+            self._total = sum(self._sizes.values())
+
+        for key in [k for k, t in self._expires.items() if t < now]:
+            self._evict(key, "expired", protect)
+
+        if self.ttl:
+            for key in [k for k, t in self._used.items() if now - t > self.ttl]:
+                if key in self._entries and self._parent(key) is None:
+                    self._evict(key, "expired", protect)
+
+        if self.budget and self._total > self.budget:
+            for key in list(self._entries):
+                if self._total <= self.budget:
+                    break
+                if key in self._entries and self._parent(key) is None:
+                    self._evict(key, "evicted", protect)
+
+    def _evict(self, key, reason, protect=None):
+        """Drop key and its derived entries unless any is protected or held; returns bytes freed."""
+        family = self._derived(key)
+        if protect in family or any(member in self._held for member in family):
+            return 0
+        freed = 0
+        for member in family:
+            entry = self._entries.pop(member, None)
+            if entry is None:
+                continue
+            freed += self._sizes.get(member, 0)
+            self._forget(member, entry)
+            self._gone[member] = reason
+            self.evictions[reason] += 1
+        self._dependants.pop(key, None)
+        while len(self._gone) > GONE_KEEP:
+            self._gone.popitem(last=False)
+        logger.info("STORE    %s %s (%d entr%s, %.1f KB)", reason, key[:8], len(family),
+                    "y" if len(family) == 1 else "ies", freed / 1024)
+        return freed
+
+
+class SQLiteStore:
+    """
+    ResultStore with the same interface, kept in a SQLite database so every
+    server process (gunicorn worker) sees the same runs and they survive a
+    restart.  Entries are pickled; their size is the pickled size.  Each
+    process keeps its last few reads decoded, re-reading an entry only when
+    another write has bumped its version.
+    """
+
+    shared = True
+    CACHE_ENTRIES = 8
+    TOUCH_EVERY = 60      # seconds between writes of an entry's last-used time
+    HOLD_MAX = 4 * 3600   # holds older than this are from a process that died
+    # Runs and entries without one; dependants are only evicted with their run
+    ROOT = "(parent IS NULL OR parent NOT IN (SELECT key FROM entries))"
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS entries (
+            key      TEXT PRIMARY KEY,
+            value    BLOB NOT NULL,
+            size     INTEGER NOT NULL,
+            parent   TEXT,
+            children TEXT NOT NULL DEFAULT '',
+            used     REAL NOT NULL,
+            version  INTEGER NOT NULL DEFAULT 1,
+            expires  REAL
+        );
+        CREATE INDEX IF NOT EXISTS entries_used ON entries (used);
+        CREATE INDEX IF NOT EXISTS entries_parent ON entries (parent);
+        CREATE TABLE IF NOT EXISTS gone (
+            key    TEXT PRIMARY KEY,
+            reason TEXT NOT NULL,
+            at     REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS holds (
+            token TEXT PRIMARY KEY,
+            key   TEXT NOT NULL,
+            at    REAL NOT NULL
+        );
+    """
+
+    def __init__(self, path, budget_mb=256, ttl_hours=6):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()      # guards the read cache and counters
+        self._cache = OrderedDict()        # key -> (version, entry)
+        self._touched = {}                 # key -> time this process last wrote `used`
+        self._last_sweep = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = {"expired": 0, "evicted": 0}
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._db().executescript(self.SCHEMA)
+        self._migrate()
+        self.configure(budget_mb, ttl_hours)
+
+    def configure(self, budget_mb, ttl_hours):
+        """Set the budget (MB of pickled entries) and idle lifetime (hours), then sweep."""
+        self.budget = int(float(budget_mb) * 1024 * 1024) if budget_mb else 0
+        self.ttl = float(ttl_hours) * 3600 if ttl_hours else 0
+        self.sweep()
+
+    # ── dict interface ─────────────────────────────────────────────
+
+    def get(self, key, default=None):
+        if not key:
+            return default
+        self._maybe_sweep()
+        db = self._db()
+        row = db.execute("SELECT version, parent FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            with self._lock:
+                self.misses += 1
+                self._cache.pop(key, None)
+            return default
+        version = row[0]
+        with self._lock:
+            self.hits += 1
+            cached = self._cache.get(key)
+            if cached is not None and cached[0] == version:
+                self._cache.move_to_end(key)
+                entry = cached[1]
+            else:
+                entry = None
+        if entry is None:
+            blob = db.execute("SELECT value, version FROM entries WHERE key = ?", (key,)).fetchone()
+            if blob is None:
+                return default
+            entry = pickle.loads(blob[0])
+            self._remember(key, blob[1], entry)
+        self._touch(key, row[1])
+        return entry
+
+    def __getitem__(self, key):
+        entry = self.get(key)
+        if entry is None:
+            raise KeyError(key)
+        return entry
+
+    def __contains__(self, key):
+        if not key:
+            return False
+        self._maybe_sweep()
+        found = self._db().execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone() is not None
+        if not found:
+            with self._lock:
+                self.misses += 1
+        return found
+
+    def __setitem__(self, key, entry):
+        with self._write() as db:
+            version = self._put(db, key, entry)
+            db.execute("DELETE FROM gone WHERE key = ?", (key,))
+        self._remember(key, version, entry)
+        self.sweep(protect=key)
+
+    def update(self, key, fields, drop=(), create=False):
+        """Read-modify-write of one entry, atomic across processes; see ResultStore.update."""
+        with self._write() as db:
+            row = db.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None and not create:
+                return None
+            entry = pickle.loads(row[0]) if row is not None else {}
+            entry.update(fields)
+            for field in drop:
+                entry.pop(field, None)
+            version = self._put(db, key, entry)
+        self._remember(key, version, entry)
+        self.sweep(protect=key)
+        return entry
+
+    def pop(self, key, default=None):
+        entry = self.get(key)
+        with self._write() as db:
+            db.execute("DELETE FROM entries WHERE key = ?", (key,))
+        with self._lock:
+            self._cache.pop(key, None)
+        return default if entry is None else entry
+
+    def __len__(self):
+        return self._db().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return [k for (k,) in self._db().execute("SELECT key FROM entries ORDER BY used")]
+
+    def items(self):
+        return [(k, e) for k, e in ((k, self.get(k)) for k in self.keys()) if e is not None]
+
+    # ── lifetime ───────────────────────────────────────────────────
+
+    @contextmanager
+    def hold(self, *keys):
+        """Keep these entries (and any run linking to them) from being evicted inside the block."""
+        tokens = [(uuid.uuid4().hex, key) for key in keys if key]
+        with self._write() as db:
+            db.executemany("INSERT INTO holds (token, key, at) VALUES (?, ?, ?)",
+                           [(token, key, time.time()) for token, key in tokens])
+        try:
+            yield
+        finally:
+            with self._write() as db:
+                db.executemany("DELETE FROM holds WHERE token = ?", [(token,) for token, _ in tokens])
+
+    def gone_reason(self, key):
+        """Why key is no longer stored ("expired" or "evicted"), or None if it never was."""
+        if not key:
+            return None
+        row = self._db().execute("SELECT reason FROM gone WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def sweep(self, protect=None):
+        """
+        Drop entries past their EXPIRES_FIELD time, then apply the TTL and
+        budget across all processes' entries.
+        """
+        now = time.time()
+        self._last_sweep = now
+        with self._write() as db:
+            held = {k for (k,) in db.execute("SELECT key FROM holds WHERE at > ?", (now - self.HOLD_MAX,))}
+            if protect:
+                held.add(protect)
+            for (key,) in db.execute("SELECT key FROM entries WHERE expires < ?", (now,)).fetchall():
+                self._evict(db, key, "expired", held)
+            if self.ttl:
+                stale = db.execute(f"SELECT key FROM entries WHERE used < ? AND {self.ROOT}",
+                                   (now - self.ttl,)).fetchall()
+                for (key,) in stale:
+                    self._evict(db, key, "expired", held)
+            if self.budget:
+                total = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+                if total > self.budget:
+                    for (key,) in db.execute(f"SELECT key FROM entries WHERE {self.ROOT} ORDER BY used").fetchall():
+                        if total <= self.budget:
+                            break
+                        total -= self._evict(db, key, "evicted", held)
+            db.execute("DELETE FROM gone WHERE key NOT IN "
+                       "(SELECT key FROM gone ORDER BY at DESC LIMIT ?)", (GONE_KEEP,))
+
+    def stats(self):
+        db = self._db()
+        entries, total = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        held = db.execute("SELECT COUNT(DISTINCT key) FROM holds WHERE at > ?",
+                          (time.time() - self.HOLD_MAX,)).fetchone()[0]
+        with self._lock:
+            return {
+                "backend": "sqlite",
+                "entries": entries,
+                "bytes": total,
+                "budget_bytes": self.budget,
+                "ttl_hours": round(self.ttl / 3600, 2),
+                "held": held,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / max(1, self.hits + self.misses), 3),
+                **{f"{reason}_entries": n for reason, n in self.evictions.items()},
+            }
+
+    # ── internals ──────────────────────────────────────────────────
+
+    def _db(self):
+        """This thread's connection (WAL, so readers don't block the writer)."""
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def _migrate(self):
+        """Bring a database written by an older version up to SCHEMA."""
+        with self._write() as db:
+            columns = {row[1] for row in db.execute("PRAGMA table_info(entries)")}
+            if "expires" not in columns:
+                db.execute("ALTER TABLE entries ADD COLUMN expires REAL")
+            db.execute("CREATE INDEX IF NOT EXISTS entries_expires ON entries (expires)")
+
+    @contextmanager
+    def _write(self):
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def _put(self, db, key, entry):
+        blob = pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL)
+        children = " ".join(str(entry[f]) for f in CHILD_FIELDS if entry.get(f))
+        row = db.execute("SELECT version FROM entries WHERE key = ?", (key,)).fetchone()
+        version = row[0] + 1 if row else 1
+        db.execute(
+            "INSERT OR REPLACE INTO entries (key, value, size, parent, children, used, version, expires) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, blob, len(blob), entry.get(PARENT_FIELD), children, time.time(), version,
+             entry.get(EXPIRES_FIELD)),
+        )
+        return version
+
+    def _remember(self, key, version, entry):
+        with self._lock:
+            self._cache[key] = (version, entry)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.CACHE_ENTRIES:
+                self._cache.popitem(last=False)
+
+    def _touch(self, key, parent):
+        """Write the last-used time of key and its run, at most every TOUCH_EVERY seconds."""
+        now = time.time()
+        if now - self._touched.get(key, 0) < self.TOUCH_EVERY:
+            return
+        if len(self._touched) > GONE_KEEP:
+            self._touched.clear()
+        self._touched[key] = now
+        with self._write() as db:
+            db.execute("UPDATE entries SET used = ? WHERE key IN (?, ?)", (now, key, parent or key))
+
+    def _maybe_sweep(self):
+        if time.time() - self._last_sweep >= SWEEP_INTERVAL:
+            self.sweep()
+
+    def _evict(self, db, key, reason, held):
+        """Delete key, its dependants and linked entries unless any is held; returns bytes freed."""
+        row = db.execute("SELECT children FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return 0
+        dependants = [k for (k,) in db.execute("SELECT key FROM entries WHERE parent = ?", (key,))]
+        family = [key] + [k for k in dict.fromkeys(row[0].split() + dependants) if k != key]
+        if any(member in held for member in family):
+            return 0
+        marks = ",".join("?" * len(family))
+        freed = db.execute(f"SELECT COALESCE(SUM(size), 0), COUNT(*) FROM entries WHERE key IN ({marks})",
+                           family).fetchone()
+        db.execute(f"DELETE FROM entries WHERE key IN ({marks})", family)
+        now = time.time()
+        db.executemany("INSERT OR REPLACE INTO gone (key, reason, at) VALUES (?, ?, ?)",
+                       [(member, reason, now) for member in family])
+        with self._lock:
+            self.evictions[reason] += freed[1]
+            for member in family:
+                self._cache.pop(member, None)
+        logger.info("STORE    %s %s (%d entr%s, %.1f KB)", reason, key[:8], freed[1],
+                    "y" if freed[1] == 1 else "ies", freed[0] / 1024)
+        return freed[0]
+
+
+def open_store(backend="memory", path=None, budget_mb=256, ttl_hours=6):
+    """The result store for `backend`: "memory" (this process only) or "sqlite" (file at `path`)."""
+    if backend == "sqlite":
+        return SQLiteStore(path, budget_mb=budget_mb, ttl_hours=ttl_hours)
+    if backend != "memory":
+        logger.warning("STORE    unknown backend %r, keeping results in memory", backend)
+    return ResultStore(budget_mb=budget_mb, ttl_hours=ttl_hours)